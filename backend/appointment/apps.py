@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class AppointmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'appointment'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+        from doctor.models import DoctorProfile
+        from . import changes, counters
+        from .models import Appointment, Prescription, record_appointment_deletion
+
+        post_save.connect(counters.doctor_created, sender=DoctorProfile, dispatch_uid='overview-doctor-created')
+        post_delete.connect(counters.doctor_deleted, sender=DoctorProfile, dispatch_uid='overview-doctor-deleted')
+        post_migrate.connect(counters.reconcile_after_migrate, sender=self, dispatch_uid='overview-reconcile-after-migrate')
+        pre_delete.connect(record_appointment_deletion, sender=Appointment, dispatch_uid='rollup-appointment-deleted')
+        post_delete.connect(changes.record_deletion, sender=Appointment, dispatch_uid='changes-appointment-deleted')
+        post_delete.connect(changes.record_deletion, sender=Prescription, dispatch_uid='changes-prescription-deleted')
@@ -0,0 +1,93 @@
+"""Slot availability engine for doctors.
+
+Availability is read from the ``DoctorSlot`` rows materialized from each
+doctor's ``WeeklyScheduleBlock`` rows (see ``doctor.schedule``). Leave and
+holidays have already been applied when the rows were built, so a slot is
+free when its row exists and no live appointment takes it.
+"""
+import datetime
+import itertools
+
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from doctor import schedule as doctor_schedule
+from doctor.models import DoctorSlot
+
+# Maximum number of days a single availability request may cover
+MAX_RANGE_DAYS = 42
+
+_TIME_FORMATS = ("%H:%M:%S", "%H:%M", "%I:%M %p", "%I:%M%p")
+
+
+def parse_time_str(value):
+    """Parse a time string such as '09:00', '9:00 AM' or '09:00:00'."""
+    if not value:
+        return None
+    if isinstance(value, datetime.time):
+        return value
+    value = str(value).strip()
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    # As a last resort, try trimming seconds and parsing
+    try:
+        parts = value.split(':')
+        if len(parts) >= 2:
+            return datetime.time(hour=int(parts[0]), minute=int(parts[1][:2]))
+    except (ValueError, TypeError):
+        pass
+    return None
+
+
+def free_slots(doctor, start, end, now=None):
+    """Return ``[(date, [time, ...]), ...]`` of free slots between start and end.
+
+    One query reads the doctor's slot rows with a flag for whether each is
+    booked. Every day the doctor has slots on is listed, even when they are
+    all taken. Slots on the current day that have already started are
+    omitted.
+    """
+    now = timezone.localtime(now) if now else timezone.localtime()
+    today, current_time = now.date(), now.time()
+
+    rows = (
+        DoctorSlot.objects.filter(doctor=doctor, date__range=(max(start, today), end))
+        .annotate(booked=doctor_schedule.booked())
+        .order_by('date', 'start_time')
+        .values_list('date', 'start_time', 'booked')
+    )
+    return [
+        (day, [t for _, t, booked in group if not booked and not (day == today and t <= current_time)])
+        for day, group in itertools.groupby(rows, key=lambda row: row[0])
+    ]
+
+
+def earliest_free_slots(doctors, start, end, limit, now=None):
+    """Return the first ``limit`` free ``(date, time, doctor)`` slots across ``doctors``.
+
+    ``doctors`` may be a ``DoctorProfile`` queryset, which is used as a
+    subquery, or an iterable of profiles. A single query returns the free
+    ``DoctorSlot`` rows ordered by ``(date, start_time, doctor)`` with a
+    LIMIT, served by the ``doctor_slot_when_idx`` index, together with the
+    doctor and user rows.
+    """
+    if isinstance(doctors, QuerySet):
+        doctor_ids = doctors.values('pk')
+    else:
+        doctor_ids = [doctor.pk for doctor in doctors]
+        if not doctor_ids:
+            return []
+
+    now = timezone.localtime(now) if now else timezone.localtime()
+    today, current_time = now.date(), now.time()
+    free = (
+        DoctorSlot.objects.filter(doctor__in=doctor_ids, date__range=(max(start, today), end))
+        .exclude(date=today, start_time__lte=current_time)
+        .exclude(doctor_schedule.booked())
+        .select_related('doctor__user')
+        .order_by('date', 'start_time', 'doctor_id')
+    )
+    return [(slot.date, slot.start_time, slot.doctor) for slot in free[:limit]]
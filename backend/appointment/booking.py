@@ -0,0 +1,121 @@
+"""Slot holds and booking guards.
+
+Only slots that exist in the doctor's schedule can be held or booked; see
+``is_offered``. Double booking is prevented by the
+``unique_active_doctor_slot`` constraint on ``Appointment``: callers simply
+insert and translate ``IntegrityError`` into a conflict response. Holds give a patient a short window (e.g. while
+paying) in which nobody else can book the same slot.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from doctor import schedule as doctor_schedule
+
+from .models import Appointment, SlotHold
+
+
+class SlotUnavailable(Exception):
+    """Raised when a slot is booked or held by another patient."""
+
+
+def hold_ttl():
+    return datetime.timedelta(seconds=int(getattr(settings, 'SLOT_HOLD_TTL_SECONDS', 600)))
+
+
+def is_offered(doctor, appointment_date, appointment_time):
+    """True when the doctor's schedule has a slot starting then, today or later.
+
+    See ``doctor.schedule.offers``: materialized ``DoctorSlot`` rows, with a
+    fallback to the schedule itself for dates not materialized yet. Whether
+    the slot is taken is not checked here.
+    """
+    if appointment_date < timezone.localdate():
+        return False
+    return doctor_schedule.offers(doctor, appointment_date, appointment_time)
+
+
+def place_hold(doctor, appointment_date, appointment_time, patient):
+    """Hold a slot for ``patient`` and return the new ``SlotHold``.
+
+    Any expired hold on the slot, or an earlier hold by the same patient, is
+    replaced. Raises ``SlotUnavailable`` if the slot is already booked or
+    held by someone else.
+    """
+    now = timezone.now()
+    slot = {'doctor': doctor, 'appointment_date': appointment_date, 'appointment_time': appointment_time}
+
+    if Appointment.objects.filter(**slot).exclude(status='cancelled').exists():
+        raise SlotUnavailable('Selected time slot is already booked.')
+
+    try:
+        with transaction.atomic():
+            SlotHold.objects.filter(**slot).filter(Q(expires_at__lte=now) | Q(patient=patient)).delete()
+            return SlotHold.objects.create(patient=patient, expires_at=now + hold_ttl(), **slot)
+    except IntegrityError:
+        raise SlotUnavailable('Selected time slot is currently held by another patient.')
+
+
+def release_hold(token, patient):
+    """Release a hold owned by ``patient``. Returns True if one was removed."""
+    deleted, _ = SlotHold.objects.filter(token=token, patient=patient).delete()
+    return deleted > 0
+
+
+def claim_slot(doctor, appointment_date, appointment_time, patient):
+    """Take the slot's hold, if any, as part of booking it.
+
+    Must run inside the booking transaction. One ``DELETE ... RETURNING``
+    removes whatever hold the slot has; if that was another patient's live
+    hold, ``SlotUnavailable`` is raised and the caller's transaction rolls
+    the delete back. Whether the slot is already booked is left to the
+    appointment unique constraint.
+    """
+    def prep(field, value):
+        return SlotHold._meta.get_field(field).get_db_prep_value(value, connection)
+
+    table = connection.ops.quote_name(SlotHold._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE doctor_id = %s AND appointment_date = %s AND appointment_time = %s '
+            'RETURNING patient_id, CASE WHEN expires_at > %s THEN 1 ELSE 0 END',
+            [
+                doctor.pk, prep('appointment_date', appointment_date),
+                prep('appointment_time', appointment_time), prep('expires_at', timezone.now()),
+            ],
+        )
+        removed = cursor.fetchall()
+    if any(live and patient_id != patient.pk for patient_id, live in removed):
+        raise SlotUnavailable('Selected time slot is currently held by another patient.')
+
+
+def cancel_duplicate_bookings(dry_run=False):
+    """Cancel all but one live appointment per doctor slot.
+
+    Needed once on databases that predate ``unique_active_doctor_slot``,
+    which can not be applied while duplicates exist. The appointment kept is
+    the completed, then confirmed, then paid one, then the earliest booked.
+    Cancellations go through ``save()`` so stats, counters and the change
+    feed see them. Returns the cancelled appointments.
+    """
+    active = Appointment.objects.exclude(status='cancelled')
+    slots = (
+        active.values('doctor', 'appointment_date', 'appointment_time')
+        .annotate(n=Count('id')).filter(n__gt=1).order_by()
+    )
+    rank = {'completed': 0, 'confirmed': 1, 'pending': 2}
+    cancelled = []
+    for slot in slots:
+        booked = list(active.filter(
+            doctor=slot['doctor'], appointment_date=slot['appointment_date'], appointment_time=slot['appointment_time'],
+        ))
+        booked.sort(key=lambda a: (rank.get(a.status, 3), not a.payment_status, a.created_at, a.pk))
+        for appointment in booked[1:]:
+            if not dry_run:
+                appointment.status = 'cancelled'
+                appointment.save(update_fields=['status', 'updated_at'])
+            cancelled.append(appointment)
+    return cancelled
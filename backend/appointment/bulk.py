@@ -0,0 +1,190 @@
+"""Bulk operations over a doctor's appointments for a date range.
+
+Used when a doctor is unavailable: every open (pending or confirmed)
+appointment in the range is cancelled or moved in one transaction with a
+single ``bulk_update``. The stats rollup and overview counters are updated
+through ``record_appointment_changes`` because ``bulk_update`` bypasses
+``Appointment.save()``. Patient notifications go through the email outbox,
+so they are sent after commit by ``manage.py send_outbox``.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from core import outbox
+from doctor.models import DoctorSlot
+
+from . import changes, rollups
+from .models import Appointment, SlotHold, record_appointment_changes
+
+OPEN_STATUSES = ('pending', 'confirmed')
+
+# Share of the consultation fee kept by the company on cancellation
+COMPANY_FEE_RATE = Decimal('0.20')
+
+# updated_at is listed (and stamped by _bulk_save) so conditional GET
+# validators and the change feed see these writes
+CANCEL_FIELDS = ['status', 'company_fee', 'refund_amount', 'refunded', 'payment_status', 'updated_at']
+MOVE_FIELDS = ['doctor', 'appointment_date', 'consultation_fee', 'updated_at']
+
+
+def apply_cancellation(appointment):
+    """Set the cancellation fields on ``appointment`` (without saving).
+
+    Returns ``(company_fee, refund_amount)``; the refund is only recorded
+    when the appointment had been paid.
+    """
+    consult_fee = Decimal(appointment.consultation_fee)
+    company_fee = (consult_fee * COMPANY_FEE_RATE).quantize(Decimal('0.01'))
+    refund_amount = (consult_fee - company_fee).quantize(Decimal('0.01'))
+
+    appointment.status = 'cancelled'
+    appointment.company_fee = company_fee
+    if appointment.payment_status:
+        appointment.refund_amount = refund_amount
+        appointment.refunded = True
+        appointment.payment_status = False
+    else:
+        appointment.refund_amount = Decimal('0.00')
+        appointment.refunded = False
+    return company_fee, refund_amount
+
+
+def _open_appointments(doctor, start, end):
+    return list(
+        Appointment.objects.select_for_update()
+        .select_related('patient', 'doctor__user')
+        .filter(doctor=doctor, appointment_date__range=(start, end), status__in=OPEN_STATUSES)
+        .order_by('appointment_date', 'appointment_time', 'id')
+    )
+
+
+def _bulk_save(appointments, fields):
+    """``bulk_update`` that also stamps ``updated_at``, which it would not set itself."""
+    now = timezone.now()
+    for appointment in appointments:
+        appointment.updated_at = now
+    Appointment.objects.bulk_update(appointments, fields, batch_size=500)
+
+
+def _notify(appointment, subject, body):
+    outbox.enqueue(subject, body, [appointment.patient.email])
+
+
+def cancel_range(doctor, start, end, reason=''):
+    """Cancel ``doctor``'s open appointments between ``start`` and ``end``.
+
+    Returns a summary dict with the cancelled appointment ids and totals.
+    """
+    with transaction.atomic():
+        appointments = _open_appointments(doctor, start, end)
+        pairs = []
+        refunds = company_fees = Decimal('0.00')
+        for appointment in appointments:
+            previous = rollups.snapshot(appointment)
+            company_fee, _ = apply_cancellation(appointment)
+            pairs.append((previous, rollups.snapshot(appointment)))
+            refunds += appointment.refund_amount
+            company_fees += company_fee
+            _notify(
+                appointment,
+                'Appointment Cancelled - Arogya Medical',
+                f"Hello {appointment.patient_name},\n\n"
+                f"Your appointment {appointment.appointment_id} with Dr. {doctor.user.name} on "
+                f"{appointment.appointment_date} at {appointment.appointment_time:%H:%M} has been cancelled"
+                f"{': ' + reason if reason else ''}.\n"
+                + (f"A refund of {appointment.refund_amount} will be issued.\n" if appointment.refunded else '')
+                + "\nBest regards,\nArogya Medical Team\n",
+            )
+
+        _bulk_save(appointments, CANCEL_FIELDS)
+        record_appointment_changes(pairs)
+
+    return {
+        'cancelled': len(appointments),
+        'appointment_ids': [a.appointment_id for a in appointments],
+        'total_refunds': str(refunds),
+        'total_company_fees': str(company_fees),
+    }
+
+
+def reschedule_range(doctor, start, end, target_start, target_doctor=None):
+    """Move ``doctor``'s open appointments in [start, end] to begin at ``target_start``.
+
+    Each appointment keeps its time and its offset from ``start``; with
+    ``target_doctor`` it is also handed to that doctor and, unless already
+    paid, re-priced at that doctor's consultation fee (a paid appointment
+    keeps the fee the patient paid, which any later refund is based on).
+    Appointments whose target slot is not in the target doctor's schedule
+    (``DoctorSlot``, so leave is respected), is already taken or is held by
+    a patient paying for it (a live ``SlotHold``) are left in place and
+    reported as skipped.
+
+    Existing bookings and holds in the target range are locked while the
+    move runs; a booking inserted concurrently still surfaces as
+    ``IntegrityError`` from the ``unique_active_doctor_slot`` constraint,
+    rolling the whole move back.
+    """
+    target_doctor = target_doctor or doctor
+    shift = target_start - start
+    target_range = (start + shift, end + shift)
+
+    with transaction.atomic():
+        appointments = _open_appointments(doctor, start, end)
+        offered = set(
+            DoctorSlot.objects.filter(doctor=target_doctor, date__range=target_range)
+            .values_list('date', 'start_time')
+        )
+        taken = set(
+            Appointment.objects.select_for_update()
+            .filter(doctor=target_doctor, appointment_date__range=target_range)
+            .exclude(status='cancelled')
+            .exclude(pk__in=[a.pk for a in appointments])
+            .values_list('appointment_date', 'appointment_time')
+        )
+        held = set(
+            SlotHold.objects.select_for_update()
+            .filter(doctor=target_doctor, appointment_date__range=target_range, expires_at__gt=timezone.now())
+            .values_list('appointment_date', 'appointment_time')
+        )
+
+        moved, skipped, pairs = [], [], []
+        for appointment in appointments:
+            slot = (appointment.appointment_date + shift, appointment.appointment_time)
+            reason = 'taken' if slot in taken else 'held' if slot in held else None if slot in offered else 'unavailable'
+            if reason:
+                skipped.append((appointment, reason))
+                continue
+            previous = rollups.snapshot(appointment)
+            if appointment.doctor_id != target_doctor.pk and not appointment.payment_status:
+                appointment.consultation_fee = target_doctor.consultation_fee
+            appointment.doctor = target_doctor
+            appointment.appointment_date = slot[0]
+            pairs.append((previous, rollups.snapshot(appointment)))
+            moved.append(appointment)
+            _notify(
+                appointment,
+                'Appointment Rescheduled - Arogya Medical',
+                f"Hello {appointment.patient_name},\n\n"
+                f"Your appointment {appointment.appointment_id} has been moved to {slot[0]} at "
+                f"{appointment.appointment_time:%H:%M} with Dr. {target_doctor.user.name}.\n"
+                "Please contact us if the new time does not suit you.\n"
+                "\nBest regards,\nArogya Medical Team\n",
+            )
+
+        _bulk_save(moved, MOVE_FIELDS)
+        record_appointment_changes(pairs)
+        changes.record_moves('appointment', [(a.pk, doctor.pk, target_doctor.pk) for a in moved])
+
+    return {
+        'moved': len(moved),
+        'appointment_ids': [a.appointment_id for a in moved],
+        'skipped': [
+            {
+                'appointment_id': a.appointment_id, 'date': a.appointment_date.isoformat(),
+                'time': a.appointment_time.isoformat(), 'reason': reason,
+            }
+            for a, reason in skipped
+        ],
+    }
@@ -0,0 +1,154 @@
+"""Incremental change feed for appointments and prescriptions.
+
+Clients keep a local copy in sync by polling with the opaque ``next`` token
+of their previous response. A page holds the rows whose ``updated_at``
+moved past the token (creations, edits and cancellations alike, since every
+write bumps ``updated_at``) plus the ids of rows deleted since, taken from
+``Tombstone``.
+
+When a row is handed to another doctor, a ``moved_out`` tombstone removes
+it from the previous doctor's feed (see ``record_moves``); the new doctor
+sees it through its ``updated_at``.
+
+Both streams are read in ``(timestamp, id)`` keyset order. Only rows older
+than ``CHANGE_FEED_LAG_SECONDS`` are served, so a transaction that stamped
+its rows just before committing cannot be skipped by a concurrent poll.
+This is a bound, not a guarantee: ``updated_at`` is taken when the row is
+written, not at commit, so a transaction that commits more than the lag
+after stamping a row can have that row skipped by a client whose token
+already passed it. Writers keep the window short by stamping rows at the
+end of their transaction (``bulk._bulk_save`` does so for bulk writes);
+the lag must exceed the longest such gap.
+"""
+import base64
+import binascii
+import datetime
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Tombstone
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def lag():
+    return datetime.timedelta(seconds=float(getattr(settings, 'CHANGE_FEED_LAG_SECONDS', 2)))
+
+
+def encode_token(position):
+    raw = json.dumps(position, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_token(value):
+    """Return ``{'rows': [ts, id] | None, 'deleted': [ts, id] | None}``."""
+    if not value:
+        return {'rows': None, 'deleted': None}
+    try:
+        position = json.loads(base64.urlsafe_b64decode(value.encode()).decode())
+        return {key: _decode_mark(position.get(key)) for key in ('rows', 'deleted')}
+    except (ValueError, TypeError, AttributeError, binascii.Error, UnicodeDecodeError):
+        raise InvalidToken('Invalid since token')
+
+
+def _decode_mark(mark):
+    if mark is None:
+        return None
+    ts, pk = mark
+    parsed = parse_datetime(ts)
+    if parsed is None:
+        raise ValueError(ts)
+    return [parsed, int(pk)]
+
+
+def _after(field, mark):
+    if mark is None:
+        return Q()
+    ts, pk = mark
+    return Q(**{f'{field}__gt': ts}) | Q(**{field: ts, 'id__gt': pk})
+
+
+def _page(queryset, field, mark, horizon, limit):
+    rows = list(
+        queryset.filter(**{f'{field}__lte': horizon})
+        .filter(_after(field, mark))
+        .order_by(field, 'id')[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    return rows[:limit], has_more
+
+
+def read(values, tombstones, token, limit=DEFAULT_LIMIT, now=None):
+    """Return ``(rows, deleted_ids, next_token, has_more)`` for one page.
+
+    ``values`` is a ``values()`` queryset that includes ``id`` and
+    ``updated_at``; ``tombstones`` a ``Tombstone`` queryset for the same
+    audience. Raises ``InvalidToken`` for a malformed token.
+    """
+    position = decode_token(token)
+    horizon = (now or timezone.now()) - lag()
+
+    rows, more_rows = _page(values, 'updated_at', position['rows'], horizon, limit)
+    dead, more_dead = _page(tombstones.values('id', 'object_id', 'deleted_at'), 'deleted_at', position['deleted'], horizon, limit)
+
+    next_position = {
+        'rows': [rows[-1]['updated_at'].isoformat(), rows[-1]['id']] if rows else _mark(position['rows']),
+        'deleted': [dead[-1]['deleted_at'].isoformat(), dead[-1]['id']] if dead else _mark(position['deleted']),
+    }
+    return rows, [d['object_id'] for d in dead], encode_token(next_position), more_rows or more_dead
+
+
+def _mark(mark):
+    return [mark[0].isoformat(), mark[1]] if mark else None
+
+
+def parse_limit(value):
+    try:
+        limit = int(value) if value else DEFAULT_LIMIT
+    except (TypeError, ValueError):
+        limit = DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def record_deletion(sender, instance, **kwargs):
+    """post_delete handler writing a ``Tombstone`` for appointments and prescriptions."""
+    Tombstone.objects.create(
+        kind=sender._meta.model_name,
+        object_id=instance.pk,
+        doctor_id=instance.doctor_id,
+        patient_id=instance.patient_id,
+    )
+
+
+def record_moves(kind, moves):
+    """Write ``moved_out`` tombstones for rows handed to another doctor.
+
+    ``moves`` holds ``(object_id, previous_doctor_id, doctor_id)`` tuples.
+    An older moved-out tombstone for the new doctor is dropped, so a row
+    moved back is not removed again by a client that has not read it yet.
+    """
+    moves = [(pk, old, new) for pk, old, new in moves if old != new]
+    if not moves:
+        return
+    Tombstone.objects.bulk_create(
+        [Tombstone(kind=kind, object_id=pk, doctor_id=old, moved_out=True) for pk, old, _ in moves],
+        batch_size=500,
+    )
+    returning = defaultdict(list)
+    for pk, _, new in moves:
+        returning[new].append(pk)
+    for doctor_id, pks in returning.items():
+        for i in range(0, len(pks), 500):
+            Tombstone.objects.filter(
+                kind=kind, moved_out=True, doctor_id=doctor_id, object_id__in=pks[i:i + 500],
+            ).delete()
@@ -0,0 +1,120 @@
+"""Running totals for the admin overview cards.
+
+Each total is an ``OverviewCounter`` row in the database, so every worker
+sees the same values. When doctors or appointments are written the rows are
+bumped with one ``UPDATE ... SET value = value + delta`` inside the writer's
+transaction, so a bump commits or rolls back with its change. The bumped
+rows stay locked until that transaction ends. Reads fetch all rows with one
+query.
+
+``reconcile()`` locks the rows before recounting, so it waits for writers
+that already bumped and recounts after they commit, while writers that bump
+later wait for it and add their delta to the fresh total. A bump that finds
+its row missing seeds it from a recount, which already includes the change.
+Rows are also seeded by a reconcile after every ``migrate``; ``manage.py
+reconcile_overview_counters`` can be run periodically (e.g. from cron) to
+repair writes that bypass the hooks, such as raw SQL. Reads never reconcile.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.utils import timezone
+
+TOTAL_DOCTORS = 'total_doctors'
+TOTAL_APPOINTMENTS = 'total_appointments'
+PENDING_PAYMENTS = 'pending_payments'
+# Revenue is kept in cents so it can be incremented exactly
+REVENUE_CENTS = 'revenue_cents'
+
+KEYS = (TOTAL_DOCTORS, TOTAL_APPOINTMENTS, PENDING_PAYMENTS, REVENUE_CENTS)
+
+
+def _to_cents(amount):
+    return int((Decimal(amount or 0) * 100).to_integral_value())
+
+
+def _count(keys):
+    from doctor.models import DoctorProfile
+    from .models import Appointment
+
+    counts = {
+        TOTAL_DOCTORS: lambda: DoctorProfile.objects.count(),
+        TOTAL_APPOINTMENTS: lambda: Appointment.objects.count(),
+        PENDING_PAYMENTS: lambda: Appointment.objects.filter(status='pending').count(),
+        REVENUE_CENTS: lambda: _to_cents(Appointment.objects.aggregate(total=Sum('consultation_fee'))['total']),
+    }
+    return {key: counts[key]() for key in keys}
+
+
+def reconcile():
+    """Recompute every counter from the database and store it."""
+    from .models import OverviewCounter
+
+    with transaction.atomic():
+        # Wait for writers that already bumped, and hold off new bumps, while recounting
+        list(OverviewCounter.objects.select_for_update().filter(name__in=KEYS))
+        values = _count(KEYS)
+        OverviewCounter.objects.bulk_create(
+            [OverviewCounter(name=name, value=value) for name, value in values.items()],
+            update_conflicts=True, unique_fields=['name'], update_fields=['value', 'updated_at'],
+        )
+    return values
+
+
+def get_overview():
+    """Return the overview totals with a single query."""
+    from .models import OverviewCounter
+
+    values = dict(OverviewCounter.objects.filter(name__in=KEYS).values_list('name', 'value'))
+    return {
+        'total_doctors': values.get(TOTAL_DOCTORS, 0),
+        'total_appointments': values.get(TOTAL_APPOINTMENTS, 0),
+        'pending_payments': values.get(PENDING_PAYMENTS, 0),
+        'total_revenue': Decimal(values.get(REVENUE_CENTS, 0)) / 100,
+    }
+
+
+def bump(deltas):
+    """Apply counter deltas in the current transaction, seeding missing rows."""
+    from .models import OverviewCounter
+
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = OverviewCounter.objects.filter(name__in=deltas).update(
+        value=F('value') + Case(*[When(name=key, then=Value(delta)) for key, delta in deltas.items()]),
+        updated_at=timezone.now(),
+    )
+    if updated < len(deltas):
+        missing = set(deltas) - set(OverviewCounter.objects.filter(name__in=deltas).values_list('name', flat=True))
+        OverviewCounter.objects.bulk_create(
+            [OverviewCounter(name=name, value=value) for name, value in _count(missing).items()],
+            ignore_conflicts=True,
+        )
+
+
+def reconcile_after_migrate(**kwargs):
+    """post_migrate handler: make sure every counter row exists and is current."""
+    reconcile()
+
+
+def appointment_changed(previous, current):
+    """Adjust counters for an appointment moving between rollup snapshots."""
+    deltas = {TOTAL_APPOINTMENTS: 0, PENDING_PAYMENTS: 0, REVENUE_CENTS: 0}
+    for snap, sign in ((previous, -1), (current, 1)):
+        if snap is None:
+            continue
+        deltas[TOTAL_APPOINTMENTS] += sign
+        deltas[PENDING_PAYMENTS] += sign * (snap.status == 'pending')
+        deltas[REVENUE_CENTS] += sign * _to_cents(snap.fee)
+    bump(deltas)
+
+
+def doctor_created(**kwargs):
+    if kwargs.get('created'):
+        bump({TOTAL_DOCTORS: 1})
+
+
+def doctor_deleted(**kwargs):
+    bump({TOTAL_DOCTORS: -1})
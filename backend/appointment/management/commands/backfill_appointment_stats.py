@@ -0,0 +1,32 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from appointment import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the DailyAppointmentStats rollup from existing appointments. '
+        'Schedule it with --recent-days to repair drift from writes that bypass the model hooks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First appointment date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Last appointment date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--recent-days', type=int, help='Rebuild from this many days ago onwards (overrides --from)')
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.date.fromisoformat(options['start']) if options['start'] else None
+            end = datetime.date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError:
+            raise CommandError('Dates must be in YYYY-MM-DD format')
+        if options['recent_days'] is not None:
+            if options['recent_days'] < 0:
+                raise CommandError('--recent-days must not be negative')
+            start = timezone.localdate() - datetime.timedelta(days=options['recent_days'])
+
+        written = rollups.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} daily appointment stats rows'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from appointment import prescription_items
+
+
+class Command(BaseCommand):
+    help = 'Create PrescriptionItem rows (with matched medicines) from Prescription.medications.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Prescriptions processed per transaction')
+        parser.add_argument('--rebuild', action='store_true', help='Recreate items for every prescription, re-running the medicine matching')
+
+    def handle(self, *args, **options):
+        prescriptions, items = prescription_items.backfill(options['batch_size'], rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {items} items for {prescriptions} prescriptions'))
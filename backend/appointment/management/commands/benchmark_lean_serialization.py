@@ -0,0 +1,82 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from appointment.models import Appointment
+from appointment.serializers import APPOINTMENT_LEAN, AppointmentSerializer
+from core.models import User
+from doctor.models import DoctorProfile
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of the regular and lean appointment list serialization.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+        parser.add_argument('--doctors', type=int, default=50)
+
+    def handle(self, *args, **options):
+        for count in options['rows']:
+            try:
+                with transaction.atomic():
+                    self._seed(count, options['doctors'])
+                    self._run(count)
+                    raise _Rollback
+            except _Rollback:
+                pass
+
+    def _seed(self, count, doctor_count):
+        patient = User.objects.create_user(
+            email='bench-patient@example.com', password=None, name='Bench Patient', role='customer'
+        )
+        doctors = []
+        for i in range(doctor_count):
+            user = User.objects.create_user(
+                email=f'bench-doctor{i}@example.com', password=None, name=f'Bench Doctor {i}', role='doctor'
+            )
+            doctors.append(DoctorProfile.objects.create(user=user, doctor_id=f'BENCH{i:05d}', specialty='General'))
+
+        start = datetime.date(2000, 1, 1)
+        appointments = []
+        for i in range(count):
+            slot, doctor_index = divmod(i, doctor_count)
+            day, hour = divmod(slot, 8)
+            appointments.append(Appointment(
+                appointment_id=f'BENCH{i:07d}',
+                patient=patient,
+                doctor=doctors[doctor_index],
+                appointment_date=start + datetime.timedelta(days=day),
+                appointment_time=datetime.time(9 + hour),
+                reason='Benchmark',
+                patient_name=patient.name,
+                patient_age=30,
+                patient_gender='Male',
+                patient_phone='0000000000',
+                consultation_fee=500,
+            ))
+        Appointment.objects.bulk_create(appointments, batch_size=2000)
+
+    def _run(self, count):
+        qs = Appointment.objects.select_related('doctor__user', 'patient').filter(reason='Benchmark')
+
+        started = time.perf_counter()
+        regular = AppointmentSerializer(qs, many=True).data
+        regular_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        lean = APPOINTMENT_LEAN.serialize(qs)
+        lean_elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'{count} rows: regular {count / regular_elapsed:,.0f} rows/s ({regular_elapsed:.2f}s), '
+            f'lean {count / lean_elapsed:,.0f} rows/s ({lean_elapsed:.2f}s), '
+            f'speedup {regular_elapsed / lean_elapsed:.1f}x'
+        )
+        if len(regular) != len(lean):
+            self.stderr.write('Row counts differ between paths')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from appointment import booking
+
+
+class Command(BaseCommand):
+    help = (
+        'Cancel all but one live appointment per doctor slot. Run before applying '
+        'the unique_active_doctor_slot constraint to an existing database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the duplicates without cancelling them')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            cancelled = booking.cancel_duplicate_bookings(dry_run=options['dry_run'])
+        for appointment in cancelled:
+            self.stdout.write(
+                f'{appointment.appointment_id}: doctor {appointment.doctor_id} '
+                f'{appointment.appointment_date} {appointment.appointment_time}'
+            )
+        verb = 'Would cancel' if options['dry_run'] else 'Cancelled'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(cancelled)} duplicate bookings'))
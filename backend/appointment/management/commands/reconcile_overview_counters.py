@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from appointment import counters
+
+
+class Command(BaseCommand):
+    help = 'Recompute the admin overview counters from the database (also run after every migrate; run periodically to repair drift).'
+
+    def handle(self, *args, **options):
+        values = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(
+            'Reconciled overview counters: '
+            f"{values[counters.TOTAL_DOCTORS]} doctors, "
+            f"{values[counters.TOTAL_APPOINTMENTS]} appointments, "
+            f"{values[counters.PENDING_PAYMENTS]} pending"
+        ))
@@ -1,8 +1,12 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
 from core.models import User
 from doctor.models import DoctorProfile
 from django.utils import timezone
 from django.conf import settings
+from core.identifiers import IdentifierAllocator, max_numeric_suffix
+from . import counters, rollups
 
 class Appointment(models.Model):
     STATUS_CHOICES = [
@@ -35,21 +39,156 @@ class Appointment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination paths for the patient and doctor dashboards;
+            # the doctor index also serves doctor + date lookups.
+            models.Index(fields=['patient', '-appointment_date', '-appointment_time', '-id'], name='appt_patient_schedule_idx'),
+            models.Index(fields=['doctor', '-appointment_date', '-appointment_time', '-id'], name='appt_doctor_schedule_idx'),
+            # Change feed (appointment.changes) scans by modification time
+            models.Index(fields=['doctor', 'updated_at', 'id'], name='appt_doctor_changes_idx'),
+            models.Index(fields=['patient', 'updated_at', 'id'], name='appt_patient_changes_idx'),
+            models.Index(fields=['updated_at', 'id'], name='appt_changes_idx'),
+        ]
+        constraints = [
+            # A doctor's slot can only be taken by one live (non-cancelled) appointment
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'],
+                condition=~models.Q(status='cancelled'),
+                name='unique_active_doctor_slot',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.appointment_id} - {self.patient_name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what feeds DailyAppointmentStats so save() can apply a delta
+        if rollups.SNAPSHOT_FIELDS.issubset(field_names):
+            instance._rollup_snapshot = rollups.snapshot(instance)
+        return instance
+
+    def _stored_rollup_snapshot(self):
+        if self._state.adding:
+            return None
+        previous = getattr(self, '_rollup_snapshot', None)
+        if previous is None and self.pk:
+            # Loaded with deferred fields; read the stored values once
+            previous = rollups.load_snapshot(self.pk)
+        return previous
+
     def save(self, *args, **kwargs):
         if not self.appointment_id:
-            last = Appointment.objects.order_by('-id').first()
-            if last and last.appointment_id.startswith('APT'):
-                try:
-                    num = int(last.appointment_id.replace('APT', '')) + 1
-                except Exception:
-                    num = Appointment.objects.count() + 1
-            else:
-                num = Appointment.objects.count() + 1
-            self.appointment_id = f"APT{num:05d}"
-        super().save(*args, **kwargs)
+            self.appointment_id = APPOINTMENT_IDS.next_id()
+        previous = self._stored_rollup_snapshot()
+        current = rollups.snapshot(self, previous, kwargs.get('update_fields'))
+        # Keep DailyAppointmentStats in step with the row in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            record_appointment_changes([(previous, current)])
+            if previous is not None and previous.doctor_id != current.doctor_id:
+                from . import changes
+                changes.record_moves('appointment', [(self.pk, previous.doctor_id, current.doctor_id)])
+        self._rollup_snapshot = current
+
+
+def record_appointment_changes(pairs):
+    """Propagate appointment writes to the stats rollup and overview counters.
+
+    ``pairs`` holds ``(previous, current)`` rollup snapshots per appointment;
+    call this directly from code that bypasses ``save()`` (bulk updates).
+    """
+    rollups.apply_many(pairs)
+    for previous, current in pairs:
+        counters.appointment_changed(previous, current)
+
+
+def record_appointment_deletion(sender, instance, **kwargs):
+    """pre_delete handler taking a deleted appointment out of the rollup and counters.
+
+    A signal rather than ``delete()`` so cascades (deleting a doctor or a
+    patient) and ``QuerySet.delete()`` are covered too; it runs in the
+    deletion's transaction.
+    """
+    record_appointment_changes([(instance._stored_rollup_snapshot(), None)])
+    instance._rollup_snapshot = None
+
+
+# Allocates APT00001, APT00002, ... without querying Appointment on insert
+APPOINTMENT_IDS = IdentifierAllocator(
+    'appointment', 'APT', 5,
+    seed=lambda: max_numeric_suffix(Appointment.objects.values_list('appointment_id', flat=True).iterator(), 'APT'),
+)
+
+class DailyAppointmentStats(models.Model):
+    """Per-day appointment rollup, per doctor and globally (doctor is NULL).
+
+    Rows are keyed by appointment_date and maintained incrementally by
+    ``appointment.rollups`` whenever an appointment is written; the
+    ``backfill_appointment_stats`` command rebuilds them from scratch.
+    """
+    date = models.DateField()
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, null=True, blank=True, related_name='daily_stats')
+    count = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cancellations = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    refunds = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    company_fees = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'doctor'], condition=models.Q(doctor__isnull=False), name='unique_daily_stats_doctor'),
+            models.UniqueConstraint(fields=['date'], condition=models.Q(doctor__isnull=True), name='unique_daily_stats_global'),
+        ]
+
+    def __str__(self):
+        scope = self.doctor_id or 'all'
+        return f"{self.date} [{scope}] {self.count} appointments"
+
+
+class OverviewCounter(models.Model):
+    """One running total for the admin overview cards.
+
+    Shared by every worker; bumped with ``F()`` by ``appointment.counters``
+    and recomputed by ``manage.py reconcile_overview_counters``.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+class SlotHold(models.Model):
+    """Short-lived reservation of a doctor's slot while the patient pays.
+
+    At most one hold may exist per doctor/date/time; expired holds are purged
+    lazily when the slot is requested again.
+    """
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name='slot_holds')
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='slot_holds')
+    appointment_date = models.DateField()
+    appointment_time = models.TimeField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'appointment_date', 'appointment_time'],
+                name='unique_slot_hold',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Hold {self.doctor_id} {self.appointment_date} {self.appointment_time} until {self.expires_at}"
+
 
 class Prescription(models.Model):
     appointment = models.OneToOneField(
@@ -75,4 +214,66 @@ class Prescription(models.Model):
         return f"Prescription for {self.patient.name} - {self.appointment.appointment_id}"
 
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='prescription_changes_idx'),
+            models.Index(fields=['doctor', 'updated_at', 'id'], name='prescription_doc_changes_idx'),
+            models.Index(fields=['patient', 'updated_at', 'id'], name='prescription_pat_changes_idx'),
+        ]
+
+class PrescriptionItem(models.Model):
+    """One medication line of a prescription.
+
+    Mirrors an entry of ``Prescription.medications`` (which stays as the
+    serialized view) so lines can be queried and matched to inventory.
+    ``medicine`` is the catalog entry resolved from ``name`` when the
+    prescription was written; it is empty when no confident match existed.
+    """
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='items')
+    position = models.PositiveSmallIntegerField(default=0)
+    name = models.CharField(max_length=255)
+    dosage = models.CharField(max_length=255, blank=True)
+    duration = models.CharField(max_length=255, blank=True)
+    medicine = models.ForeignKey(
+        'pharmacy.Medicine', on_delete=models.SET_NULL, null=True, blank=True, related_name='prescription_items'
+    )
+
+    class Meta:
+        ordering = ['prescription', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['prescription', 'position'], name='unique_prescription_item_position'),
+        ]
+        indexes = [
+            models.Index(fields=['medicine', 'prescription'], name='prescription_item_demand_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.dosage}) for prescription {self.prescription_id}"
+
+class Tombstone(models.Model):
+    """Record of a deleted appointment or prescription for the change feed.
+
+    ``doctor_id`` / ``patient_id`` keep enough of the deleted row to scope
+    the feed per user. Written by post_delete handlers in ``changes``.
+    A ``moved_out`` tombstone instead marks a row handed to another doctor;
+    it only removes the row from the previous doctor's feed.
+    """
+    KIND_CHOICES = (
+        ('appointment', 'Appointment'),
+        ('prescription', 'Prescription'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    doctor_id = models.BigIntegerField(null=True, blank=True)
+    patient_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(default=timezone.now)
+    moved_out = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'deleted_at', 'id'], name='tombstone_changes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} deleted {self.deleted_at}"
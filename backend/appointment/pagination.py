@@ -0,0 +1,85 @@
+"""Keyset (cursor) pagination over appointment schedule order.
+
+Appointments are ordered by (appointment_date, appointment_time, id). A page
+is fetched by seeking past the last row of the previous page instead of
+using OFFSET, so every page costs the same regardless of how deep the
+client scrolls, and the composite schedule indexes on ``Appointment`` can
+serve it directly.
+"""
+import base64
+import binascii
+import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(appointment):
+    """Build the cursor for an Appointment instance or a values() row."""
+    if isinstance(appointment, dict):
+        date, time, pk = appointment['appointment_date'], appointment['appointment_time'], appointment['id']
+    else:
+        date, time, pk = appointment.appointment_date, appointment.appointment_time, appointment.pk
+    raw = f"{date.isoformat()}|{time.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(value):
+    try:
+        raw = base64.urlsafe_b64decode(value.encode()).decode()
+        date_s, time_s, pk_s = raw.split('|')
+        return datetime.date.fromisoformat(date_s), datetime.time.fromisoformat(time_s), int(pk_s)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def parse_limit(value):
+    try:
+        limit = int(value) if value else DEFAULT_PAGE_SIZE
+    except (TypeError, ValueError):
+        limit = DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _after(date, time, pk, descending):
+    op = 'lt' if descending else 'gt'
+    return (
+        Q(**{f'appointment_date__{op}': date})
+        | Q(appointment_date=date, **{f'appointment_time__{op}': time})
+        | Q(appointment_date=date, appointment_time=time, **{f'id__{op}': pk})
+    )
+
+
+def split_by_time(qs, scope, now):
+    """Restrict ``qs`` to 'upcoming' or 'past' appointments relative to ``now``."""
+    today, current = now.date(), now.time()
+    upcoming = Q(appointment_date__gt=today) | Q(appointment_date=today, appointment_time__gte=current)
+    if scope == 'upcoming':
+        return qs.filter(upcoming)
+    if scope == 'past':
+        return qs.exclude(upcoming)
+    return qs
+
+
+def paginate(qs, cursor=None, limit=DEFAULT_PAGE_SIZE, descending=True):
+    """Return ``(rows, next_cursor)`` for one page of ``qs``.
+
+    ``next_cursor`` is None on the last page. Raises ``InvalidCursor`` for a
+    malformed cursor.
+    """
+    if cursor:
+        qs = qs.filter(_after(*decode_cursor(cursor), descending=descending))
+
+    prefix = '-' if descending else ''
+    qs = qs.order_by(f'{prefix}appointment_date', f'{prefix}appointment_time', f'{prefix}id')
+    rows = list(qs[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
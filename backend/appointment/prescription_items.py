@@ -0,0 +1,136 @@
+"""Normalized prescription lines (``PrescriptionItem``) and medicine matching.
+
+``Prescription.medications`` holds what the doctor typed. When a
+prescription is written its lines are copied into ``PrescriptionItem`` rows
+and each name is matched against the pharmacy catalog by
+``MedicineResolver``. Matching is deliberately conservative: a line is only
+linked when one medicine fits, because a wrong strength is worse than
+leaving the pharmacist to choose.
+"""
+import difflib
+import re
+
+from django.db import transaction
+from django.db.models import Q
+
+from pharmacy.models import Medicine
+
+from .models import Prescription, PrescriptionItem
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+_LEADING_ALNUM = re.compile(r'[0-9a-z]+')
+
+
+def normalize(text):
+    return ' '.join(_NON_ALNUM.sub(' ', (text or '').lower()).split())
+
+
+class MedicineResolver:
+    """Match free-text medication names to ``Medicine`` ids.
+
+    Candidates for all ``names`` are loaded with one query (medicines whose
+    name starts like a requested one, see ``prefix()``), so a resolver can
+    be shared by every line of a prescription or a whole backfill batch.
+    Large batches are split into one query per ``PREFIX_BATCH`` prefixes,
+    keeping each OR chain within SQLite's expression depth limit.
+    """
+    CUTOFF = 0.85
+    PREFIX = 4
+    PREFIX_BATCH = 200
+
+    def __init__(self, names):
+        prefixes = sorted({self.prefix(name) for name in names} - {''})
+
+        self.strengths = {}
+        self.keys = {}
+        for i in range(0, len(prefixes), self.PREFIX_BATCH):
+            self._load(prefixes[i:i + self.PREFIX_BATCH])
+
+    @classmethod
+    def prefix(cls, name):
+        """Up to ``PREFIX`` leading letters of ``name``, as stored, for ``istartswith``.
+
+        Short enough to tolerate spelling slips later in the word, and cut at
+        the first non-alphanumeric so "Co-amoxiclav" still finds itself.
+        """
+        match = _LEADING_ALNUM.match((name or '').strip().lower())
+        return match.group()[:cls.PREFIX] if match else ''
+
+    def _load(self, prefixes):
+        query = Q()
+        for prefix in prefixes:
+            query |= Q(name__istartswith=prefix)
+        for medicine in Medicine.objects.filter(query).values('id', 'name', 'weight_or_volume'):
+            name = normalize(medicine['name'])
+            strength = normalize(medicine['weight_or_volume'])
+            self.strengths[medicine['id']] = strength
+            for key in {name, f'{name} {strength}'.strip()}:
+                self.keys.setdefault(key, set()).add(medicine['id'])
+
+    def resolve(self, name, dosage=''):
+        """Return the id of the single medicine matching ``name``, or None."""
+        text = normalize(name)
+        if not text:
+            return None
+        ids = self.keys.get(text)
+        if ids is None:
+            close = difflib.get_close_matches(text, self.keys, n=1, cutoff=self.CUTOFF)
+            ids = self.keys[close[0]] if close else set()
+        if len(ids) > 1:
+            # Same name in several strengths: keep the one the line mentions
+            context = f' {text} {normalize(dosage)} '
+            ids = {pk for pk in ids if self.strengths[pk] and f' {self.strengths[pk]} ' in context}
+        return next(iter(ids)) if len(ids) == 1 else None
+
+
+def build_items(prescription, resolver=None):
+    """Return unsaved ``PrescriptionItem`` rows for ``prescription.medications``."""
+    medications = [m for m in prescription.medications or [] if isinstance(m, dict)]
+    if resolver is None:
+        resolver = MedicineResolver([m.get('name', '') for m in medications])
+    return [
+        PrescriptionItem(
+            prescription=prescription,
+            position=position,
+            name=(med.get('name') or '').strip()[:255],
+            dosage=(med.get('dosage') or '').strip()[:255],
+            duration=(med.get('duration') or '').strip()[:255],
+            medicine_id=resolver.resolve(med.get('name', ''), med.get('dosage', '')),
+        )
+        for position, med in enumerate(medications)
+    ]
+
+
+def sync_items(prescription):
+    """Replace ``prescription``'s items with rows built from its medications."""
+    PrescriptionItem.objects.filter(prescription=prescription).delete()
+    return PrescriptionItem.objects.bulk_create(build_items(prescription))
+
+
+def backfill(batch_size=500, rebuild=False):
+    """Create items for prescriptions that have none (all of them with ``rebuild``).
+
+    Works in primary-key batches with one resolver query per batch. Returns
+    ``(prescriptions, items)`` counts.
+    """
+    queryset = Prescription.objects.only('id', 'medications').order_by('id')
+    if not rebuild:
+        queryset = queryset.filter(items__isnull=True)
+
+    prescriptions = items = 0
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return prescriptions, items
+        last_id = batch[-1].id
+        resolver = MedicineResolver([
+            med.get('name', '') for p in batch for med in p.medications or [] if isinstance(med, dict)
+        ])
+        rows = [row for p in batch for row in build_items(p, resolver)]
+        with transaction.atomic():
+            if rebuild:
+                PrescriptionItem.objects.filter(prescription__in=batch).delete()
+            PrescriptionItem.objects.bulk_create(rows, batch_size=1000)
+        prescriptions += len(batch)
+        items += len(rows)
@@ -0,0 +1,145 @@
+"""Pharmacist prescription queue events.
+
+Prescription creation and (un)dispensing publish events on
+``PRESCRIPTION_CHANNEL`` through ``core.pubsub`` once the write commits.
+``PrescriptionQueueStreamView`` relays them to pharmacists as Server-Sent
+Events; ``stream()`` formats them as an async iterator, so under ASGI each
+frame is flushed as soon as it is produced and an open stream holds no
+worker thread. ``stream_sync()`` is the blocking variant used when the view
+runs under WSGI (e.g. ``runserver``), where every open stream occupies a
+worker until it ends.
+
+Events are not replayed after a reconnect. A client that reconnects, or
+that receives a ``resync`` event, should catch up with the prescription
+change feed (``/api/appointment/changes/prescriptions/``).
+"""
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from rest_framework.renderers import BaseRenderer
+
+from core import pubsub
+
+PRESCRIPTION_CHANNEL = 'pharmacy.prescriptions'
+
+
+def heartbeat_seconds():
+    return float(getattr(settings, 'SSE_HEARTBEAT_SECONDS', 15))
+
+
+def max_stream_seconds():
+    return float(getattr(settings, 'SSE_MAX_STREAM_SECONDS', 300))
+
+
+def publish_created(prescription_data):
+    pubsub.publish_on_commit(PRESCRIPTION_CHANNEL, {'event': 'prescription.created', 'data': prescription_data})
+
+
+def publish_dispense(prescription):
+    pubsub.publish_on_commit(PRESCRIPTION_CHANNEL, {
+        'event': 'prescription.dispensed' if prescription.dispensed else 'prescription.undispensed',
+        'data': {
+            'id': prescription.pk,
+            'dispensed': prescription.dispensed,
+            'dispensed_by': prescription.dispensed_by_id,
+            'dispensed_at': prescription.dispensed_at,
+        },
+    })
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets ``Accept: text/event-stream`` requests through content negotiation.
+
+    The stream itself bypasses renderers; this only renders error responses
+    (such as a 403) as a single ``error`` event.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data).encode() if data is not None else b''
+
+
+def stream(subscription, heartbeat=None, max_seconds=None):
+    """Return an async iterator of SSE frames from ``subscription`` ending after ``max_seconds``.
+
+    A comment line is sent every ``heartbeat`` seconds without events so
+    proxies keep the connection open. Waiting for a message happens in a
+    thread outside the event loop. Bounding the stream length lets
+    EventSource clients reconnect and resync periodically.
+    """
+    heartbeat, deadline = _limits(heartbeat, max_seconds)
+    return _AsyncStream(subscription, _async_frames(subscription, heartbeat, deadline))
+
+
+def stream_sync(subscription, heartbeat=None, max_seconds=None):
+    """Blocking variant of ``stream()`` for WSGI servers."""
+    heartbeat, deadline = _limits(heartbeat, max_seconds)
+    return _frames(subscription, heartbeat, deadline)
+
+
+def _limits(heartbeat, max_seconds):
+    heartbeat = heartbeat_seconds() if heartbeat is None else heartbeat
+    return heartbeat, time.monotonic() + (max_stream_seconds() if max_seconds is None else max_seconds)
+
+
+def _message_frames(subscription, message):
+    frames = []
+    if subscription.overflowed:
+        subscription.overflowed = False
+        frames.append(format_event('resync', {}))
+    frames.append(': keepalive\n\n' if message is None else format_event(message['event'], message['data']))
+    return frames
+
+
+class _AsyncStream:
+    """Async frames plus a ``close()`` for ``StreamingHttpResponse`` to call.
+
+    The response closes its content once sent or when the client goes away,
+    which an async generator alone would leave to garbage collection.
+    """
+
+    def __init__(self, subscription, frames):
+        self.subscription = subscription
+        self.frames = frames
+
+    def __aiter__(self):
+        return self.frames
+
+    def close(self):
+        self.subscription.close()
+
+
+async def _async_frames(subscription, heartbeat, deadline):
+    get = sync_to_async(subscription.get, thread_sensitive=False)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            for frame in _message_frames(subscription, await get(timeout=min(heartbeat, remaining))):
+                yield frame
+    finally:
+        subscription.close()
+
+
+def _frames(subscription, heartbeat, deadline):
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            yield from _message_frames(subscription, subscription.get(timeout=min(heartbeat, remaining)))
+    finally:
+        subscription.close()
@@ -0,0 +1,178 @@
+"""Incremental maintenance of ``DailyAppointmentStats``.
+
+Every appointment contributes to two rollup rows for its appointment_date:
+one for its doctor and one global row (doctor NULL). When an appointment is
+written, its previous contribution is subtracted and the new one added with
+``F()`` increments, in the same transaction as the appointment write.
+
+``Appointment.save()`` and a ``pre_delete`` handler (which also sees cascade
+and queryset deletes) apply changes automatically. Code that bypasses
+``save()`` (``bulk_update``, ``QuerySet.update``) must call
+``appointment.models.record_appointment_changes`` with snapshots taken
+before and after the change; writes that do not (raw SQL, a stray
+``update()``) leave the rollup stale until ``manage.py
+backfill_appointment_stats --recent-days N`` runs, which is meant to be
+scheduled (e.g. nightly) to repair recent days.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+
+Snapshot = namedtuple('Snapshot', 'date doctor_id status fee refund company_fee')
+
+METRICS = ('count', 'revenue', 'cancellations', 'completed', 'refunds', 'company_fees')
+
+_FIELDS = {
+    'date': 'appointment_date',
+    'doctor_id': 'doctor',
+    'status': 'status',
+    'fee': 'consultation_fee',
+    'refund': 'refund_amount',
+    'company_fee': 'company_fee',
+}
+
+# Attribute names that must be loaded for a snapshot to be taken cheaply
+SNAPSHOT_FIELDS = frozenset(('appointment_date', 'doctor_id', 'status', 'consultation_fee', 'refund_amount', 'company_fee'))
+
+ZERO = Decimal('0')
+
+
+def _dec(value):
+    return Decimal(value) if value is not None else ZERO
+
+
+def snapshot(appointment, previous=None, update_fields=None):
+    """Capture the fields of ``appointment`` that feed the rollup.
+
+    When saving with ``update_fields``, fields that are not written keep the
+    value from ``previous`` so the rollup mirrors what is actually stored.
+    """
+    current = Snapshot(
+        date=appointment.appointment_date,
+        doctor_id=appointment.doctor_id,
+        status=appointment.status,
+        fee=_dec(appointment.consultation_fee),
+        refund=_dec(appointment.refund_amount),
+        company_fee=_dec(appointment.company_fee),
+    )
+    if previous is None or update_fields is None:
+        return current
+    update_fields = set(update_fields)
+    return Snapshot(**{
+        attr: getattr(current, attr) if field in update_fields or f'{field}_id' in update_fields else getattr(previous, attr)
+        for attr, field in _FIELDS.items()
+    })
+
+
+def load_snapshot(pk):
+    """Read the stored snapshot for an appointment, or None if it is gone."""
+    from .models import Appointment
+
+    row = Appointment.objects.filter(pk=pk).values_list(
+        'appointment_date', 'doctor_id', 'status', 'consultation_fee', 'refund_amount', 'company_fee'
+    ).first()
+    if row is None:
+        return None
+    return Snapshot(row[0], row[1], row[2], _dec(row[3]), _dec(row[4]), _dec(row[5]))
+
+
+def contribution(snap):
+    return (
+        1,
+        snap.fee,
+        1 if snap.status == 'cancelled' else 0,
+        1 if snap.status == 'completed' else 0,
+        snap.refund,
+        snap.company_fee,
+    )
+
+
+def _accumulate(deltas, snap, sign):
+    values = contribution(snap)
+    for key in ((snap.date, snap.doctor_id), (snap.date, None)):
+        current = deltas.setdefault(key, [0, ZERO, 0, 0, ZERO, ZERO])
+        for i, v in enumerate(values):
+            current[i] += sign * v
+
+
+def compute_deltas(pairs):
+    """Fold ``(previous, current)`` snapshot pairs into per-row metric deltas."""
+    deltas = {}
+    for previous, current in pairs:
+        if previous is not None:
+            _accumulate(deltas, previous, -1)
+        if current is not None:
+            _accumulate(deltas, current, 1)
+    return {key: values for key, values in deltas.items() if any(values)}
+
+
+def apply(previous, current):
+    """Move one appointment's contribution from ``previous`` to ``current``."""
+    apply_many([(previous, current)])
+
+
+def apply_many(pairs):
+    """Apply the rollup changes for several appointments at once."""
+    from .models import DailyAppointmentStats
+
+    deltas = compute_deltas(pairs)
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        for (day, doctor_id), values in sorted(deltas.items(), key=lambda kv: (kv[0][0], kv[0][1] or 0)):
+            updates = {name: F(name) + value for name, value in zip(METRICS, values)}
+            row = DailyAppointmentStats.objects.filter(date=day, doctor_id=doctor_id)
+            if row.update(**updates):
+                continue
+            try:
+                with transaction.atomic():
+                    DailyAppointmentStats.objects.create(
+                        date=day, doctor_id=doctor_id, **dict(zip(METRICS, values))
+                    )
+            except IntegrityError:
+                # Created concurrently by another writer; add to it instead
+                row.update(**updates)
+
+
+def rebuild(start=None, end=None):
+    """Recompute rollup rows from ``Appointment`` (optionally for a date range).
+
+    Returns the number of rollup rows written.
+    """
+    from .models import Appointment, DailyAppointmentStats
+
+    appointments = Appointment.objects.all()
+    existing = DailyAppointmentStats.objects.all()
+    if start:
+        appointments = appointments.filter(appointment_date__gte=start)
+        existing = existing.filter(date__gte=start)
+    if end:
+        appointments = appointments.filter(appointment_date__lte=end)
+        existing = existing.filter(date__lte=end)
+
+    aggregates = dict(
+        count=Count('id'),
+        revenue=Sum('consultation_fee'),
+        cancellations=Count('id', filter=Q(status='cancelled')),
+        completed=Count('id', filter=Q(status='completed')),
+        refunds=Sum('refund_amount'),
+        company_fees=Sum('company_fee'),
+    )
+
+    rows = []
+    per_doctor = appointments.values('appointment_date', 'doctor').annotate(**aggregates).order_by()
+    overall = appointments.values('appointment_date').annotate(**aggregates).order_by()
+    for item in list(per_doctor) + list(overall):
+        rows.append(DailyAppointmentStats(
+            date=item['appointment_date'],
+            doctor_id=item.get('doctor'),
+            **{name: item[name] or 0 for name in METRICS}
+        ))
+
+    with transaction.atomic():
+        existing.delete()
+        DailyAppointmentStats.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
@@ -1,7 +1,9 @@
 from rest_framework import serializers
-from .models import Appointment, Prescription
+from .models import Appointment, Prescription, SlotHold
 from doctor.models import DoctorProfile
 from core.models import User
+from core.lean import LeanSerializer
+from . import prescription_items
 
 class AppointmentSerializer(serializers.ModelSerializer):
     doctor_name = serializers.CharField(source='doctor.user.name', read_only=True)
@@ -44,6 +46,21 @@ class AppointmentSerializer(serializers.ModelSerializer):
             'updated_at',
             'patient',
         )
+        # Slot conflicts are reported by the unique_active_doctor_slot
+        # constraint at insert time instead of a validator pre-read
+        validators = []
+
+APPOINTMENT_LEAN = LeanSerializer(AppointmentSerializer)
+
+
+class SlotHoldSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SlotHold
+        fields = ('token', 'doctor', 'appointment_date', 'appointment_time', 'expires_at', 'created_at')
+        read_only_fields = ('token', 'expires_at', 'created_at')
+        # Expired or own holds are replaced in booking.place_hold
+        validators = []
+
 
 class PrescriptionSerializer(serializers.ModelSerializer):
     doctor_name = serializers.CharField(source='doctor.user.name', read_only=True)
@@ -82,6 +99,9 @@ class PrescriptionSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at', 'updated_at')
 
 
+PRESCRIPTION_LEAN = LeanSerializer(PrescriptionSerializer)
+
+
 class PrescriptionPharmacistSerializer(serializers.ModelSerializer):
     # Only expose fields relevant for pharmacist: appointment id/date/time, patient identifiers and medications
     patient_name = serializers.CharField(source='patient.name', read_only=True)
@@ -102,12 +122,34 @@ class PrescriptionPharmacistSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'created_at', 'dispensed', 'dispensed_by', 'dispensed_at')
 
 
+PRESCRIPTION_PHARMACIST_LEAN = LeanSerializer(PrescriptionPharmacistSerializer)
+
+
 class PrescriptionDispenseSerializer(serializers.Serializer):
     # Payload for marking as dispensed
     dispensed = serializers.BooleanField(required=True)
     # option to attach a sale id if created on dispense
     sale_id = serializers.IntegerField(required=False, allow_null=True)
 
+class DispenseSaleLineSerializer(serializers.Serializer):
+    medicine_id = serializers.IntegerField()
+    qty = serializers.IntegerField(min_value=1, default=1)
+
+
+class PrescriptionDispenseSaleSerializer(serializers.Serializer):
+    # Payload for dispensing a prescription and selling its medicines at once
+    payment_method = serializers.ChoiceField(choices=('cash', 'card'), default='cash')
+    customer_name = serializers.CharField(required=False, allow_blank=True)
+    phone = serializers.CharField(required=False, allow_blank=True)
+    # optional basket overriding the prescription's matched medicines
+    items = DispenseSaleLineSerializer(many=True, required=False)
+
+    def validate_items(self, value):
+        if not value:
+            raise serializers.ValidationError('Items list cannot be empty')
+        return value
+
+
 class PrescriptionCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Prescription
@@ -196,5 +238,6 @@ class PrescriptionCreateSerializer(serializers.ModelSerializer):
             notes=validated_data.get('notes', ''),
             follow_up_date=validated_data.get('follow_up_date')
         )
-        
+        prescription_items.sync_items(prescription)
+
         return prescription
\ No newline at end of file
@@ -1,3 +1,1212 @@
-from django.test import TestCase
+import datetime
+import io
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from core.models import User
+from doctor.models import DoctorProfile, ScheduleException
+from .models import Appointment, PrescriptionItem
+
+
+class EarliestAvailableTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.doctors = []
+        for i, (slots, fee) in enumerate([
+            (['09:00 - 09:30', '11:00 - 11:30'], 500),
+            (['10:00 - 10:30'], 800),
+            (['09:00 - 09:30'], 500),
+        ]):
+            user = User.objects.create_user(email=f'doc{i}@example.com', password='pw', name=f'Doctor {i}', role='doctor')
+            cls.doctors.append(DoctorProfile.objects.create(
+                user=user, specialty='Cardiology', available_time_slots=slots, consultation_fee=fee,
+            ))
+        user = User.objects.create_user(email='derm@example.com', password='pw', name='Derm', role='doctor')
+        DoctorProfile.objects.create(user=user, specialty='Dermatology', available_time_slots=['08:00 - 08:30'])
+
+        cls.day = datetime.date.today() + datetime.timedelta(days=1)
+
+    def search(self, **params):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        params.setdefault('from', self.day.isoformat())
+        return client.get('/api/appointment/availability/earliest/', params)
+
+    def test_merges_slots_across_doctors_in_time_order(self):
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctors[0], appointment_date=self.day,
+            appointment_time=datetime.time(9), reason='Checkup', patient_name='Patient',
+            patient_age=30, patient_gender='Male', patient_phone='123', consultation_fee=500,
+        )
+        # Leave removes the doctor's slot rows once it commits
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleException.objects.create(doctor=self.doctors[1], date=self.day)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.search(specialty='cardiology', limit=3)
+        self.assertEqual(response.status_code, 200)
+        found = [(s['date'], s['time'], s['doctor']) for s in response.data['slots']]
+        tomorrow, after = self.day.isoformat(), (self.day + datetime.timedelta(days=1)).isoformat()
+        self.assertEqual(found, [
+            (tomorrow, '09:00:00', self.doctors[2].id),
+            (tomorrow, '11:00:00', self.doctors[0].id),
+            (after, '09:00:00', self.doctors[0].id),
+        ])
+        # One ordered, limited query over DoctorSlot, doctors joined in
+        self.assertEqual(len(ctx), 1)
+        self.assertIn('LIMIT 3', ctx.captured_queries[0]['sql'])
+
+    def test_skips_slots_that_already_started_today(self):
+        from django.utils import timezone
+        from . import availability
+
+        now = timezone.make_aware(datetime.datetime.combine(self.day, datetime.time(9, 30)))
+        found = availability.earliest_free_slots(
+            [self.doctors[0], self.doctors[2]], self.day - datetime.timedelta(days=1), self.day, 5, now=now,
+        )
+        self.assertEqual(found, [(self.day, datetime.time(11), self.doctors[0])])
+        self.assertEqual(availability.earliest_free_slots([], self.day, self.day, 5), [])
+
+    def test_fee_filter_and_validation(self):
+        response = self.search(specialty='cardiology', min_fee='600', limit=1)
+        self.assertEqual([s['doctor'] for s in response.data['slots']], [self.doctors[1].id])
+        self.assertEqual(self.search(limit='x').status_code, 400)
+        self.assertEqual(self.search(to='2000-01-01').status_code, 400)
+
+
+class DoctorRangeBulkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', role='admin', is_staff=True)
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.doctors = []
+        for i, fee in enumerate((500, 800)):
+            user = User.objects.create_user(email=f'doc{i}@example.com', password='pw', name=f'Doctor {i}', role='doctor')
+            cls.doctors.append(DoctorProfile.objects.create(
+                user=user, specialty='Cardiology', consultation_fee=fee,
+                available_time_slots=['09:00 - 09:30', '10:00 - 10:30', '11:00 - 11:30'],
+            ))
+        cls.day = datetime.date.today() + datetime.timedelta(days=3)
+
+    def book(self, doctor, day, hour, **extra):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=doctor, appointment_date=day, appointment_time=datetime.time(hour),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500, **extra,
+        )
+
+    def post(self, user, **data):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post('/api/appointment/bulk/doctor-range/', data, format='json')
+
+    def test_cancel_range_updates_fees_rollup_and_queues_mail(self):
+        from core.models import OutboundEmail
+        from .models import DailyAppointmentStats
+
+        doctor = self.doctors[0]
+        paid = self.book(doctor, self.day, 9, payment_status=True)
+        unpaid = self.book(doctor, self.day, 10)
+        done = self.book(doctor, self.day, 11, status='completed')
+        outside = self.book(doctor, self.day + datetime.timedelta(days=1), 9)
+
+        response = self.post(self.admin, doctor=doctor.id, action='cancel', reason='Doctor unwell', **{'from': self.day.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['cancelled'], 2)
+        self.assertEqual(response.data['total_refunds'], '400.00')
+        self.assertEqual(response.data['total_company_fees'], '200.00')
+
+        paid.refresh_from_db()
+        self.assertEqual((paid.status, paid.refunded, paid.payment_status), ('cancelled', True, False))
+        self.assertEqual(paid.refund_amount, 400)
+        unpaid.refresh_from_db()
+        self.assertEqual((unpaid.status, unpaid.refund_amount), ('cancelled', 0))
+        for untouched in (done, outside):
+            self.assertNotEqual(Appointment.objects.get(pk=untouched.pk).status, 'cancelled')
+
+        stats = DailyAppointmentStats.objects.get(date=self.day, doctor__isnull=True)
+        self.assertEqual((stats.cancellations, stats.refunds, stats.company_fees), (2, 400, 200))
+        self.assertEqual(OutboundEmail.objects.filter(recipients=['patient@example.com']).count(), 2)
+
+    def test_reschedule_moves_and_skips_taken_slots(self):
+        from .models import DailyAppointmentStats
+
+        source, cover = self.doctors
+        target_day = self.day + datetime.timedelta(days=7)
+        first = self.book(source, self.day, 9)
+        second = self.book(source, self.day, 10)
+        self.book(cover, target_day, 10)
+
+        response = self.post(
+            self.admin, doctor=source.id, action='reschedule', target_doctor=cover.id,
+            target_from=target_day.isoformat(), **{'from': self.day.isoformat()},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['appointment_ids'], [first.appointment_id])
+        self.assertEqual([s['appointment_id'] for s in response.data['skipped']], [second.appointment_id])
+
+        first.refresh_from_db()
+        self.assertEqual((first.doctor_id, first.appointment_date), (cover.id, target_day))
+        self.assertEqual(DailyAppointmentStats.objects.get(date=target_day, doctor=cover).count, 2)
+        self.assertEqual(DailyAppointmentStats.objects.get(date=self.day, doctor=source).count, 1)
+
+    def test_reschedule_respects_target_schedule_and_reprices(self):
+        from doctor import schedule
+
+        source, cover = self.doctors
+        target_day = self.day + datetime.timedelta(days=7)
+        first = self.book(source, self.day, 9)
+        on_leave = self.book(source, self.day, 10)
+        off_schedule = self.book(source, self.day, 11)
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleException.objects.create(doctor=cover, date=target_day, start_time=datetime.time(10), end_time=datetime.time(11))
+            cover.schedule_blocks.filter(start_time=datetime.time(11)).delete()
+        schedule.materialize(doctor_ids=[cover.pk])
+
+        response = self.post(
+            self.admin, doctor=source.id, action='reschedule', target_doctor=cover.id,
+            target_from=target_day.isoformat(), **{'from': self.day.isoformat()},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['appointment_ids'], [first.appointment_id])
+        self.assertEqual(
+            [(s['appointment_id'], s['reason']) for s in response.data['skipped']],
+            [(on_leave.appointment_id, 'unavailable'), (off_schedule.appointment_id, 'unavailable')],
+        )
+        first.refresh_from_db()
+        self.assertEqual((first.doctor_id, first.consultation_fee), (cover.id, 800))
+        self.assertGreater(first.updated_at, on_leave.updated_at)
+
+    def test_reschedule_keeps_paid_fee_and_skips_held_slots(self):
+        from django.utils import timezone
+        from .models import DailyAppointmentStats, SlotHold
+
+        source, cover = self.doctors
+        target_day = self.day + datetime.timedelta(days=7)
+        paid = self.book(source, self.day, 9, payment_status=True)
+        held = self.book(source, self.day, 10)
+        expired = self.book(source, self.day, 11)
+        SlotHold.objects.create(
+            doctor=cover, patient=self.admin, appointment_date=target_day, appointment_time=datetime.time(10),
+            expires_at=timezone.now() + datetime.timedelta(minutes=5),
+        )
+        SlotHold.objects.create(
+            doctor=cover, patient=self.admin, appointment_date=target_day, appointment_time=datetime.time(11),
+            expires_at=timezone.now() - datetime.timedelta(minutes=5),
+        )
+
+        response = self.post(
+            self.admin, doctor=source.id, action='reschedule', target_doctor=cover.id,
+            target_from=target_day.isoformat(), **{'from': self.day.isoformat()},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['appointment_ids'], [paid.appointment_id, expired.appointment_id])
+        self.assertEqual([(s['appointment_id'], s['reason']) for s in response.data['skipped']], [(held.appointment_id, 'held')])
+
+        # The paid booking keeps the fee the patient paid; the unpaid one is re-priced
+        paid.refresh_from_db()
+        expired.refresh_from_db()
+        self.assertEqual((paid.doctor_id, paid.consultation_fee), (cover.id, 500))
+        self.assertEqual(expired.consultation_fee, 800)
+        self.assertEqual(DailyAppointmentStats.objects.get(date=target_day, doctor=cover).revenue, 500 + 800)
+
+        # A later cancellation refunds from what was paid
+        from . import bulk
+        bulk.cancel_range(cover, target_day, target_day)
+        paid.refresh_from_db()
+        self.assertEqual(paid.refund_amount, 400)
+
+    def test_reschedule_conflict_is_409(self):
+        from unittest import mock
+        from django.db import IntegrityError
+
+        source, cover = self.doctors
+        with mock.patch('appointment.bulk.reschedule_range', side_effect=IntegrityError):
+            response = self.post(
+                self.admin, doctor=source.id, action='reschedule', target_doctor=cover.id,
+                target_from=self.day.isoformat(), **{'from': self.day.isoformat()},
+            )
+        self.assertEqual(response.status_code, 409)
+
+    def test_requires_admin_and_rejects_overlap(self):
+        doctor = self.doctors[0]
+        self.assertEqual(self.post(self.patient, doctor=doctor.id, action='cancel', **{'from': self.day.isoformat()}).status_code, 403)
+        response = self.post(
+            self.admin, doctor=doctor.id, action='reschedule', target_from=self.day.isoformat(),
+            **{'from': self.day.isoformat()},
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CHANGE_FEED_LAG_SECONDS=0)
+class ChangeFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.other = User.objects.create_user(email='other@example.com', password='pw', name='Other', role='customer')
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=user, specialty='Cardiology')
+        cls.day = datetime.date.today() + datetime.timedelta(days=2)
+
+    def book(self, patient, hour):
+        return Appointment.objects.create(
+            patient=patient, doctor=self.doctor, appointment_date=self.day, appointment_time=datetime.time(hour),
+            reason='Checkup', patient_name=patient.name, patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500,
+        )
+
+    def poll(self, user, kind='appointments', **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f'/api/appointment/changes/{kind}/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_feed_returns_only_changes_since_token(self):
+        first = self.book(self.patient, 9)
+        second = self.book(self.patient, 10)
+        self.book(self.other, 11)
+
+        page = self.poll(self.patient, limit=1)
+        self.assertEqual([row['id'] for row in page['changes']], [first.id])
+        self.assertTrue(page['has_more'])
+        page = self.poll(self.patient, since=page['next'])
+        self.assertEqual([row['id'] for row in page['changes']], [second.id])
+        self.assertFalse(page['has_more'])
+
+        token = page['next']
+        self.assertEqual(self.poll(self.patient, since=token)['changes'], [])
+
+        first.status = 'cancelled'
+        first.save(update_fields=['status', 'updated_at'])
+        second_id = second.id
+        second.delete()
+        page = self.poll(self.patient, since=token)
+        self.assertEqual([(row['id'], row['status']) for row in page['changes']], [(first.id, 'cancelled')])
+        self.assertEqual(page['deleted'], [second_id])
+        self.assertEqual(self.poll(self.patient, since=page['next'])['deleted'], [])
+
+    def test_feed_is_scoped_per_role(self):
+        from .models import Prescription
+
+        appointment = self.book(self.patient, 9)
+        self.book(self.other, 10)
+        Prescription.objects.create(appointment=appointment, doctor=self.doctor, patient=self.patient, medications=[], instructions='Rest')
+
+        self.assertEqual(len(self.poll(self.doctor.user)['changes']), 2)
+        self.assertEqual(len(self.poll(self.other)['changes']), 1)
+        pharmacist_rows = self.poll(self.pharmacist, kind='prescriptions')['changes']
+        self.assertEqual(len(pharmacist_rows), 1)
+        self.assertNotIn('diagnosis', pharmacist_rows[0])
+
+        client = APIClient()
+        client.force_authenticate(self.pharmacist)
+        self.assertEqual(client.get('/api/appointment/changes/appointments/').status_code, 403)
+        client.force_authenticate(self.patient)
+        self.assertEqual(client.get('/api/appointment/changes/appointments/', {'since': 'bogus'}).status_code, 400)
+
+    def test_lag_hides_rows_that_may_still_be_committing(self):
+        self.book(self.patient, 9)
+        with override_settings(CHANGE_FEED_LAG_SECONDS=60):
+            page = self.poll(self.patient)
+        self.assertEqual(page['changes'], [])
+        self.assertEqual(len(self.poll(self.patient, since=page['next'])['changes']), 1)
+
+    def test_lag_only_covers_commits_within_the_window(self):
+        # Documented limit: a row stamped before a token's mark but committed
+        # later than CHANGE_FEED_LAG_SECONDS after stamping is not served
+        from . import changes
+        from .models import Tombstone
+
+        appointment = self.book(self.patient, 9)
+        values = Appointment.objects.filter(patient=self.patient).values('id', 'updated_at')
+        tombstones = Tombstone.objects.none()
+        stamped = appointment.updated_at
+
+        with override_settings(CHANGE_FEED_LAG_SECONDS=2):
+            rows, _, _, _ = changes.read(values, tombstones, None, now=stamped + datetime.timedelta(seconds=1))
+            self.assertEqual(rows, [])
+            rows, _, token, _ = changes.read(values, tombstones, None, now=stamped + datetime.timedelta(seconds=3))
+            self.assertEqual([row['id'] for row in rows], [appointment.id])
+
+            late = self.book(self.patient, 10)
+            Appointment.objects.filter(pk=late.pk).update(updated_at=stamped - datetime.timedelta(seconds=1))
+            rows, _, _, _ = changes.read(values, tombstones, token, now=stamped + datetime.timedelta(seconds=4))
+            self.assertEqual(rows, [])
+
+    def test_moving_to_another_doctor_tombstones_the_previous_doctor(self):
+        from doctor.models import DoctorSlot
+        from . import bulk
+
+        user = User.objects.create_user(email='doc2@example.com', password='pw', name='Doctor Two', role='doctor')
+        second = DoctorProfile.objects.create(user=user, specialty='Cardiology')
+        appointment = self.book(self.patient, 9)
+        token = self.poll(self.doctor.user)['next']
+        patient_token = self.poll(self.patient)['next']
+        admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', role='admin', is_staff=True)
+        admin_token = self.poll(admin)['next']
+
+        appointment.doctor = second
+        appointment.save()
+        page = self.poll(self.doctor.user, since=token)
+        self.assertEqual((page['changes'], page['deleted']), ([], [appointment.id]))
+        self.assertEqual([row['id'] for row in self.poll(second.user)['changes']], [appointment.id])
+        self.assertEqual(self.poll(self.patient, since=patient_token)['deleted'], [])
+        self.assertEqual(self.poll(admin, since=admin_token)['deleted'], [])
+
+        # The bulk path hands it back; the stale tombstone for the first doctor goes
+        second_token = self.poll(second.user)['next']
+        DoctorSlot.objects.get_or_create(doctor=self.doctor, date=self.day, start_time=datetime.time(9), defaults={'end_time': datetime.time(9, 30)})
+        result = bulk.reschedule_range(second, self.day, self.day, self.day, target_doctor=self.doctor)
+        self.assertEqual(result['moved'], 1)
+        self.assertEqual(self.poll(second.user, since=second_token)['deleted'], [appointment.id])
+        page = self.poll(self.doctor.user, since=token)
+        self.assertEqual(([row['id'] for row in page['changes']], page['deleted']), ([appointment.id], []))
+
+
+class PrescriptionQueueStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Prescription
+
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=user, specialty='Cardiology')
+        appointment = Appointment.objects.create(
+            patient=cls.patient, doctor=cls.doctor, appointment_date=datetime.date.today(), appointment_time=datetime.time(9),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500,
+        )
+        cls.prescription = Prescription.objects.create(
+            appointment=appointment, doctor=cls.doctor, patient=cls.patient, medications=[], instructions='Rest',
+        )
+
+    def test_local_broker_fans_out_to_every_subscriber(self):
+        from core.pubsub import LocalBroker
+
+        broker = LocalBroker()
+        first, second = broker.subscribe('queue'), broker.subscribe('queue')
+        other = broker.subscribe('elsewhere')
+        self.assertEqual(broker.publish('queue', {'n': 1}), 2)
+        self.assertEqual(first.get(timeout=0), {'n': 1})
+        self.assertEqual(second.get(timeout=0), {'n': 1})
+        self.assertIsNone(other.get(timeout=0))
+
+        first.close()
+        self.assertEqual(broker.publish('queue', {'n': 2}), 1)
+
+    def test_local_broker_warns_with_several_workers(self):
+        from core import pubsub
+
+        with override_settings(PUBSUB_BROKER='core.pubsub.LocalBroker', WEB_CONCURRENCY=4):
+            self.assertEqual([w.id for w in pubsub.check_broker()], ['core.W001'])
+        with override_settings(PUBSUB_BROKER='core.pubsub.LocalBroker', WEB_CONCURRENCY=1):
+            self.assertEqual(pubsub.check_broker(), [])
+        with override_settings(PUBSUB_BROKER='core.pubsub.Broker', WEB_CONCURRENCY=4):
+            self.assertEqual(pubsub.check_broker(), [])
+
+    def test_dispense_is_published_after_commit_and_streamed(self):
+        from core import pubsub
+        from . import queue
+
+        subscription = pubsub.get_broker().subscribe(queue.PRESCRIPTION_CHANNEL)
+        client = APIClient()
+        client.force_authenticate(self.pharmacist)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = client.post(f'/api/appointment/prescriptions/{self.prescription.pk}/dispense/', {'dispensed': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(subscription.get(timeout=0))
+        for callback in callbacks:
+            callback()
+
+        frames = list(queue.stream_sync(subscription, heartbeat=0.01, max_seconds=0.05))
+        self.assertEqual(frames[0], 'retry: 3000\n\n')
+        self.assertTrue(frames[1].startswith('event: prescription.dispensed\ndata: {"id": %d' % self.prescription.pk))
+        self.assertIn(': keepalive\n\n', frames[2:])
+        self.assertNotIn(subscription, pubsub.get_broker()._subscribers.get(queue.PRESCRIPTION_CHANNEL, ()))
+
+    def test_stream_is_limited_to_pharmacists(self):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        response = client.get('/api/appointment/prescriptions/pharmacist/stream/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 403)
+
+        client.force_authenticate(self.pharmacist)
+        with override_settings(SSE_MAX_STREAM_SECONDS=0):
+            response = client.get('/api/appointment/prescriptions/pharmacist/stream/', HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(b''.join(response.streaming_content), b'retry: 3000\n\n')
+
+    async def test_asgi_stream_flushes_frames_before_it_ends(self):
+        import asyncio
+        from django.test import AsyncClient
+        from rest_framework_simplejwt.tokens import AccessToken
+        from core import pubsub
+        from . import queue
+
+        headers = {'accept': 'text/event-stream', 'authorization': f'Bearer {AccessToken.for_user(self.pharmacist)}'}
+        with override_settings(SSE_HEARTBEAT_SECONDS=60, SSE_MAX_STREAM_SECONDS=60):
+            response = await AsyncClient().get('/api/appointment/prescriptions/pharmacist/stream/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+
+        frames = response.streaming_content
+        self.assertEqual(await asyncio.wait_for(anext(frames), 5), b'retry: 3000\n\n')
+        pubsub.get_broker().publish(queue.PRESCRIPTION_CHANNEL, {'event': 'prescription.dispensed', 'data': {'id': 1}})
+        frame = await asyncio.wait_for(anext(frames), 5)
+        self.assertTrue(frame.startswith(b'event: prescription.dispensed\n'))
+        # What the ASGI handler does once the client has gone
+        response.close()
+        self.assertFalse(pubsub.get_broker()._subscribers.get(queue.PRESCRIPTION_CHANNEL))
+
+
+class PrescriptionItemTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from pharmacy.models import Medicine
+
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=user, specialty='Cardiology')
+        cls.para_500 = Medicine.objects.create(name='Paracetamol', weight_or_volume='500mg', stock_count=40)
+        cls.para_650 = Medicine.objects.create(name='Paracetamol', weight_or_volume='650mg', stock_count=10)
+        cls.amox = Medicine.objects.create(name='Amoxicillin', weight_or_volume='250mg', stock_count=5)
+
+    def appointment(self, hour):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=datetime.date.today(), appointment_time=datetime.time(hour),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500, status='confirmed',
+        )
+
+    def test_resolver_matches_conservatively(self):
+        from .prescription_items import MedicineResolver
+
+        resolver = MedicineResolver(['Paracetamol 500 mg', 'amoxycillin', 'Ibuprofen'])
+        self.assertEqual(resolver.resolve('Paracetamol', '650mg twice daily'), self.para_650.id)
+        self.assertEqual(resolver.resolve('paracetamol-500mg'), self.para_500.id)
+        self.assertEqual(resolver.resolve('amoxycillin'), self.amox.id)
+        self.assertIsNone(resolver.resolve('Paracetamol', '1 tablet'))
+        self.assertIsNone(resolver.resolve('Ibuprofen'))
+
+    def test_resolver_loads_hyphenated_names(self):
+        from pharmacy.models import Medicine
+        from .prescription_items import MedicineResolver
+
+        co_amox = Medicine.objects.create(name='Co-amoxiclav', weight_or_volume='625 mg', stock_count=10)
+        b_complex = Medicine.objects.create(name='B-Complex', stock_count=10)
+        resolver = MedicineResolver(['Co-amoxiclav', 'b complex'])
+        self.assertEqual(resolver.resolve('Co-amoxiclav'), co_amox.id)
+        self.assertEqual(resolver.resolve('co amoxiclav 625mg'), co_amox.id)
+        self.assertEqual(resolver.resolve('b complex'), b_complex.id)
+
+    def test_resolver_splits_many_prefixes_across_queries(self):
+        from .prescription_items import MedicineResolver
+
+        # 2000 distinct prefixes would overflow SQLite's expression depth in one OR chain
+        names = [f'{i:04d}' for i in range(2000)] + ['Amoxicillin']
+        with CaptureQueriesContext(connection) as queries:
+            resolver = MedicineResolver(names)
+        self.assertEqual(len(queries), 11)
+        self.assertEqual(resolver.resolve('Amoxicillin'), self.amox.id)
+
+    def test_created_prescription_gets_items_and_shows_in_demand(self):
+        client = APIClient()
+        client.force_authenticate(self.doctor.user)
+        response = client.post('/api/appointment/prescriptions/create/', {
+            'appointment': self.appointment(9).id,
+            'medications': [
+                {'name': 'Amoxicillin', 'dosage': '1 capsule', 'duration': '5 days'},
+                {'name': 'Mystery tonic', 'dosage': '5ml', 'duration': '3 days'},
+            ],
+            'instructions': 'After meals',
+            'diagnosis': 'Infection',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        items = list(PrescriptionItem.objects.filter(prescription_id=response.data['prescription']['id']))
+        self.assertEqual([(i.position, i.name, i.medicine_id) for i in items], [(0, 'Amoxicillin', self.amox.id), (1, 'Mystery tonic', None)])
+
+        client.force_authenticate(self.pharmacist)
+        demand = client.get('/api/appointment/prescriptions/demand/').data
+        self.assertEqual(demand['demand'], [{'medicine_id': self.amox.id, 'name': 'Amoxicillin', 'stock_count': 5, 'open_prescriptions': 1}])
+        self.assertEqual(demand['unmatched_items'], 1)
+        listed = client.get('/api/appointment/prescriptions/pharmacist/', {'medicine': self.para_500.id}).data
+        self.assertEqual(listed['prescriptions'], [])
+
+    def test_backfill_creates_missing_items_once(self):
+        from django.core.management import call_command
+        from .models import Prescription
+
+        for hour in (9, 10):
+            Prescription.objects.create(
+                appointment=self.appointment(hour), doctor=self.doctor, patient=self.patient, instructions='Rest',
+                medications=[{'name': 'Paracetamol 500mg', 'dosage': '1 tablet', 'duration': '3 days'}],
+            )
+        call_command('backfill_prescription_items', batch_size=1, stdout=io.StringIO())
+        call_command('backfill_prescription_items', stdout=io.StringIO())
+        self.assertEqual(list(PrescriptionItem.objects.values_list('medicine_id', flat=True)), [self.para_500.id] * 2)
+
+
+class DispenseSaleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from pharmacy.models import Medicine
+
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=user, specialty='Cardiology')
+        cls.medicines = [
+            Medicine.objects.create(name=f'Drug{i}', price='10.00', discount='10.00', stock_count=5)
+            for i in range(3)
+        ]
+
+    def prescription(self, hour, medicines):
+        from .models import Prescription
+        from . import prescription_items
+
+        appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=datetime.date.today(), appointment_time=datetime.time(hour),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500, status='completed',
+        )
+        prescription = Prescription.objects.create(
+            appointment=appointment, doctor=self.doctor, patient=self.patient, instructions='Rest',
+            medications=[{'name': m.name, 'dosage': '1', 'duration': '1 day'} for m in medicines],
+        )
+        prescription_items.sync_items(prescription)
+        return prescription
+
+    def dispense(self, prescription, **payload):
+        client = APIClient()
+        client.force_authenticate(self.pharmacist)
+        return client.post(f'/api/appointment/prescriptions/{prescription.pk}/dispense-sale/', payload, format='json')
+
+    def test_sale_stock_and_dispense_are_written_together(self):
+        prescription = self.prescription(9, self.medicines)
+        response = self.dispense(prescription)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['sale']['subtotal'], response.data['sale']['tax'], response.data['sale']['total']), ('27.00', '1.35', '28.35'))
+
+        prescription.refresh_from_db()
+        self.assertTrue(prescription.dispensed)
+        self.assertEqual(prescription.sale.items.count(), 3)
+        self.assertEqual([m.stock_count for m in type(self.medicines[0]).objects.order_by('id')], [4, 4, 4])
+        self.assertEqual(self.dispense(prescription).status_code, 409)
+
+    def test_shortage_rolls_everything_back(self):
+        from pharmacy.models import Sale
+
+        prescription = self.prescription(9, self.medicines[:1])
+        response = self.dispense(prescription, items=[{'medicine_id': self.medicines[0].id, 'qty': 6}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['shortages'], [{'product_id': self.medicines[0].id, 'requested': 6, 'available': 5}])
+        prescription.refresh_from_db()
+        self.assertFalse(prescription.dispensed)
+        self.assertFalse(Sale.objects.exists())
+        self.medicines[0].refresh_from_db()
+        self.assertEqual(self.medicines[0].stock_count, 5)
+
+    def test_query_count_does_not_grow_with_items(self):
+        counts = []
+        for hour, medicines in ((9, self.medicines[:1]), (10, self.medicines)):
+            prescription = self.prescription(hour, medicines)
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.dispense(prescription).status_code, 201)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class AppointmentIdempotencyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=user, specialty='Cardiology', available_time_slots=['09:00 - 09:30'])
+
+    def test_retried_booking_is_replayed_not_duplicated(self):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        payload = {
+            'doctor': self.doctor.id, 'appointment_date': (datetime.date.today() + datetime.timedelta(days=1)).isoformat(),
+            'appointment_time': '09:00', 'patient_name': 'Patient', 'patient_age': 30, 'patient_gender': 'female',
+            'patient_phone': '0771234567', 'consultation_fee': '500.00', 'payment_method': 'cash_on_arrival',
+            'reason': 'Checkup',
+        }
+        first = client.post('/api/appointment/appointments/create/', payload, format='json', HTTP_IDEMPOTENCY_KEY='book-1')
+        retry = client.post('/api/appointment/appointments/create/', payload, format='json', HTTP_IDEMPOTENCY_KEY='book-1')
+        self.assertEqual(first.status_code, 201, first.content)
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        # Without a key a retry is a new booking attempt and hits the taken slot
+        self.assertEqual(client.post('/api/appointment/appointments/create/', payload, format='json').status_code, 409)
+
+
+class SlotHoldTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.other = User.objects.create_user(email='other@example.com', password='pw', name='Other', role='customer')
+        user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=user, specialty='Cardiology')
+        cls.day = datetime.date.today() + datetime.timedelta(days=2)
+        cls.time = datetime.time(9)
+
+    def book(self, patient, status='pending', **extra):
+        return Appointment.objects.create(
+            patient=patient, doctor=self.doctor, appointment_date=self.day, appointment_time=self.time,
+            reason='Checkup', patient_name=patient.name, patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500, status=status, **extra,
+        )
+
+    def claim(self, patient):
+        from django.db import transaction
+        from . import booking
+
+        with transaction.atomic():
+            booking.claim_slot(self.doctor, self.day, self.time, patient)
+            return self.book(patient)
+
+    def test_hold_blocks_other_patients_until_it_expires(self):
+        from django.utils import timezone
+        from . import booking
+        from .models import SlotHold
+
+        hold = booking.place_hold(self.doctor, self.day, self.time, self.patient)
+        with self.assertRaises(booking.SlotUnavailable):
+            booking.place_hold(self.doctor, self.day, self.time, self.other)
+        with self.assertRaises(booking.SlotUnavailable):
+            self.claim(self.other)
+        # The failed claim rolled back, so the hold is still there
+        self.assertTrue(SlotHold.objects.filter(pk=hold.pk).exists())
+
+        SlotHold.objects.filter(pk=hold.pk).update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.claim(self.other)
+        self.assertFalse(SlotHold.objects.exists())
+
+    def test_owner_books_own_hold_with_one_statement(self):
+        from django.db import transaction
+        from . import booking
+        from .models import SlotHold
+
+        booking.place_hold(self.doctor, self.day, self.time, self.patient)
+        with transaction.atomic(), self.assertNumQueries(1):
+            booking.claim_slot(self.doctor, self.day, self.time, self.patient)
+        self.assertFalse(SlotHold.objects.exists())
+        with transaction.atomic(), self.assertNumQueries(1):
+            booking.claim_slot(self.doctor, self.day, self.time, self.patient)
+
+    def test_constraint_allows_one_live_booking_per_slot(self):
+        from django.db import IntegrityError, transaction
+
+        self.book(self.patient, status='cancelled')
+        self.book(self.patient)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.book(self.other)
+
+    def test_cancel_duplicate_bookings_before_constraint(self):
+        from django.core.management import call_command
+        from django.db import connection
+
+        # Stand in for a database that predates the constraint
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX unique_active_doctor_slot')
+        first = self.book(self.patient)
+        paid = self.book(self.other, payment_status=True)
+        late = self.book(self.other)
+
+        out = io.StringIO()
+        call_command('cancel_duplicate_bookings', '--dry-run', stdout=out)
+        self.assertIn('Would cancel 2', out.getvalue())
+        self.assertEqual(Appointment.objects.exclude(status='cancelled').count(), 3)
+
+        call_command('cancel_duplicate_bookings', stdout=io.StringIO())
+        self.assertEqual(
+            dict(Appointment.objects.values_list('pk', 'status')),
+            {first.pk: 'cancelled', paid.pk: 'pending', late.pk: 'cancelled'},
+        )
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=user, specialty='Cardiology')
+        cls.other_doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user(email='doc2@example.com', password='pw', name='Doctor 2', role='doctor'),
+            specialty='Dermatology',
+        )
+        cls.today = datetime.date(2030, 5, 10)
+        # Two doctors share each (date, time), so pages must break ties on id
+        for offset in (-1, 0, 1):
+            for hour in (9, 10, 11):
+                for doctor in (cls.doctor, cls.other_doctor):
+                    Appointment.objects.create(
+                        patient=cls.patient, doctor=doctor, appointment_date=cls.today + datetime.timedelta(days=offset),
+                        appointment_time=datetime.time(hour), reason='Checkup', patient_name='Patient',
+                        patient_age=30, patient_gender='Male', patient_phone='123', consultation_fee=500,
+                    )
+
+    def walk(self, qs, limit, descending):
+        from . import pagination
+
+        seen, cursor = [], None
+        while True:
+            rows, cursor = pagination.paginate(qs, cursor=cursor, limit=limit, descending=descending)
+            self.assertLessEqual(len(rows), limit)
+            seen.extend(row['id'] if isinstance(row, dict) else row.pk for row in rows)
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_row_once_in_order(self):
+        qs = Appointment.objects.all()
+        ascending = list(qs.order_by('appointment_date', 'appointment_time', 'id').values_list('id', flat=True))
+        for limit in (1, 4, 18, 50):
+            self.assertEqual(self.walk(qs, limit, descending=False), ascending)
+            self.assertEqual(self.walk(qs, limit, descending=True), ascending[::-1])
+        # values() rows carry the same cursor as instances
+        self.assertEqual(
+            self.walk(qs.values('id', 'appointment_date', 'appointment_time'), 5, descending=False), ascending,
+        )
+
+    def test_cursor_round_trip(self):
+        from . import pagination
+
+        appointment = Appointment.objects.first()
+        cursor = pagination.encode_cursor(appointment)
+        self.assertEqual(
+            pagination.decode_cursor(cursor),
+            (appointment.appointment_date, appointment.appointment_time, appointment.pk),
+        )
+        self.assertEqual(
+            cursor,
+            pagination.encode_cursor({'appointment_date': appointment.appointment_date,
+                                      'appointment_time': appointment.appointment_time, 'id': appointment.pk}),
+        )
+
+    def test_bad_cursors_are_rejected(self):
+        import base64
+        from . import pagination
+
+        def b64(raw):
+            return base64.urlsafe_b64encode(raw).decode()
+
+        for value in ('!!!', 'abc', b64(b'2030-05-10|09:00'), b64(b'2030-13-01|09:00|1'),
+                      b64(b'2030-05-10|25:00|1'), b64(b'2030-05-10|09:00|x'), b64(b'\xff\xfe')):
+            with self.subTest(value=value), self.assertRaises(pagination.InvalidCursor):
+                pagination.paginate(Appointment.objects.all(), cursor=value)
+
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        response = client.get('/api/appointment/appointments/', {'cursor': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_parse_limit(self):
+        from . import pagination
+
+        self.assertEqual(pagination.parse_limit(None), pagination.DEFAULT_PAGE_SIZE)
+        self.assertEqual(pagination.parse_limit('junk'), pagination.DEFAULT_PAGE_SIZE)
+        self.assertEqual(pagination.parse_limit('0'), 1)
+        self.assertEqual(pagination.parse_limit('5'), 5)
+        self.assertEqual(pagination.parse_limit('100000'), pagination.MAX_PAGE_SIZE)
+
+    def test_split_by_time(self):
+        from . import pagination
+
+        qs = Appointment.objects.all()
+        now = datetime.datetime.combine(self.today, datetime.time(10))
+        upcoming = pagination.split_by_time(qs, 'upcoming', now)
+        past = pagination.split_by_time(qs, 'past', now)
+
+        # An appointment starting exactly now is still upcoming
+        self.assertEqual(upcoming.count(), 2 * 2 + 6)
+        self.assertEqual(past.count(), 2 + 6)
+        self.assertFalse(upcoming.filter(pk__in=past.values('pk')).exists())
+        self.assertTrue(upcoming.filter(appointment_date=self.today, appointment_time=datetime.time(10)).exists())
+        self.assertEqual(pagination.split_by_time(qs, None, now).count(), qs.count())
+
+    def test_scoped_pages_through_the_view(self):
+        from unittest import mock
+
+        from django.utils import timezone
+
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        now = timezone.make_aware(datetime.datetime.combine(self.today, datetime.time(10)))
+        seen, cursor = [], None
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            while True:
+                params = {'scope': 'upcoming', 'limit': 4}
+                if cursor:
+                    params['cursor'] = cursor
+                response = client.get('/api/appointment/appointments/', params)
+                self.assertEqual(response.status_code, 200)
+                seen.extend((a['appointment_date'], a['appointment_time'][:5]) for a in response.data['appointments'])
+                cursor = response.data['next_cursor']
+                if cursor is None:
+                    break
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(seen[0], (self.today.isoformat(), '10:00'))
+
+
+class AppointmentStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', role='admin')
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.doctors = [
+            DoctorProfile.objects.create(
+                user=User.objects.create_user(email=f'doc{i}@example.com', password='pw', name=f'Doctor {i}', role='doctor'),
+                specialty='Cardiology',
+            )
+            for i in range(2)
+        ]
+        cls.day = datetime.date.today()
+
+    def book(self, doctor, hour, day=None, **extra):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=doctor, appointment_date=day or self.day, appointment_time=datetime.time(hour),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500, **extra,
+        )
+
+    def rollup(self):
+        from .models import DailyAppointmentStats
+
+        return {
+            (row['date'], row['doctor_id']): (
+                row['count'], row['revenue'], row['cancellations'], row['completed'], row['refunds'], row['company_fees'],
+            )
+            for row in DailyAppointmentStats.objects.values()
+            if row['count'] or row['cancellations'] or row['completed'] or row['revenue']
+        }
+
+    def assertMatchesRebuild(self):
+        from . import rollups
+
+        incremental = self.rollup()
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rollup())
+        return incremental
+
+    def test_save_and_delete_apply_deltas(self):
+        first, second = self.doctors
+        appointment = self.book(first, 9)
+        self.book(second, 9)
+        stats = self.assertMatchesRebuild()
+        self.assertEqual(stats[(self.day, None)][:2], (2, 1000))
+        self.assertEqual(stats[(self.day, first.pk)][:2], (1, 500))
+
+        # Full save through an instance loaded by from_db
+        appointment = Appointment.objects.get(pk=appointment.pk)
+        appointment.status = 'cancelled'
+        appointment.refund_amount = 400
+        appointment.company_fee = 100
+        appointment.save()
+        stats = self.assertMatchesRebuild()
+        self.assertEqual(stats[(self.day, first.pk)], (1, 500, 1, 0, 400, 100))
+
+        # update_fields only moves what is written
+        appointment.consultation_fee = 900
+        appointment.status = 'completed'
+        appointment.save(update_fields=['status', 'updated_at'])
+        stats = self.assertMatchesRebuild()
+        self.assertEqual(stats[(self.day, first.pk)][:4], (1, 500, 0, 1))
+
+        # Deferred fields fall back to reading the stored snapshot
+        moved = Appointment.objects.only('id', 'appointment_id').get(pk=appointment.pk)
+        moved.appointment_date = self.day + datetime.timedelta(days=1)
+        moved.save(update_fields=['appointment_date', 'updated_at'])
+        stats = self.assertMatchesRebuild()
+        self.assertNotIn((self.day, first.pk), stats)
+        self.assertEqual(stats[(moved.appointment_date, first.pk)][:4], (1, 500, 0, 1))
+
+        Appointment.objects.get(pk=appointment.pk).delete()
+        stats = self.assertMatchesRebuild()
+        self.assertNotIn((moved.appointment_date, None), stats)
+        self.assertEqual(stats[(self.day, None)][:2], (1, 500))
+
+    def test_cascade_and_queryset_deletes_leave_the_rollup(self):
+        from . import counters
+
+        other = User.objects.create_user(email='other@example.com', password='pw', name='Other', role='customer')
+        self.book(self.doctors[0], 9)
+        self.book(self.doctors[1], 10)
+        Appointment.objects.create(
+            patient=other, doctor=self.doctors[1], appointment_date=self.day, appointment_time=datetime.time(11),
+            reason='Checkup', patient_name='Other', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=300,
+        )
+        counters.reconcile()
+
+        self.doctors[0].user.delete()
+        self.assertEqual(self.assertMatchesRebuild()[(self.day, None)][:2], (2, 800))
+        other.delete()
+        self.assertEqual(self.assertMatchesRebuild()[(self.day, None)][:2], (1, 500))
+        Appointment.objects.all().delete()
+        self.assertEqual(self.assertMatchesRebuild(), {})
+
+        before = counters.get_overview()
+        counters.reconcile()
+        self.assertEqual(counters.get_overview(), before)
+        self.assertEqual(before['total_appointments'], 0)
+
+    def test_backfill_command_rebuilds_from_appointments(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from .models import DailyAppointmentStats
+
+        self.book(self.doctors[0], 9)
+        self.book(self.doctors[1], 10, day=self.day - datetime.timedelta(days=3), status='completed')
+        expected = self.rollup()
+        DailyAppointmentStats.objects.update(count=99)
+
+        out = io.StringIO()
+        call_command('backfill_appointment_stats', '--from', self.day.isoformat(), stdout=out)
+        self.assertIn('Rebuilt 2 ', out.getvalue())
+        # Rows before --from are left as they were
+        self.assertEqual(DailyAppointmentStats.objects.filter(date__lt=self.day).values_list('count', flat=True).first(), 99)
+
+        call_command('backfill_appointment_stats', stdout=io.StringIO())
+        self.assertEqual(self.rollup(), expected)
+
+        # The scheduled repair only rebuilds recent days
+        DailyAppointmentStats.objects.update(count=99)
+        call_command('backfill_appointment_stats', '--recent-days', '1', stdout=io.StringIO())
+        self.assertEqual(DailyAppointmentStats.objects.filter(date__lt=self.day - datetime.timedelta(days=1)).values_list('count', flat=True).first(), 99)
+        self.assertEqual(DailyAppointmentStats.objects.get(date=self.day, doctor__isnull=True).count, 1)
+        with self.assertRaises(CommandError):
+            call_command('backfill_appointment_stats', '--to', 'tomorrow')
+
+    def test_stats_view(self):
+        from .views import AdminAppointmentStatsView
+
+        self.book(self.doctors[0], 9, payment_status=True)
+        self.book(self.doctors[1], 9)
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        self.assertEqual(client.get('/api/appointment/stats/').status_code, 403)
+
+        client.force_authenticate(self.admin)
+        response = client.get('/api/appointment/stats/', {'days': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['labels'][-1], self.day.isoformat())
+        self.assertEqual(response.data['counts'], [0, 0, 2])
+        self.assertEqual(response.data['total_revenue'], '1000.0')
+
+        response = client.get('/api/appointment/stats/', {'from': self.day.isoformat(), 'to': self.day.isoformat(), 'doctor': self.doctors[1].pk})
+        self.assertEqual((response.data['counts'], response.data['revenues']), ([1], [500.0]))
+
+        end = self.day + datetime.timedelta(days=AdminAppointmentStatsView.MAX_DAYS)
+        self.assertEqual(client.get('/api/appointment/stats/', {'from': self.day.isoformat(), 'to': end.isoformat()}).status_code, 400)
+        end -= datetime.timedelta(days=1)
+        response = client.get('/api/appointment/stats/', {'from': self.day.isoformat(), 'to': end.isoformat()})
+        self.assertEqual(len(response.data['labels']), AdminAppointmentStatsView.MAX_DAYS)
+        self.assertEqual(response.data['labels'][0], self.day.isoformat())
+
+        for params in ({'from': 'yesterday'}, {'from': self.day.isoformat(), 'to': (self.day - datetime.timedelta(days=1)).isoformat()},
+                       {'doctor': 'x'}):
+            self.assertEqual(client.get('/api/appointment/stats/', params).status_code, 400)
+
+
+class OverviewCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', role='admin')
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.doctor = DoctorProfile.objects.create(
+            user=User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor'),
+            specialty='Cardiology',
+        )
+        cls.day = datetime.date.today() + datetime.timedelta(days=1)
+
+    def book(self, hour, **extra):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=self.day, appointment_time=datetime.time(hour),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee='500.50', **extra,
+        )
+
+    def overview(self):
+        from . import counters
+
+        return counters.get_overview()
+
+    def test_counters_follow_writes_after_reconcile(self):
+        from django.core.management import call_command
+        from .models import OverviewCounter
+        from . import counters
+
+        # A bump that finds no row seeds it from a recount, which includes the write
+        OverviewCounter.objects.all().delete()
+        self.book(9)
+        self.assertEqual(self.overview()['total_appointments'], 1)
+        self.assertEqual(self.overview()['total_doctors'], 0)
+
+        out = io.StringIO()
+        call_command('reconcile_overview_counters', stdout=out)
+        self.assertIn('1 doctors, 1 appointments, 1 pending', out.getvalue())
+
+        second = self.book(10, status='confirmed')
+        self.assertEqual(self.overview(), {
+            'total_doctors': 1, 'total_appointments': 2, 'pending_payments': 1, 'total_revenue': Decimal('1001.00'),
+        })
+
+        second.status = 'pending'
+        second.consultation_fee = 100
+        second.save()
+        self.assertEqual(self.overview()['pending_payments'], 2)
+        self.assertEqual(self.overview()['total_revenue'], Decimal('600.50'))
+
+        second.delete()
+        other = DoctorProfile.objects.create(
+            user=User.objects.create_user(email='doc2@example.com', password='pw', name='Doctor 2', role='doctor'),
+            specialty='Dermatology',
+        )
+        self.assertEqual(self.overview(), {
+            'total_doctors': 2, 'total_appointments': 1, 'pending_payments': 1, 'total_revenue': Decimal('500.50'),
+        })
+        other.delete()
+        self.assertEqual(self.overview()['total_doctors'], 1)
+        # The running totals agree with a full recount
+        before = self.overview()
+        counters.reconcile()
+        self.assertEqual(self.overview(), before)
+
+    def test_rolled_back_write_does_not_bump(self):
+        from django.db import transaction
+        from . import counters
+
+        counters.reconcile()
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.book(9)
+            # The bump is part of the write's transaction
+            self.assertEqual(self.overview()['total_appointments'], 1)
+            raise RuntimeError
+        self.assertEqual(self.overview()['total_appointments'], 0)
+
+    def test_reconcile_repairs_drift_and_reads_do_not(self):
+        from .models import OverviewCounter
+        from . import counters
+
+        self.book(9)
+        counters.reconcile()
+        OverviewCounter.objects.filter(name=counters.TOTAL_APPOINTMENTS).update(value=42)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.overview()['total_appointments'], 42)
+        self.assertEqual(counters.reconcile()[counters.TOTAL_APPOINTMENTS], 1)
+        self.assertEqual(self.overview()['total_appointments'], 1)
+
+    def test_overview_view(self):
+        from . import counters
+
+        self.book(9)
+        counters.reconcile()
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        self.assertEqual(client.get('/api/appointment/overview/').status_code, 403)
+        client.force_authenticate(self.admin)
+        response = client.get('/api/appointment/overview/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['total_doctors'], response.data['total_appointments'], response.data['total_revenue']),
+            (1, 1, '500.5'),
+        )
+
+
+class DoctorAvailabilityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+        cls.user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(
+            user=cls.user, specialty='Cardiology', available_time_slots=['09:00 - 09:30', '10:00 - 10:30'],
+        )
+        cls.day = datetime.date.today() + datetime.timedelta(days=1)
+
+    def days(self, **params):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        params.setdefault('doctor', self.doctor.pk)
+        params.setdefault('from', self.day.isoformat())
+        params.setdefault('to', (self.day + datetime.timedelta(days=1)).isoformat())
+        response = client.get('/api/appointment/availability/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return {day['date']: day['slots'] for day in response.data['days']}
+
+    def test_bookings_and_leave_remove_slots(self):
+        after = self.day + datetime.timedelta(days=1)
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=self.day, appointment_time=datetime.time(9),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500,
+        )
+        # A cancelled booking frees its slot again
+        Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=self.day, appointment_time=datetime.time(10),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500, status='cancelled',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleException.objects.create(doctor=self.doctor, date=after, start_time=datetime.time(10), end_time=datetime.time(11))
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.days(), {
+                self.day.isoformat(): ['10:00:00'],
+                after.isoformat(): ['09:00:00'],
+            })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleException.objects.create(date=after, kind='holiday')
+        self.assertEqual(self.days(), {self.day.isoformat(): ['10:00:00']})
+
+    def test_started_slots_today_are_omitted(self):
+        from django.utils import timezone
+        from . import availability
+
+        now = timezone.make_aware(datetime.datetime.combine(self.day, datetime.time(9, 15)))
+        self.assertEqual(
+            availability.free_slots(self.doctor, self.day - datetime.timedelta(days=1), self.day, now=now),
+            [(self.day, [datetime.time(10)])],
+        )
+
+    def test_range_is_validated(self):
+        from . import availability
+
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        too_far = self.day + datetime.timedelta(days=availability.MAX_RANGE_DAYS)
+        for params in (
+            {'from': self.day.isoformat(), 'to': too_far.isoformat()},
+            {'from': self.day.isoformat(), 'to': (self.day - datetime.timedelta(days=1)).isoformat()},
+            {'from': 'soon'},
+        ):
+            response = client.get('/api/appointment/availability/', dict(params, doctor=self.doctor.pk))
+            self.assertEqual(response.status_code, 400, params)
+        self.assertEqual(client.get('/api/appointment/availability/', {'doctor': 'x'}).status_code, 400)
+        ok = client.get('/api/appointment/availability/', {
+            'doctor': self.doctor.pk, 'from': self.day.isoformat(), 'to': (too_far - datetime.timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(ok.status_code, 200)
+
+    def test_schedule_edit_is_visible_on_the_next_request(self):
+        self.assertEqual(self.days()[self.day.isoformat()], ['09:00:00', '10:00:00'])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.put('/api/doctor/doctor/profile/', {'available_time_slots': '["11:00 - 11:30"]'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.days()[self.day.isoformat()], ['11:00:00'])
@@ -6,11 +6,21 @@ urlpatterns = [
     path('appointments/create/', views.AppointmentCreateView.as_view(), name='appointment-create'),
     path('appointments/<int:pk>/', views.AppointmentDetailView.as_view(), name='appointment-detail'),
     path('appointments/<int:pk>/cancel/', views.AppointmentCancelView.as_view(), name='appointment-cancel'),
+    path('holds/', views.SlotHoldView.as_view(), name='slot-hold-create'),
+    path('holds/<uuid:token>/', views.SlotHoldDetailView.as_view(), name='slot-hold-detail'),
+    path('availability/', views.DoctorAvailabilityView.as_view(), name='appointment-availability'),
+    path('availability/earliest/', views.EarliestAvailableView.as_view(), name='appointment-earliest-available'),
+    path('bulk/doctor-range/', views.AdminDoctorAppointmentsBulkView.as_view(), name='appointment-bulk-doctor-range'),
+    path('changes/appointments/', views.ChangeFeedView.as_view(kind='appointment'), name='appointment-changes'),
+    path('changes/prescriptions/', views.ChangeFeedView.as_view(kind='prescription'), name='prescription-changes'),
     path('stats/', views.AdminAppointmentStatsView.as_view(), name='appointment-stats'),
     path('overview/', views.AdminOverviewView.as_view(), name='appointment-overview'),
     path('prescriptions/', views.PrescriptionListView.as_view(), name='prescription-list'),
     path('prescriptions/create/', views.PrescriptionCreateView.as_view(), name='prescription-create'),
     path('prescriptions/<int:pk>/', views.PrescriptionDetailView.as_view(), name='prescription-detail'),
     path('prescriptions/pharmacist/', views.PharmacistPrescriptionListView.as_view(), name='prescription-pharmacist-list'),
+    path('prescriptions/demand/', views.PrescriptionDemandView.as_view(), name='prescription-demand'),
+    path('prescriptions/pharmacist/stream/', views.PrescriptionQueueStreamView.as_view(), name='prescription-pharmacist-stream'),
     path('prescriptions/<int:pk>/dispense/', views.PrescriptionDispenseView.as_view(), name='prescription-dispense'),
+    path('prescriptions/<int:pk>/dispense-sale/', views.PrescriptionDispenseSaleView.as_view(), name='prescription-dispense-sale'),
 ]
\ No newline at end of file
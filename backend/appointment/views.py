@@ -2,30 +2,65 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 from django.db.models import Q
-from django.db.models import Count, Sum
-from .models import Appointment, Prescription
+from django.db.models import Avg, Count, Exists, OuterRef, Sum
+from .models import Appointment, Prescription, PrescriptionItem, DailyAppointmentStats, Tombstone
 from doctor.models import DoctorProfile
+from pharmacy import sales
+from pharmacy.models import Medicine
+from pharmacy.serializers import SaleSerializer
 from django.core.exceptions import ObjectDoesNotExist
 from .serializers import (
     AppointmentSerializer,
     PrescriptionSerializer,
     PrescriptionCreateSerializer,
     PrescriptionPharmacistSerializer,
+    PrescriptionDispenseSaleSerializer,
     PrescriptionDispenseSerializer,
+    SlotHoldSerializer,
+    APPOINTMENT_LEAN,
+    PRESCRIPTION_LEAN,
+    PRESCRIPTION_PHARMACIST_LEAN,
 )
+from core import conditional
+from core import pubsub
+from core.idempotency import idempotent
+from core.lean import LeanSerializer, lean_requested
 from decimal import Decimal
-from django.db import transaction
+from . import availability
+from . import booking
+from . import bulk
+from . import changes
+from . import counters
+from . import pagination
+from . import queue as prescription_queue
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 import datetime
 
 class AppointmentListView(APIView):
+    """List appointments for the current customer/doctor, or a doctor's
+    appointments when ``doctor`` is given.
+
+    Passing any of ``scope`` (upcoming | past), ``limit`` or ``cursor``
+    switches to keyset pagination: upcoming appointments come soonest first,
+    everything else newest first, and the response carries ``next_cursor``.
+    """
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         doctor_id = request.query_params.get('doctor')
         date = request.query_params.get('date')
         status_filter = request.query_params.get('status')
+        scope = request.query_params.get('scope')
+        cursor = request.query_params.get('cursor')
+        limit = request.query_params.get('limit')
+
+        if scope and scope not in ('upcoming', 'past'):
+            return Response({'success': False, 'message': "scope must be 'upcoming' or 'past'"}, status=status.HTTP_400_BAD_REQUEST)
 
         if doctor_id:
             try:
@@ -33,13 +68,10 @@ class AppointmentListView(APIView):
             except Exception:
                 return Response({'success': False, 'message': 'Invalid doctor id'}, status=status.HTTP_400_BAD_REQUEST)
 
-            if date:
-                qs = qs.filter(appointment_date=date)
-
-            appointments = qs.select_related('doctor', 'patient').order_by('appointment_date', 'appointment_time')
+            appointments = qs.select_related('doctor', 'doctor__user', 'patient').order_by('appointment_date', 'appointment_time')
         else:
             if request.user.role == 'customer':
-                appointments = Appointment.objects.filter(patient=request.user).select_related('doctor', 'doctor__user').order_by('-appointment_date', '-appointment_time')
+                appointments = Appointment.objects.filter(patient=request.user).select_related('patient', 'doctor', 'doctor__user').order_by('-appointment_date', '-appointment_time')
             elif request.user.role == 'doctor':
                 appointments = Appointment.objects.filter(doctor__user=request.user).select_related('patient', 'doctor__user').order_by('-appointment_date', '-appointment_time')
             else:
@@ -47,20 +79,164 @@ class AppointmentListView(APIView):
                     'success': False,
                     'message': 'Permission denied'
                 }, status=status.HTTP_403_FORBIDDEN)
+
+        if date:
+            appointments = appointments.filter(appointment_date=date)
         
         # Filter by status if provided
         if status_filter:
             appointments = appointments.filter(status=status_filter)
-        
-        serializer = AppointmentSerializer(appointments, many=True)
+
+        # Scoped pages also depend on the clock, so they revalidate every minute
+        clock = timezone.localtime().strftime('%Y-%m-%dT%H:%M') if scope else ''
+        validators, not_modified = conditional.check(
+            request, appointments, DoctorProfile.objects.filter(pk__in=appointments.values('doctor')), extra=clock,
+        )
+        if not_modified:
+            return not_modified
+
+        lean = lean_requested(request)
+
+        if not (scope or cursor or limit):
+            if lean:
+                data = APPOINTMENT_LEAN.serialize(appointments)
+            else:
+                data = AppointmentSerializer(appointments, many=True).data
+            return conditional.finalize(Response({
+                'success': True,
+                'appointments': data
+            }), validators)
+
+        appointments = pagination.split_by_time(appointments, scope, timezone.localtime())
+        if lean:
+            lookups, mappers = APPOINTMENT_LEAN.compile()
+            appointments = appointments.values(*lookups)
+        try:
+            rows, next_cursor = pagination.paginate(
+                appointments,
+                cursor=cursor,
+                limit=pagination.parse_limit(limit),
+                descending=scope != 'upcoming',
+            )
+        except pagination.InvalidCursor:
+            return Response({'success': False, 'message': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if lean:
+            data = LeanSerializer.build_rows(rows, mappers)
+        else:
+            data = AppointmentSerializer(rows, many=True).data
+        return conditional.finalize(Response({
+            'success': True,
+            'appointments': data,
+            'next_cursor': next_cursor,
+        }), validators)
+
+class DoctorAvailabilityView(APIView):
+    """Return free slots for a doctor over a date range in a single call.
+
+    Query params: doctor (DoctorProfile id, required), from / to (YYYY-MM-DD,
+    default today and today + 6 days). The range may span up to
+    ``availability.MAX_RANGE_DAYS`` days.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        doctor_id = request.query_params.get('doctor')
+        try:
+            doctor = DoctorProfile.objects.get(id=int(doctor_id))
+        except (TypeError, ValueError, ObjectDoesNotExist):
+            return Response({'success': False, 'message': 'Invalid or missing doctor id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        today = timezone.localdate()
+        try:
+            start = datetime.date.fromisoformat(request.query_params.get('from') or today.isoformat())
+            end_param = request.query_params.get('to')
+            end = datetime.date.fromisoformat(end_param) if end_param else start + datetime.timedelta(days=6)
+        except ValueError:
+            return Response({'success': False, 'message': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if end < start:
+            return Response({'success': False, 'message': "'to' must not be before 'from'"}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start).days + 1 > availability.MAX_RANGE_DAYS:
+            return Response({'success': False, 'message': f'Date range cannot exceed {availability.MAX_RANGE_DAYS} days'}, status=status.HTTP_400_BAD_REQUEST)
+
+        days = [
+            {'date': day.isoformat(), 'slots': [t.isoformat() for t in times]}
+            for day, times in availability.free_slots(doctor, start, end)
+        ]
+        return Response({
+            'success': True,
+            'doctor': doctor.id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'days': days,
+        })
+
+class EarliestAvailableView(APIView):
+    """Return the earliest free slots across all doctors matching a search.
+
+    Query params: specialty, from / to (YYYY-MM-DD, default today and
+    today + 6 days), min_fee / max_fee, min_rating and limit (default 10,
+    max 50).
+    """
+    permission_classes = [IsAuthenticated]
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 50
+
+    def get(self, request):
+        params = request.query_params
+        today = timezone.localdate()
+        try:
+            start = datetime.date.fromisoformat(params.get('from') or today.isoformat())
+            end = datetime.date.fromisoformat(params['to']) if params.get('to') else start + datetime.timedelta(days=6)
+        except ValueError:
+            return Response({'success': False, 'message': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+        if end < start:
+            return Response({'success': False, 'message': "'to' must not be before 'from'"}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start).days + 1 > availability.MAX_RANGE_DAYS:
+            return Response({'success': False, 'message': f'Date range cannot exceed {availability.MAX_RANGE_DAYS} days'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(max(int(params.get('limit') or self.DEFAULT_LIMIT), 1), self.MAX_LIMIT)
+            min_fee = Decimal(params['min_fee']) if params.get('min_fee') else None
+            max_fee = Decimal(params['max_fee']) if params.get('max_fee') else None
+            min_rating = float(params['min_rating']) if params.get('min_rating') else None
+        except (ValueError, ArithmeticError):
+            return Response({'success': False, 'message': 'Invalid numeric filter'}, status=status.HTTP_400_BAD_REQUEST)
+
+        doctors = DoctorProfile.objects.select_related('user')
+        if params.get('specialty'):
+            doctors = doctors.filter(specialty__iexact=params['specialty'].strip())
+        if min_fee is not None:
+            doctors = doctors.filter(consultation_fee__gte=min_fee)
+        if max_fee is not None:
+            doctors = doctors.filter(consultation_fee__lte=max_fee)
+        if min_rating is not None:
+            doctors = doctors.annotate(rating=Avg('reviews__rating')).filter(rating__gte=min_rating)
+
+        slots = availability.earliest_free_slots(doctors, start, end, limit)
         return Response({
             'success': True,
-            'appointments': serializer.data
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'slots': [
+                {
+                    'date': day.isoformat(),
+                    'time': t.isoformat(),
+                    'doctor': doctor.id,
+                    'doctor_name': doctor.user.name,
+                    'specialty': doctor.specialty,
+                    'consultation_fee': str(doctor.consultation_fee),
+                }
+                for day, t, doctor in slots
+            ],
         })
 
+
 class AppointmentCreateView(APIView):
     permission_classes = [IsAuthenticated]
     
+    @idempotent
     def post(self, request):
         if request.user.role != 'customer':
             return Response({
@@ -102,10 +278,23 @@ class AppointmentCreateView(APIView):
 
         serializer = AppointmentSerializer(data=data)
         if serializer.is_valid():
-            appointment = serializer.save(patient=request.user, doctor=doctor_obj)
+            vd = serializer.validated_data
+            if not booking.is_offered(doctor_obj, vd['appointment_date'], vd['appointment_time']):
+                return Response({'success': False, 'message': 'Selected slot is not available for this doctor.'}, status=status.HTTP_400_BAD_REQUEST)
+            # The unique_active_doctor_slot constraint is the source of truth
+            # for conflicts; no pre-read of existing appointments is needed.
+            try:
+                with transaction.atomic():
+                    booking.claim_slot(doctor_obj, vd['appointment_date'], vd['appointment_time'], request.user)
+                    appointment = serializer.save(patient=request.user, doctor=doctor_obj)
+            except booking.SlotUnavailable as e:
+                return Response({'success': False, 'message': str(e)}, status=status.HTTP_409_CONFLICT)
+            except IntegrityError:
+                return Response({'success': False, 'message': 'Selected time slot is already booked. Please choose another slot.'}, status=status.HTTP_409_CONFLICT)
+
             if pm == 'atm':
                 appointment.status = 'confirmed'
-                appointment.save(update_fields=['status'])
+                appointment.save(update_fields=['status', 'updated_at'])
 
             return Response({
                 'success': True,
@@ -119,27 +308,67 @@ class AppointmentCreateView(APIView):
             'errors': serializer.errors
         }, status=status.HTTP_400_BAD_REQUEST)
 
+class SlotHoldView(APIView):
+    """POST: hold a doctor's slot for the current customer while they pay.
+
+    The hold expires after ``SLOT_HOLD_TTL_SECONDS``; booking the same slot
+    with AppointmentCreateView consumes it.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if request.user.role != 'customer':
+            return Response({'success': False, 'message': 'Only customers can hold appointment slots'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = SlotHoldSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'success': False, 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        vd = serializer.validated_data
+        if not booking.is_offered(vd['doctor'], vd['appointment_date'], vd['appointment_time']):
+            return Response({'success': False, 'message': 'Selected slot is not available for this doctor.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            hold = booking.place_hold(vd['doctor'], vd['appointment_date'], vd['appointment_time'], request.user)
+        except booking.SlotUnavailable as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_409_CONFLICT)
+
+        return Response({'success': True, 'hold': SlotHoldSerializer(hold).data}, status=status.HTTP_201_CREATED)
+
+
+class SlotHoldDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, token):
+        if not booking.release_hold(token, request.user):
+            return Response({'success': False, 'message': 'Hold not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'success': True, 'message': 'Hold released'})
+
+
 class PrescriptionListView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         if request.user.role == 'customer':
-            prescriptions = Prescription.objects.filter(patient=request.user).select_related('doctor', 'doctor__user', 'appointment')
+            prescriptions = Prescription.objects.filter(patient=request.user).select_related('patient', 'doctor', 'doctor__user', 'appointment')
         elif request.user.role == 'doctor':
-            prescriptions = Prescription.objects.filter(doctor__user=request.user).select_related('patient', 'appointment')
+            prescriptions = Prescription.objects.filter(doctor__user=request.user).select_related('patient', 'appointment', 'doctor', 'doctor__user')
         elif request.user.role == 'pharmacist':
             # pharmacists: return all prescriptions (or we can filter by clinic/organization)
-            prescriptions = Prescription.objects.select_related('patient', 'appointment', 'doctor')
+            prescriptions = Prescription.objects.select_related('patient', 'appointment', 'doctor', 'doctor__user')
         else:
             return Response({
                 'success': False,
                 'message': 'Permission denied'
             }, status=status.HTTP_403_FORBIDDEN)
         
-        serializer = PrescriptionSerializer(prescriptions, many=True)
+        if lean_requested(request):
+            data = PRESCRIPTION_LEAN.serialize(prescriptions)
+        else:
+            data = PrescriptionSerializer(prescriptions, many=True).data
         return Response({
             'success': True,
-            'prescriptions': serializer.data
+            'prescriptions': data
         })
 
 
@@ -151,11 +380,139 @@ class PharmacistPrescriptionListView(APIView):
         if request.user.role != 'pharmacist' and not getattr(request.user, 'is_staff', False) and getattr(request.user, 'role', None) != 'admin':
             return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-        qs = Prescription.objects.select_related('appointment', 'patient', 'doctor').order_by('-created_at')
+        qs = Prescription.objects.select_related('appointment', 'patient', 'doctor', 'doctor__user').order_by('-created_at')
+        # ?medicine=<id>: prescriptions with a line matched to that medicine
+        medicine = request.query_params.get('medicine')
+        if medicine:
+            if not medicine.isdigit():
+                return Response({'success': False, 'message': 'medicine must be an id'}, status=status.HTTP_400_BAD_REQUEST)
+            qs = qs.filter(Exists(PrescriptionItem.objects.filter(prescription=OuterRef('pk'), medicine_id=medicine)))
         serializer = PrescriptionPharmacistSerializer(qs, many=True)
         return Response({'success': True, 'prescriptions': serializer.data})
 
 
+class PrescriptionDemandView(APIView):
+    """GET: medicines needed by prescriptions that are not dispensed yet.
+
+    One row per matched medicine with the number of open prescriptions
+    asking for it next to its current stock, plus the count of open lines
+    that could not be matched to the catalog.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if request.user.role != 'pharmacist' and not getattr(request.user, 'is_staff', False) and getattr(request.user, 'role', None) != 'admin':
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        open_items = PrescriptionItem.objects.filter(prescription__dispensed=False)
+        demand = (
+            open_items.filter(medicine__isnull=False)
+            .values('medicine_id', 'medicine__name', 'medicine__stock_count')
+            .annotate(open_prescriptions=Count('prescription', distinct=True))
+            .order_by('-open_prescriptions', 'medicine_id')
+        )
+        return Response({
+            'success': True,
+            'demand': [
+                {
+                    'medicine_id': row['medicine_id'],
+                    'name': row['medicine__name'],
+                    'stock_count': row['medicine__stock_count'],
+                    'open_prescriptions': row['open_prescriptions'],
+                }
+                for row in demand
+            ],
+            'unmatched_items': open_items.filter(medicine__isnull=True).count(),
+        })
+
+
+class PrescriptionQueueStreamView(APIView):
+    """GET: Server-Sent Events stream of the pharmacist prescription queue.
+
+    Emits ``prescription.created``, ``prescription.dispensed`` and
+    ``prescription.undispensed`` events, keepalive comments in between, and
+    ``resync`` if events had to be dropped. The stream ends after
+    ``SSE_MAX_STREAM_SECONDS``; clients reconnect and catch up through the
+    prescription change feed.
+
+    Under ASGI (``backend.asgi``) frames come from the async ``stream()``
+    and are flushed as they are produced; under WSGI the blocking
+    ``stream_sync()`` is used and each open stream pins a worker. Events
+    only reach streams in the process that published them unless
+    ``PUBSUB_BROKER`` is a shared broker, so run a single worker process.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [JSONRenderer, prescription_queue.EventStreamRenderer]
+
+    def get(self, request):
+        if request.user.role != 'pharmacist' and not getattr(request.user, 'is_staff', False) and getattr(request.user, 'role', None) != 'admin':
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        # Subscribe before responding so nothing published meanwhile is missed
+        subscription = pubsub.get_broker().subscribe(prescription_queue.PRESCRIPTION_CHANNEL)
+        frames = prescription_queue.stream if isinstance(request._request, ASGIRequest) else prescription_queue.stream_sync
+        response = StreamingHttpResponse(frames(subscription), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class ChangeFeedView(APIView):
+    """GET: appointments or prescriptions changed since an opaque token.
+
+    Query params: since (the ``next`` token of the previous response; omit
+    for a full initial sync) and limit (default 100, max 500). Returns the
+    changed rows, the ids deleted since the token, a ``next`` token and
+    ``has_more`` when another page is waiting.
+    """
+    permission_classes = [IsAuthenticated]
+    kind = None
+
+    def scope(self, user):
+        """Return ``(queryset, tombstones, lean_serializer)`` for ``user``, or None."""
+        role = getattr(user, 'role', None)
+        is_admin = role == 'admin' or getattr(user, 'is_staff', False)
+        tombstones = Tombstone.objects.filter(kind=self.kind)
+        model, lean = (Appointment, APPOINTMENT_LEAN) if self.kind == 'appointment' else (Prescription, PRESCRIPTION_LEAN)
+
+        if role == 'customer':
+            return model.objects.filter(patient=user), tombstones.filter(patient_id=user.pk), lean
+        if role == 'doctor':
+            doctor_ids = DoctorProfile.objects.filter(user=user).values('pk')
+            return model.objects.filter(doctor__in=doctor_ids), tombstones.filter(doctor_id__in=doctor_ids), lean
+        # Moved-out tombstones only concern the previous doctor's feed
+        if self.kind == 'prescription' and (role == 'pharmacist' or is_admin):
+            return Prescription.objects.all(), tombstones.filter(moved_out=False), PRESCRIPTION_PHARMACIST_LEAN
+        if is_admin:
+            return model.objects.all(), tombstones.filter(moved_out=False), lean
+        return None
+
+    def get(self, request):
+        scoped = self.scope(request.user)
+        if scoped is None:
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        queryset, tombstones, lean = scoped
+
+        lookups, mappers = lean.compile()
+        values = queryset.values(*dict.fromkeys(lookups + ['id', 'updated_at']))
+        try:
+            rows, deleted, next_token, has_more = changes.read(
+                values, tombstones, request.query_params.get('since'),
+                limit=changes.parse_limit(request.query_params.get('limit')),
+            )
+        except changes.InvalidToken:
+            return Response({'success': False, 'message': 'Invalid since token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'success': True,
+            'changes': LeanSerializer.build_rows(rows, mappers),
+            'deleted': deleted,
+            'next': next_token,
+            'has_more': has_more,
+        })
+
+
 class PrescriptionDispenseView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -181,8 +538,9 @@ class PrescriptionDispenseView(APIView):
             prescription.dispensed = True
             prescription.dispensed_by = request.user
             prescription.dispensed_at = timezone.now()
-            prescription.save(update_fields=['dispensed', 'dispensed_by', 'dispensed_at'])
-            
+            prescription.save(update_fields=['dispensed', 'dispensed_by', 'dispensed_at', 'updated_at'])
+            prescription_queue.publish_dispense(prescription)
+
             # Return success response
             return Response({
                 'success': True, 
@@ -194,9 +552,86 @@ class PrescriptionDispenseView(APIView):
             prescription.dispensed = False
             prescription.dispensed_by = None
             prescription.dispensed_at = None
-            prescription.save(update_fields=['dispensed', 'dispensed_by', 'dispensed_at'])
+            prescription.save(update_fields=['dispensed', 'dispensed_by', 'dispensed_at', 'updated_at'])
+            prescription_queue.publish_dispense(prescription)
             return Response({'success': True, 'message': 'Prescription marked as not dispensed'})
         
+class PrescriptionDispenseSaleView(APIView):
+    """POST: dispense a prescription and sell its medicines in one transaction.
+
+    Without ``items`` the basket is one unit of each prescription line that
+    is matched to a medicine; prescriptions with unmatched lines need an
+    explicit ``items`` list. The sale, its items, the stock decrement and
+    the dispensed flag are written together with a fixed number of queries,
+    or not at all when stock runs short (409).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        if request.user.role != 'pharmacist' and not getattr(request.user, 'is_staff', False) and getattr(request.user, 'role', None) != 'admin':
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        serializer = PrescriptionDispenseSaleSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response({'success': False, 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        try:
+            with transaction.atomic():
+                prescription = (
+                    Prescription.objects.select_for_update(of=('self',))
+                    .select_related('patient').filter(pk=pk).first()
+                )
+                if prescription is None:
+                    return Response({'success': False, 'message': 'Prescription not found'}, status=status.HTTP_404_NOT_FOUND)
+                if prescription.dispensed:
+                    return Response({'success': False, 'message': 'Prescription already dispensed'}, status=status.HTTP_409_CONFLICT)
+
+                if 'items' in data:
+                    medicines = Medicine.objects.in_bulk([line['medicine_id'] for line in data['items']])
+                    missing = sorted({line['medicine_id'] for line in data['items']} - set(medicines))
+                    if missing:
+                        return Response({'success': False, 'errors': {'items': f'Products not found: {missing}'}}, status=status.HTTP_400_BAD_REQUEST)
+                    lines = [(medicines[line['medicine_id']], line['qty']) for line in data['items']]
+                else:
+                    items = list(prescription.items.select_related('medicine'))
+                    unmatched = [item.name for item in items if item.medicine is None]
+                    if unmatched or not items:
+                        return Response({
+                            'success': False,
+                            'message': 'Prescription medicines are not all matched to products; send items explicitly',
+                            'unmatched': unmatched,
+                        }, status=status.HTTP_400_BAD_REQUEST)
+                    lines = [(item.medicine, 1) for item in items]
+
+                sale = sales.record_sale(
+                    lines,
+                    created_by=request.user,
+                    prescription=prescription,
+                    customer_name=data.get('customer_name') or prescription.patient.name,
+                    phone=data.get('phone') or prescription.patient.phone,
+                    payment_method=data['payment_method'],
+                )
+                prescription.dispensed = True
+                prescription.dispensed_by = request.user
+                prescription.dispensed_at = timezone.now()
+                prescription.save(update_fields=['dispensed', 'dispensed_by', 'dispensed_at', 'updated_at'])
+                prescription_queue.publish_dispense(prescription)
+        except sales.InsufficientStock as e:
+            return Response({
+                'success': False,
+                'message': 'Insufficient stock',
+                'shortages': e.shortages,
+            }, status=status.HTTP_409_CONFLICT)
+
+        return Response({
+            'success': True,
+            'message': 'Prescription dispensed and sale recorded',
+            'prescription_id': prescription.pk,
+            'sale': SaleSerializer(sale).data,
+        }, status=status.HTTP_201_CREATED)
+
+
 class PrescriptionCreateView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -233,8 +668,11 @@ class PrescriptionCreateView(APIView):
                     
                     # Update appointment status to completed
                     appointment.status = 'completed'
-                    appointment.save(update_fields=['status'])
-                    
+                    appointment.save(update_fields=['status', 'updated_at'])
+
+                    # Pharmacists watching the queue stream get it once committed
+                    prescription_queue.publish_created(PrescriptionPharmacistSerializer(prescription).data)
+
                     return Response({
                         'success': True,
                         'message': 'Prescription created successfully',
@@ -291,7 +729,7 @@ class AppointmentDetailView(APIView):
 
     def get(self, request, pk):
         try:
-            appointment = Appointment.objects.select_related('doctor', 'patient').get(pk=pk)
+            appointment = Appointment.objects.select_related('doctor', 'doctor__user', 'patient').get(pk=pk)
         except Appointment.DoesNotExist:
             return Response({'success': False, 'message': 'Appointment not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -310,8 +748,7 @@ class AppointmentDetailView(APIView):
         - Only the owning customer may update
         - Cannot update cancelled or completed appointments
         - Cannot update if appointment is within 24 hours of scheduled datetime
-        - New date must be one of the doctor's available_days
-        - New time must match one of the doctor's available_time_slots (start time)
+        - New date and time must be one of the doctor's schedule slots (booking.is_offered)
         - Slot must not already be booked by another appointment
         Returns serialized appointment on success
         """
@@ -346,28 +783,6 @@ class AppointmentDetailView(APIView):
         new_time = data.get('appointment_time')
         new_reason = data.get('reason', appointment.reason)
 
-        # Helper to parse incoming time strings into time objects
-        def parse_time_str(value):
-            if not value:
-                return None
-            if isinstance(value, datetime.time):
-                return value
-            # Try several common formats
-            for fmt in ("%H:%M:%S", "%H:%M", "%I:%M %p", "%I:%M%p"):
-                try:
-                    return datetime.datetime.strptime(value, fmt).time()
-                except Exception:
-                    continue
-            # As a last resort, try trimming seconds and parsing
-            try:
-                parts = value.split(':')
-                if len(parts) >= 2:
-                    h = int(parts[0]); m = int(parts[1])
-                    return datetime.time(hour=h, minute=m)
-            except Exception:
-                pass
-            return None
-
         # Determine target date and time (fall back to existing)
         target_date = appointment.appointment_date
         target_time = appointment.appointment_time
@@ -379,58 +794,35 @@ class AppointmentDetailView(APIView):
                 return Response({'success': False, 'message': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
 
         if new_time:
-            parsed_time = parse_time_str(new_time)
+            parsed_time = availability.parse_time_str(new_time)
             if not parsed_time:
                 return Response({'success': False, 'message': 'Invalid time format.'}, status=status.HTTP_400_BAD_REQUEST)
             target_time = parsed_time
 
-        # Validate target date is one of doctor's available_days (if doctor has availability configured)
+        # Validate target date/time against the doctor's materialized slots
         doctor_profile = appointment.doctor
-        try:
-            if doctor_profile.available_days and len(doctor_profile.available_days) > 0:
-                weekday = target_date.strftime('%A').lower()
-                available_days = [d.strip().lower() for d in (doctor_profile.available_days or [])]
-                if weekday not in available_days:
-                    return Response({'success': False, 'message': 'Doctor is not available on the selected date.'}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception:
-            # ignore and continue if doctor availability is malformed
-            pass
-
-        # Validate target_time is one of doctor's available_time_slots (compare start time)
-        try:
-            slot_ok = True
-            if doctor_profile.available_time_slots and len(doctor_profile.available_time_slots) > 0:
-                slot_ok = False
-                for slot in doctor_profile.available_time_slots:
-                    # slot may be in formats like '09:00 - 09:30' or '9:00 AM - 9:30 AM'
-                    start = str(slot).split('-')[0].strip()
-                    start_time = parse_time_str(start)
-                    if start_time and start_time == target_time:
-                        slot_ok = True
-                        break
-                if not slot_ok:
-                    return Response({'success': False, 'message': 'Selected time is not within the doctor\'s available time slots.'}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception:
-            pass
-
-        # Check for booking conflicts (another appointment at same doctor/date/time)
-        conflict_qs = Appointment.objects.filter(doctor=doctor_profile, appointment_date=target_date, appointment_time=target_time).exclude(pk=appointment.pk)
-        if conflict_qs.exists():
-            return Response({'success': False, 'message': 'Selected time slot is already booked. Please choose another slot.'}, status=status.HTTP_409_CONFLICT)
+        if not booking.is_offered(doctor_profile, target_date, target_time):
+            return Response({'success': False, 'message': 'Selected time is not within the doctor\'s available time slots.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Perform update
+        # Perform update; conflicts with other bookings surface from the
+        # unique_active_doctor_slot constraint
         try:
             with transaction.atomic():
+                booking.claim_slot(doctor_profile, target_date, target_time, request.user)
                 appointment.appointment_date = target_date
                 appointment.appointment_time = target_time
                 appointment.reason = new_reason
                 appointment.save(update_fields=['appointment_date', 'appointment_time', 'reason', 'updated_at'])
-
-            serializer = AppointmentSerializer(appointment)
-            return Response({'success': True, 'message': 'Appointment updated successfully', 'appointment': serializer.data})
+        except booking.SlotUnavailable as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_409_CONFLICT)
+        except IntegrityError:
+            return Response({'success': False, 'message': 'Selected time slot is already booked. Please choose another slot.'}, status=status.HTTP_409_CONFLICT)
         except Exception as e:
             return Response({'success': False, 'message': f'Failed to update appointment: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+        serializer = AppointmentSerializer(appointment)
+        return Response({'success': True, 'message': 'Appointment updated successfully', 'appointment': serializer.data})
+
 class AppointmentCancelView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -448,75 +840,160 @@ class AppointmentCancelView(APIView):
         if appointment.status == 'completed':
             return Response({'success': False, 'message': 'Completed appointments cannot be cancelled'}, status=status.HTTP_400_BAD_REQUEST)
 
-        consult_fee = Decimal(appointment.consultation_fee)
-        company_fee = (consult_fee * Decimal('0.20')).quantize(Decimal('0.01'))
-        refund_amount = (consult_fee - company_fee).quantize(Decimal('0.01'))
-
         with transaction.atomic():
-            appointment.status = 'cancelled'
-            appointment.company_fee = company_fee
-            if appointment.payment_status:
-                appointment.refund_amount = refund_amount
-                appointment.refunded = True
-                appointment.payment_status = False
-            else:
-                appointment.refund_amount = Decimal('0.00')
-                appointment.refunded = False
-
-            appointment.save(update_fields=['status', 'company_fee', 'refund_amount', 'refunded', 'payment_status'])
+            company_fee, refund_amount = bulk.apply_cancellation(appointment)
+            appointment.save(update_fields=bulk.CANCEL_FIELDS)
 
         return Response({'success': True, 'message': 'Appointment cancelled', 'company_fee': str(company_fee), 'refund_amount': str(refund_amount)})
 
 
+class AdminDoctorAppointmentsBulkView(APIView):
+    """POST: cancel or move all of a doctor's open appointments in a date range.
+
+    Body: doctor, from, to (YYYY-MM-DD, ``to`` defaults to ``from``), action
+    ('cancel' or 'reschedule'), and reason for cancellations or target_from
+    (plus optional target_doctor) for rescheduling. Runs in one transaction
+    and queues a notification email per patient.
+    """
+    permission_classes = [IsAuthenticated]
+
+    MAX_DAYS = 31
+
+    def post(self, request):
+        user = request.user
+        if not getattr(user, 'is_staff', False) and getattr(user, 'role', None) != 'admin':
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        data = request.data
+        action = data.get('action')
+        if action not in ('cancel', 'reschedule'):
+            return Response({'success': False, 'message': "action must be 'cancel' or 'reschedule'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            doctor = DoctorProfile.objects.select_related('user').get(id=int(data.get('doctor')))
+        except (TypeError, ValueError, ObjectDoesNotExist):
+            return Response({'success': False, 'message': 'Invalid or missing doctor id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            start = datetime.date.fromisoformat(data.get('from') or '')
+            end = datetime.date.fromisoformat(data['to']) if data.get('to') else start
+        except ValueError:
+            return Response({'success': False, 'message': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+        if end < start:
+            return Response({'success': False, 'message': "'to' must not be before 'from'"}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start).days + 1 > self.MAX_DAYS:
+            return Response({'success': False, 'message': f'Date range cannot exceed {self.MAX_DAYS} days'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if action == 'cancel':
+            summary = bulk.cancel_range(doctor, start, end, reason=str(data.get('reason') or '').strip())
+            return Response({'success': True, 'message': f"{summary['cancelled']} appointments cancelled", **summary})
+
+        try:
+            target_start = datetime.date.fromisoformat(data.get('target_from') or '')
+        except ValueError:
+            return Response({'success': False, 'message': 'target_from is required (YYYY-MM-DD)'}, status=status.HTTP_400_BAD_REQUEST)
+        if target_start < timezone.localdate():
+            return Response({'success': False, 'message': 'Cannot reschedule into the past'}, status=status.HTTP_400_BAD_REQUEST)
+
+        target_doctor = doctor
+        if data.get('target_doctor'):
+            try:
+                target_doctor = DoctorProfile.objects.select_related('user').get(id=int(data['target_doctor']))
+            except (TypeError, ValueError, ObjectDoesNotExist):
+                return Response({'success': False, 'message': 'Invalid target doctor id'}, status=status.HTTP_400_BAD_REQUEST)
+
+        target_end = target_start + (end - start)
+        if target_doctor.pk == doctor.pk and target_start <= end and start <= target_end:
+            return Response({'success': False, 'message': 'Target range must not overlap the source range'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            summary = bulk.reschedule_range(doctor, start, end, target_start, target_doctor=target_doctor)
+        except IntegrityError:
+            return Response({'success': False, 'message': 'Target slots were booked while rescheduling; please retry.'}, status=status.HTTP_409_CONFLICT)
+        return Response({'success': True, 'message': f"{summary['moved']} appointments rescheduled", **summary})
+
+
 class AdminAppointmentStatsView(APIView):
-    """Return day-wise appointment counts and revenue for the admin dashboard."""
+    """Return day-wise appointment counts and revenue for the admin dashboard.
+
+    Served from the DailyAppointmentStats rollup, so the cost depends on the
+    number of days requested rather than the number of appointments. Accepts
+    either ``days`` (ending today, capped at ``MAX_DAYS``) or an explicit
+    ``from``/``to`` range, which is rejected if longer than ``MAX_DAYS``, and
+    an optional ``doctor`` id. Writes that bypass the model hooks (raw SQL,
+    ``QuerySet.update``) make the rollup stale until the scheduled
+    ``backfill_appointment_stats --recent-days`` run repairs it.
+    """
     permission_classes = [IsAuthenticated]
 
+    MAX_DAYS = 3660
+
     def get(self, request):
         # Only allow staff or admin role users
         user = request.user
         if not getattr(user, 'is_staff', False) and getattr(user, 'role', None) != 'admin':
             return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-        try:
-            days = int(request.query_params.get('days', 7))
-        except Exception:
-            days = 7
-
-        days = max(1, min(days, 30))
         today = timezone.localdate()
-        start = today - datetime.timedelta(days=days - 1)
-
-        qs = Appointment.objects.filter(appointment_date__range=(start, today))
+        start_param = request.query_params.get('from')
+        end_param = request.query_params.get('to')
+        if start_param or end_param:
+            try:
+                end = datetime.date.fromisoformat(end_param) if end_param else today
+                start = datetime.date.fromisoformat(start_param) if start_param else end - datetime.timedelta(days=6)
+            except ValueError:
+                return Response({'success': False, 'message': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+            if end < start:
+                return Response({'success': False, 'message': "'to' must not be before 'from'"}, status=status.HTTP_400_BAD_REQUEST)
+            days = (end - start).days + 1
+            if days > self.MAX_DAYS:
+                return Response({'success': False, 'message': f'Date range cannot exceed {self.MAX_DAYS} days'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            try:
+                days = int(request.query_params.get('days', 7))
+            except Exception:
+                days = 7
+            days = max(1, min(days, self.MAX_DAYS))
+            end = today
+            start = today - datetime.timedelta(days=days - 1)
 
-        # Aggregate counts and revenue per day
-        agg = qs.values('appointment_date').annotate(
-            count=Count('id'),
-            revenue=Sum('consultation_fee')
-        ).order_by('appointment_date')
+        qs = DailyAppointmentStats.objects.filter(date__range=(start, end))
+        doctor_id = request.query_params.get('doctor')
+        if doctor_id:
+            try:
+                qs = qs.filter(doctor_id=int(doctor_id))
+            except ValueError:
+                return Response({'success': False, 'message': 'Invalid doctor id'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            qs = qs.filter(doctor__isnull=True)
 
         # Build a date-indexed map for fast lookup
-        data_map = {item['appointment_date']: item for item in agg}
+        data_map = {row.date: row for row in qs}
 
         labels = []
         counts = []
         revenues = []
+        cancellations = []
+        refunds = []
+        company_fees = []
 
         for i in range(days):
             d = start + datetime.timedelta(days=i)
             labels.append(d.isoformat())
             entry = data_map.get(d)
             if entry:
-                counts.append(int(entry.get('count') or 0))
-                rev = entry.get('revenue') or 0
+                counts.append(entry.count)
                 # Convert Decimal to float for JSON serialization
-                try:
-                    revenues.append(float(rev))
-                except Exception:
-                    revenues.append(0.0)
+                revenues.append(float(entry.revenue))
+                cancellations.append(entry.cancellations)
+                refunds.append(float(entry.refunds))
+                company_fees.append(float(entry.company_fees))
             else:
                 counts.append(0)
                 revenues.append(0.0)
+                cancellations.append(0)
+                refunds.append(0.0)
+                company_fees.append(0.0)
 
         total_count = sum(counts)
         total_revenue = sum(revenues)
@@ -526,13 +1003,16 @@ class AdminAppointmentStatsView(APIView):
             'labels': labels,
             'counts': counts,
             'revenues': revenues,
+            'cancellations': cancellations,
+            'refunds': refunds,
+            'company_fees': company_fees,
             'total_count': total_count,
             'total_revenue': str(total_revenue),
         })
 
 
 class AdminOverviewView(APIView):
-    """Return basic totals for admin dashboard cards."""
+    """Return basic totals for admin dashboard cards (from the overview counters)."""
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
@@ -540,22 +1020,12 @@ class AdminOverviewView(APIView):
         if not getattr(user, 'is_staff', False) and getattr(user, 'role', None) != 'admin':
             return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-        total_doctors = DoctorProfile.objects.count()
-        total_appointments = Appointment.objects.count()
-        pending_payments = Appointment.objects.filter(status='pending').count()
-
-        agg = Appointment.objects.aggregate(total_revenue=Sum('consultation_fee'))
-        total_revenue = agg.get('total_revenue') or 0
-
-        try:
-            total_revenue_val = float(total_revenue)
-        except Exception:
-            total_revenue_val = 0.0
+        overview = counters.get_overview()
 
         return Response({
             'success': True,
-            'total_doctors': total_doctors,
-            'total_appointments': total_appointments,
-            'pending_payments': pending_payments,
-            'total_revenue': str(total_revenue_val),
-        })
\ No newline at end of file
+            'total_doctors': overview['total_doctors'],
+            'total_appointments': overview['total_appointments'],
+            'pending_payments': overview['pending_payments'],
+            'total_revenue': str(float(overview['total_revenue'])),
+        })
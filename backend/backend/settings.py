@@ -38,8 +38,51 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', 'sarujanang@gmail.com')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', 'cofv vwry bmrr bknw')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Outbox delivery (manage.py send_outbox): attempts before a message is marked
+# failed, and the base retry delay in seconds (doubled after each failure)
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_RETRY_SECONDS = int(os.getenv('EMAIL_OUTBOX_RETRY_SECONDS', 60))
+
 AUTH_USER_MODEL = 'core.User'
 
+# Number of APT/DOC identifier values each worker reserves per sequence hit
+IDENTIFIER_BLOCK_SIZE = int(os.getenv('IDENTIFIER_BLOCK_SIZE', 20))
+
+# How long a customer's slot hold survives while they complete payment
+SLOT_HOLD_TTL_SECONDS = int(os.getenv('SLOT_HOLD_TTL_SECONDS', 600))
+
+# Change feed only serves rows older than this, so in-flight transactions are not
+# skipped; it must exceed the longest gap between stamping updated_at and commit
+CHANGE_FEED_LAG_SECONDS = float(os.getenv('CHANGE_FEED_LAG_SECONDS', 2))
+
+# Pub/sub broker behind the pharmacist SSE stream. LocalBroker only fans out
+# within one process; multi-process deployments point this at a shared broker.
+# WEB_CONCURRENCY is the number of worker processes (as read by gunicorn and
+# uvicorn); with LocalBroker run a single one, or the check core.W001 warns.
+# Serve the stream from an ASGI server (backend.asgi) so open streams do not
+# each hold a worker
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+PUBSUB_BROKER = os.getenv('PUBSUB_BROKER', 'core.pubsub.LocalBroker')
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+SSE_MAX_STREAM_SECONDS = float(os.getenv('SSE_MAX_STREAM_SECONDS', 300))
+
+# Responses stored for Idempotency-Key retries are replayed for this long;
+# `manage.py prune_idempotency_keys` drops expired ones and keeps at most IDEMPOTENCY_MAX_KEYS
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_KEY_TTL_SECONDS', 86400))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv('IDEMPOTENCY_MAX_KEYS', 100000))
+
+# Weeks of concrete DoctorSlot rows kept ahead by `manage.py materialize_slots`
+SCHEDULE_HORIZON_WEEKS = int(os.getenv('SCHEDULE_HORIZON_WEEKS', 8))
+
+# The per-process medicine autocomplete index reloads from the database when older than this
+MEDICINE_AUTOCOMPLETE_MAX_AGE = float(os.getenv('MEDICINE_AUTOCOMPLETE_MAX_AGE', 300))
+
+# Requests issuing more SQL queries than this are logged at WARNING level
+QUERY_BUDGET_WARN_THRESHOLD = int(os.getenv('QUERY_BUDGET_WARN_THRESHOLD', 50))
+
+# Build large list responses from values() rows by default (override with ?lean=0/1)
+LEAN_LIST_SERIALIZATION = os.getenv('LEAN_LIST_SERIALIZATION', 'False') == 'True'
+
 # Application definition
 # CORS
 CORS_ALLOWED_ORIGINS = [
@@ -66,6 +109,7 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'idempotency-key',
     'origin',
     'user-agent',
     'x-csrftoken',
@@ -134,6 +178,7 @@ else:
     }
 
 MIDDLEWARE = [
+    'core.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
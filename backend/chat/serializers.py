@@ -18,8 +18,11 @@ class ChatSessionSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'user', 'created_at', 'updated_at')
     
     def get_last_message(self, obj):
-        last_msg = obj.messages.last()
+        # Index into messages.all() so a prefetched list is reused instead of
+        # issuing a reversed query per session
+        messages = obj.messages.all()
+        last_msg = messages[len(messages) - 1] if messages else None
         return last_msg.content if last_msg else ""
     
     def get_message_count(self, obj):
-        return obj.messages.count()
\ No newline at end of file
+        return len(obj.messages.all())
\ No newline at end of file
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, OTP, PasswordResetToken
+from .models import User, OTP, PasswordResetToken, IdentifierSequence, OutboundEmail, ImageJob
 from django.utils import timezone
 from datetime import timedelta
 
@@ -45,4 +45,24 @@ class OTPAdmin(admin.ModelAdmin):
 class PasswordResetTokenAdmin(admin.ModelAdmin):
     list_display = ('user', 'token', 'created_at', 'expires_at', 'is_used')
     list_filter = ('is_used', 'created_at')
-    search_fields = ('user__email', 'token')
\ No newline at end of file
+    search_fields = ('user__email', 'token')
+
+@admin.register(IdentifierSequence)
+class IdentifierSequenceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_value', 'updated_at')
+    readonly_fields = ('updated_at',)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('subject', 'recipients')
+    readonly_fields = ('created_at', 'sent_at', 'last_error')
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('model', 'object_id', 'source', 'status', 'attempts', 'next_attempt_at', 'finished_at')
+    list_filter = ('status', 'model')
+    search_fields = ('source',)
+    readonly_fields = ('created_at', 'finished_at', 'last_error')
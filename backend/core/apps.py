@@ -5,4 +5,8 @@ class CoreConfig(AppConfig):
     name = 'core'
 
     def ready(self):
-        pass
\ No newline at end of file
+        from . import images
+        # Registers the broker system check
+        from . import pubsub  # noqa: F401
+
+        images.connect()
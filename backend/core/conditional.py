@@ -0,0 +1,122 @@
+"""Conditional GET (ETag / Last-Modified) for list endpoints.
+
+Validators are derived from cheap aggregates instead of the response body:
+for every source queryset the latest timestamp (``updated_at`` by default)
+and the row count are read, all sources together in one query. Inserts and
+updates move the timestamp and deletes change the count, so the pair
+changes whenever the serialized list would. A matching ``If-None-Match``
+is answered with ``304 Not Modified`` before any serializer runs.
+
+``Last-Modified`` is sent for information only: ``If-Modified-Since`` is
+never answered with a 304, because the latest timestamp alone cannot see a
+deleted row. Clients have to revalidate with the ETag.
+
+Writes that bypass ``Model.save()`` (``QuerySet.update``, ``bulk_update``)
+or save with ``update_fields`` must write ``updated_at`` too, or the
+validators will not notice them.
+
+Usage in a view::
+
+    validators, not_modified = conditional.check(request, queryset)
+    if not_modified:
+        return not_modified
+    ...
+    return conditional.finalize(Response(...), validators)
+"""
+import datetime
+import hashlib
+from collections import namedtuple
+
+from django.db.models import F, Func, IntegerField, TextField, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+Validators = namedtuple('Validators', 'etag last_modified')
+
+
+def _source(source):
+    if isinstance(source, tuple):
+        return source
+    return source, 'updated_at'
+
+
+def _version_row(index, source):
+    queryset, field = _source(source)
+    # Plain SQL MAX/COUNT (not Django aggregates) so the rows can be UNIONed;
+    # everything is cast to text because column types differ between sources
+    return queryset.order_by().values_list(
+        Value(index, output_field=IntegerField()),
+        Cast(Func(F(field), function='MAX'), TextField()),
+        Cast(Func(F('pk'), function='COUNT'), TextField()),
+    )
+
+
+def _parse_latest(value):
+    if value is None:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        return value
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def compute(request, *sources, extra=''):
+    """Build ``Validators`` for a response listing ``sources``.
+
+    Each source is a queryset (versioned by ``updated_at``) or a
+    ``(queryset, field)`` pair; ``field`` is normally a timestamp but any
+    monotonically increasing column works. All sources are read with a
+    single query. The ETag also covers the full path, the requesting user
+    and ``extra`` (anything else the response depends on).
+    """
+    user = getattr(request, 'user', None)
+    parts = [request.get_full_path(), str(getattr(user, 'pk', None) or ''), str(extra)]
+    last_modified = None
+    if sources:
+        rows = [_version_row(i, source) for i, source in enumerate(sources)]
+        combined = rows[0].union(*rows[1:], all=True) if len(rows) > 1 else rows[0]
+        for _, latest, total in sorted(combined, key=lambda row: row[0]):
+            parts.append(f"{latest or ''}:{total}")
+            latest = _parse_latest(latest)
+            if isinstance(latest, datetime.datetime) and (last_modified is None or latest > last_modified):
+                last_modified = latest
+
+    digest = hashlib.sha1('|'.join(parts).encode()).hexdigest()[:32]
+    return Validators(f'W/"{digest}"', last_modified)
+
+
+def _matches(request, validators):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        ours = validators.etag.removeprefix('W/')
+        return any(tag == '*' or tag.removeprefix('W/') == ours for tag in parse_etags(if_none_match))
+    return False
+
+
+def finalize(response, validators):
+    """Attach validators to ``response`` and make clients revalidate it."""
+    response['ETag'] = validators.etag
+    if validators.last_modified is not None:
+        response['Last-Modified'] = http_date(validators.last_modified.timestamp())
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ('Authorization', 'Cookie'))
+    return response
+
+
+def check(request, *sources, extra=''):
+    """Return ``(validators, response)``; ``response`` is a 304 when the client copy is fresh."""
+    validators = compute(request, *sources, extra=extra)
+    if _matches(request, validators):
+        return validators, finalize(Response(status=status.HTTP_304_NOT_MODIFIED), validators)
+    return validators, None
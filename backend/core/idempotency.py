@@ -0,0 +1,115 @@
+"""``Idempotency-Key`` support for POST endpoints that create things.
+
+A client sends a unique ``Idempotency-Key`` header with a POST and reuses it
+when retrying. The first request runs normally and its response is stored;
+retries with the same key get that stored response back (marked with an
+``Idempotent-Replayed: true`` header) without running the view again.
+
+The key row is inserted at the start of a transaction that also wraps the
+view, so it commits together with the view's writes. A concurrent
+duplicate's INSERT waits on the unique index until the first request
+finishes, then replays its response. If the first request fails, the row
+is rolled back and the duplicate runs instead. Server errors (5xx) are not
+stored, so they can be retried.
+
+Keys are per user. A key reused with a different endpoint or body gets
+422. Keys expire after ``IDEMPOTENCY_KEY_TTL_SECONDS``.
+``manage.py prune_idempotency_keys`` deletes expired rows and caps the
+table at ``IDEMPOTENCY_MAX_KEYS``.
+"""
+import datetime
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def ttl():
+    return datetime.timedelta(seconds=int(getattr(settings, 'IDEMPOTENCY_KEY_TTL_SECONDS', 86400)))
+
+
+def max_keys():
+    return int(getattr(settings, 'IDEMPOTENCY_MAX_KEYS', 100000))
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _claim(user, key, endpoint, digest, now):
+    """Insert the key, or return the finished row another request committed.
+
+    Returns ``(record, created)``. An expired row is replaced.
+    """
+    while True:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user, key=key, endpoint=endpoint, fingerprint=digest, expires_at=now + ttl(),
+                ), True
+        except IntegrityError:
+            pass
+        record = IdempotencyKey.objects.select_for_update().filter(user=user, key=key).first()
+        if record is None:
+            continue
+        if record.expires_at > now:
+            return record, False
+        record.delete()
+
+
+def idempotent(handler):
+    """Decorate an ``APIView`` handler so a repeated ``Idempotency-Key`` replays its response.
+
+    Requests without the header, or from anonymous users, run unchanged.
+    """
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not request.user.is_authenticated:
+            return handler(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({'success': False, 'message': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}, status=status.HTTP_400_BAD_REQUEST)
+
+        endpoint = f'{request.method} {request.path}'[:255]
+        digest = fingerprint(request)
+        with transaction.atomic():
+            record, created = _claim(request.user, key, endpoint, digest, timezone.now())
+            if not created:
+                if (record.endpoint, record.fingerprint) != (endpoint, digest):
+                    return Response({'success': False, 'message': f'{HEADER} was already used for a different request'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                return Response(record.response_body, status=record.response_status, headers={REPLAYED_HEADER: 'true'})
+
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code >= 500:
+                record.delete()
+            else:
+                record.response_status = response.status_code
+                record.response_body = response.data
+                record.save(update_fields=['response_status', 'response_body'])
+        return response
+
+    return wrapper
+
+
+def prune(now=None):
+    """Delete expired keys, then the oldest beyond ``IDEMPOTENCY_MAX_KEYS``. Returns the number deleted."""
+    now = now or timezone.now()
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now).delete()
+    # Every key gets the same TTL, so the earliest expiry is the oldest key
+    cutoff = IdempotencyKey.objects.order_by('-expires_at', '-id').values_list('expires_at', 'id')[max_keys():max_keys() + 1]
+    for expires_at, pk in cutoff:
+        trimmed, _ = IdempotencyKey.objects.filter(expires_at__lte=expires_at).exclude(expires_at=expires_at, id__gt=pk).delete()
+        deleted += trimmed
+    return deleted
@@ -0,0 +1,152 @@
+"""Race-free allocation of human-readable identifiers such as APT00042.
+
+Each identifier series is backed by an ``IdentifierSequence`` row. A worker
+reserves a block of values with a single ``UPDATE ... SET last_value =
+last_value + n`` (which takes a row lock on PostgreSQL and the write lock on
+SQLite) and then hands values out from memory, so most inserts do not touch
+the sequence table at all.
+
+The unused part of a block is only published to the process once the
+reservation has committed (``transaction.on_commit``). Until then it is
+kept private to the transaction that reserved it, so further identifiers
+issued in that transaction come from the same block. If the reservation
+rolls back, the counter rolls back with it and the block is dropped, so two
+workers can never share values.
+"""
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import IdentifierSequence
+
+
+def max_numeric_suffix(values, prefix):
+    """Return the largest N among strings of the form ``<prefix>N`` (0 if none)."""
+    best = 0
+    for value in values:
+        if not value or not value.startswith(prefix):
+            continue
+        try:
+            best = max(best, int(value[len(prefix):]))
+        except ValueError:
+            continue
+    return best
+
+
+class IdentifierAllocator:
+    """Hand out ``<prefix><zero padded number>`` identifiers for one series.
+
+    ``seed`` is called once, when the sequence row does not exist yet, and
+    must return the highest number already in use so existing rows are never
+    reissued.
+    """
+
+    def __init__(self, name, prefix, width, seed=None, block_size=None):
+        self.name = name
+        self.prefix = prefix
+        self.width = width
+        self.seed = seed
+        self._block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+        # Block reserved by the current thread's open transaction, not yet published
+        self._local = threading.local()
+
+    @property
+    def block_size(self):
+        if self._block_size is not None:
+            return self._block_size
+        return max(1, int(getattr(settings, 'IDENTIFIER_BLOCK_SIZE', 20)))
+
+    def format(self, number):
+        return f"{self.prefix}{number:0{self.width}d}"
+
+    def next_id(self):
+        return self.format(self.next_value())
+
+    def next_value(self):
+        with self._lock:
+            if self._next < self._end:
+                value = self._next
+                self._next += 1
+                return value
+
+        block = self._pending()
+        if block is not None:
+            value = block.next
+            block.next += 1
+            return value
+
+        start, end = self._reserve(self.block_size)
+        if start + 1 < end:
+            block = _Block(self, start + 1, end)
+            if transaction.get_connection().in_atomic_block:
+                self._local.block = block
+            transaction.on_commit(block.publish)
+        return start
+
+    def _pending(self):
+        """The unexhausted block reserved earlier in the current transaction, if any."""
+        block = getattr(self._local, 'block', None)
+        if block is None or block.next >= block.end:
+            return None
+        connection = transaction.get_connection()
+        # A rolled-back reservation (the transaction or the savepoint it ran
+        # in) also drops its on_commit callback; only a live block is reused.
+        if connection.in_atomic_block and any(func == block.publish for _, func, _ in connection.run_on_commit):
+            return block
+        self._local.block = None
+        return None
+
+    def _publish(self, start, end):
+        with self._lock:
+            # A concurrent reservation may already have refilled the block;
+            # the extra values are simply skipped.
+            if self._next >= self._end:
+                self._next, self._end = start, end
+
+    def reset(self):
+        """Forget any values reserved in memory by this process."""
+        with self._lock:
+            self._next = self._end = 0
+        self._local.block = None
+
+    def _reserve(self, size):
+        """Reserve ``size`` values and return the half-open range [start, end)."""
+        while True:
+            with transaction.atomic():
+                updated = IdentifierSequence.objects.filter(name=self.name).update(
+                    last_value=F('last_value') + size
+                )
+                if updated:
+                    last = IdentifierSequence.objects.values_list('last_value', flat=True).get(name=self.name)
+                    return last - size + 1, last + 1
+            self._create_row()
+
+    def _create_row(self):
+        initial = self.seed() if self.seed else 0
+        try:
+            with transaction.atomic():
+                IdentifierSequence.objects.create(name=self.name, last_value=initial)
+        except IntegrityError:
+            # Another worker created the row first; its value is authoritative.
+            pass
+
+
+class _Block:
+    """Rest of a reserved block, handed out by its own transaction until it commits."""
+
+    def __init__(self, allocator, start, end):
+        self.allocator = allocator
+        self.next = start
+        self.end = end
+
+    def publish(self):
+        start, self.next = self.next, self.end
+        if getattr(self.allocator._local, 'block', None) is self:
+            self.allocator._local.block = None
+        if start < self.end:
+            self.allocator._publish(start, self.end)
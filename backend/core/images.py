@@ -0,0 +1,212 @@
+"""Background image variants for uploaded photos.
+
+Saving a model listed in ``IMAGE_FIELDS`` with a new upload clears its
+``image_variants`` and queues an ``ImageJob`` in the same transaction.
+``manage.py process_images`` drains the queue: each upload is decoded
+once and re-encoded as WebP and JPEG at every size in ``VARIANTS``,
+rotated per its EXIF orientation, with EXIF/ICC and other metadata
+dropped. Files are stored under ``image_variants/`` named by a hash of
+their content, so they never change and can be served with a far-future
+``Cache-Control: immutable``.
+
+The variants are written back only if the row still holds the same
+upload, so a replaced image never receives the variants of the old one.
+Failed jobs are retried with exponential backoff like the email outbox.
+"""
+import datetime
+import hashlib
+import io
+import logging
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from .models import ImageJob
+
+logger = logging.getLogger('core.images')
+
+# model label -> image field; each model also has an ``image_variants`` JSONField
+IMAGE_FIELDS = {
+    'pharmacy.medicine': 'image',
+    'doctor.doctorprofile': 'profile_image',
+}
+
+# name -> longest edge in pixels; smaller uploads are never upscaled
+VARIANTS = (('thumb', 160), ('card', 480), ('full', 1280))
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+VARIANT_DIR = 'image_variants'
+
+DEFAULT_BATCH_SIZE = 20
+MAX_ATTEMPTS = 3
+RETRY_SECONDS = 60
+# Seconds a claimed batch is hidden from other workers while it renders
+LEASE_SECONDS = 300
+
+
+def _store(data, ext):
+    name = f'{VARIANT_DIR}/{hashlib.sha256(data).hexdigest()[:24]}.{ext}'
+    if default_storage.exists(name):
+        return name
+    return default_storage.save(name, ContentFile(data))
+
+
+def _opaque(image):
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render(fp):
+    """Write every variant of the image in ``fp``; returns the variant map to store."""
+    with Image.open(fp) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        base = image.convert('RGBA' if has_alpha else 'RGB')
+
+    variants = {}
+    for name, edge in VARIANTS:
+        resized = base.copy()
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        entry = {'width': resized.width, 'height': resized.height}
+        for ext, fmt, options in FORMATS:
+            buffer = io.BytesIO()
+            # No exif/icc_profile is passed to save(), so none is written
+            (resized if fmt == 'WEBP' else _opaque(resized)).save(buffer, fmt, **options)
+            entry[ext] = _store(buffer.getvalue(), ext)
+        variants[name] = entry
+    return variants
+
+
+def enqueue(instance):
+    """Queue variants for ``instance``'s current upload, clearing stale ones."""
+    label = instance._meta.label_lower
+    name = getattr(instance, IMAGE_FIELDS[label]).name or ''
+    if instance.image_variants.get('source', '') == name:
+        return None
+    if instance.image_variants:
+        type(instance).objects.filter(pk=instance.pk).update(image_variants={}, updated_at=timezone.now())
+        instance.image_variants = {}
+    if not name:
+        return None
+
+    job, created = ImageJob.objects.get_or_create(model=label, object_id=instance.pk, source=name)
+    if not created and job.status != 'pending':
+        ImageJob.objects.filter(pk=job.pk).update(status='pending', attempts=0, next_attempt_at=timezone.now())
+    return job
+
+
+def image_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        enqueue(instance)
+
+
+def connect():
+    for label in IMAGE_FIELDS:
+        post_save.connect(image_saved, sender=apps.get_model(label), dispatch_uid=f'image-variants-{label}')
+
+
+def backfill():
+    """Queue variants for every stored upload that has none. Returns the number queued."""
+    queued = 0
+    for label, field in IMAGE_FIELDS.items():
+        model = apps.get_model(label)
+        rows = model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''}).only('pk', field, 'image_variants')
+        for instance in rows.iterator(chunk_size=500):
+            with transaction.atomic():
+                queued += enqueue(instance) is not None
+    return queued
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE, now=None):
+    """Lease up to ``batch_size`` due jobs to the calling worker."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = (
+            ImageJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+        )
+        batch = list(due[:batch_size])
+        if batch:
+            ImageJob.objects.filter(pk__in=[job.pk for job in batch]).update(
+                next_attempt_at=now + datetime.timedelta(seconds=LEASE_SECONDS)
+            )
+    return batch
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """Render one batch of due jobs. Returns ``(done, failed)`` counts."""
+    done = failed = 0
+    for job in claim_batch(batch_size):
+        if _process(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def _process(job):
+    now = timezone.now()
+    job.attempts += 1
+    model = apps.get_model(job.model)
+    field = IMAGE_FIELDS[job.model]
+    current = model.objects.filter(pk=job.object_id)
+    try:
+        if not current.filter(**{field: job.source}).exists():
+            # Replaced or deleted since it was queued; the new upload has its own job
+            job.status = 'skipped'
+        else:
+            with default_storage.open(job.source, 'rb') as fp:
+                variants = render(fp)
+            current.filter(**{field: job.source}).update(
+                image_variants={'source': job.source, **variants}, updated_at=timezone.now(),
+            )
+            job.status = 'done'
+    except Exception as exc:
+        job.last_error = f'{type(exc).__name__}: {exc}'
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = 'failed'
+            logger.error('Giving up on image job %s after %d attempts: %s', job.pk, job.attempts, exc)
+        else:
+            job.next_attempt_at = now + datetime.timedelta(seconds=RETRY_SECONDS * 2 ** (job.attempts - 1))
+            logger.warning('Image job %s failed (attempt %d): %s', job.pk, job.attempts, exc)
+        job.save(update_fields=['attempts', 'status', 'next_attempt_at', 'last_error'])
+        return False
+
+    job.finished_at = now
+    job.last_error = ''
+    job.save(update_fields=['attempts', 'status', 'finished_at', 'last_error'])
+    return True
+
+
+class ImageVariantsField(serializers.Field):
+    """Read-only ``{variant: {'webp': url, 'jpeg': url, 'width', 'height'}}``; empty until processed."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        variants = {}
+        for name, _ in VARIANTS:
+            entry = (value or {}).get(name)
+            if not entry:
+                continue
+            variants[name] = dict(entry)
+            for ext, _, _ in FORMATS:
+                url = default_storage.url(entry[ext])
+                variants[name][ext] = request.build_absolute_uri(url) if request is not None else url
+        return variants
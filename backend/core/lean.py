@@ -0,0 +1,187 @@
+"""Lean read path for large list responses.
+
+``LeanSerializer`` compiles a DRF ``ModelSerializer`` class once into a flat
+list of ``(output key, values() lookup, converter)`` mappers and then builds
+rows straight from ``QuerySet.values()``. No model instances or serializer
+field objects are created per row, but every value still goes through the
+same DRF field representation wherever one would change the value (decimals,
+datetimes, file URLs), so the rendered JSON is byte-identical to the
+regular serializer.
+
+Serializer method fields cannot be derived automatically; callers pass an
+``overrides`` mapping ``{field_name: (lookup, converter)}`` for them.
+
+Compiled plans are cached per serializer and context shape. The only part of
+a request a plan depends on is its absolute base URL (for file and image
+URLs), so plans for requests to the same host are shared and no request
+object is kept: fields see a stand-in that only offers
+``build_absolute_uri()``. Fields that need more of the request (hyperlinked
+relations) are not supported.
+"""
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import fields as drf_fields
+from rest_framework import relations
+from rest_framework import serializers
+
+# Field types whose representation of a non-null DB value is the value itself
+_IDENTITY_FIELDS = (
+    drf_fields.CharField,
+    drf_fields.IntegerField,
+    drf_fields.BooleanField,
+    drf_fields.ChoiceField,
+    drf_fields.JSONField,
+    relations.PrimaryKeyRelatedField,
+)
+
+_MAX_PLANS = 64
+
+
+class _AbsoluteUrls:
+    """Stands in for the request in a cached plan; only builds absolute URLs."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def build_absolute_uri(self, location):
+        # Same result as HttpRequest.build_absolute_uri() for storage URLs
+        return urljoin(self.base_url, location)
+
+
+def lean_requested(request):
+    """True when the caller opted into the lean path (``?lean=1``) or it is the default."""
+    value = request.query_params.get('lean')
+    if value is None:
+        return getattr(settings, 'LEAN_LIST_SERIALIZATION', False)
+    return value.lower() in ('1', 'true', 'yes')
+
+
+class LeanSerializer:
+    def __init__(self, serializer_class, overrides=None):
+        self.serializer_class = serializer_class
+        self.overrides = overrides or {}
+        self._plans = {}
+
+    def compile(self, context=None):
+        """Return ``(lookups, mappers)`` for the given serializer context.
+
+        Each mapper is ``(key, lookup, converter, nested_mappers, sees_null)``.
+        The result is cached and must not be modified.
+        """
+        context = dict(context or {})
+        request = context.pop('request', None)
+        base_url = request.build_absolute_uri('/') if request is not None else None
+        try:
+            key = (base_url, frozenset(context.items()))
+            plan = self._plans.get(key)
+        except TypeError:
+            # Unhashable context values: compile without caching
+            key = plan = None
+        if plan is None:
+            plan = self._compile(context, base_url)
+            if key is not None:
+                if len(self._plans) >= _MAX_PLANS:
+                    # Hosts are whatever ALLOWED_HOSTS lets through; keep it bounded
+                    self._plans.clear()
+                self._plans[key] = plan
+        return plan
+
+    def _compile(self, context, base_url):
+        if base_url is not None:
+            context = dict(context, request=_AbsoluteUrls(base_url))
+        serializer = self.serializer_class(context=context)
+        lookups = []
+        mappers = self._compile_fields(serializer, '', lookups, context)
+        return list(dict.fromkeys(lookups)), mappers
+
+    def _compile_fields(self, serializer, prefix, lookups, context):
+        model = serializer.Meta.model
+        mappers = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+
+            if not prefix and name in self.overrides:
+                lookup, converter = self.overrides[name]
+                lookups.append(lookup)
+                # Overrides mirror method fields, which also see NULL values
+                mappers.append((name, lookup, converter, None, True))
+                continue
+
+            if isinstance(field, serializers.SerializerMethodField):
+                raise ValueError(f'{self.serializer_class.__name__}.{name} needs a lean override')
+
+            if not self._resolves(model, field.source):
+                if field.required:
+                    raise ValueError(f'{self.serializer_class.__name__}.{name}: cannot resolve {field.source!r}')
+                # DRF skips optional fields whose source attribute is missing
+                continue
+
+            lookup = prefix + field.source.replace('.', '__')
+            lookups.append(lookup)
+
+            if isinstance(field, serializers.BaseSerializer):
+                nested = self._compile_fields(field, lookup + '__', lookups, context)
+                mappers.append((name, lookup, None, nested, False))
+            elif isinstance(field, drf_fields.FileField):
+                mappers.append((name, lookup, self._file_converter(model, field, context), None, False))
+            elif isinstance(field, _IDENTITY_FIELDS):
+                mappers.append((name, lookup, None, None, False))
+            else:
+                mappers.append((name, lookup, field.to_representation, None, False))
+        return mappers
+
+    @staticmethod
+    def _resolves(model, source):
+        for part in source.split('.'):
+            try:
+                field = model._meta.get_field(part)
+            except FieldDoesNotExist:
+                return False
+            model = field.related_model
+        return True
+
+    @staticmethod
+    def _file_converter(model, field, context):
+        storage = model._meta.get_field(field.source).storage
+        request = context.get('request')
+        use_url = getattr(field, 'use_url', True)
+
+        def convert(name):
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+
+        return convert
+
+    @staticmethod
+    def build_row(row, mappers):
+        out = {}
+        for name, lookup, converter, nested, sees_null in mappers:
+            value = row[lookup]
+            if sees_null:
+                out[name] = converter(value)
+            elif value is None:
+                out[name] = None
+            elif nested is not None:
+                out[name] = LeanSerializer.build_row(row, nested)
+            elif converter is None:
+                out[name] = value
+            else:
+                out[name] = converter(value)
+        return out
+
+    @classmethod
+    def build_rows(cls, rows, mappers):
+        build = cls.build_row
+        return [build(row, mappers) for row in rows]
+
+    def serialize(self, queryset, context=None):
+        """Serialize ``queryset`` to a list of dicts via a single values() query."""
+        lookups, mappers = self.compile(context)
+        return self.build_rows(queryset.values(*lookups), mappers)
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import images
+
+
+class Command(BaseCommand):
+    help = 'Render resized WebP/JPEG variants for queued image uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=images.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Process the due jobs and exit')
+        parser.add_argument('--backfill', action='store_true', help='First queue every existing upload without variants')
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            self.stdout.write(f'Queued {images.backfill()} existing images')
+
+        batch_size = options['batch_size']
+        total_done = total_failed = 0
+        while True:
+            done, failed = images.process_batch(batch_size)
+            total_done += done
+            total_failed += failed
+            if done or failed:
+                self.stdout.write(f'Processed {done}, failed {failed}')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Image queue drained: {total_done} processed, {total_failed} failed'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key responses and cap the number kept.'
+
+    def handle(self, *args, **options):
+        deleted = idempotency.prune()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys'))
@@ -0,0 +1,51 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('core.querybudget')
+
+
+class QueryCounter:
+    """``connection.execute_wrapper`` hook that counts queries and DB time."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class QueryBudgetMiddleware:
+    """Record the number of SQL queries and DB time spent per request.
+
+    With DEBUG on the figures are returned in ``X-DB-Query-Count`` and
+    ``X-DB-Query-Time-Ms`` response headers; otherwise they are logged on the
+    ``core.querybudget`` logger, at WARNING level once a request exceeds
+    ``QUERY_BUDGET_WARN_THRESHOLD`` queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+
+        elapsed_ms = round(counter.duration * 1000, 2)
+        if settings.DEBUG:
+            response['X-DB-Query-Count'] = str(counter.count)
+            response['X-DB-Query-Time-Ms'] = str(elapsed_ms)
+        else:
+            threshold = getattr(settings, 'QUERY_BUDGET_WARN_THRESHOLD', 50)
+            level = logging.WARNING if counter.count > threshold else logging.INFO
+            logger.log(level, '%s %s queries=%d db_ms=%s', request.method, request.path, counter.count, elapsed_ms)
+        return response
@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone
@@ -121,4 +122,118 @@ class PasswordResetToken(models.Model):
         return not self.is_used and timezone.now() < self.expires_at
 
     def __str__(self):
-        return f"Password reset for {self.user.email}"
\ No newline at end of file
+        return f"Password reset for {self.user.email}"
+
+class IdentifierSequence(models.Model):
+    """Counter row backing a human-readable identifier series (APT, DOC, ...).
+
+    Workers reserve blocks of values by atomically bumping ``last_value``;
+    see ``core.identifiers.IdentifierAllocator``.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
+
+
+class OutboundEmail(models.Model):
+    """Email queued for delivery by ``manage.py send_outbox``.
+
+    Rows are written in the same transaction as the change that triggers
+    them, so a rolled-back request never sends mail and a committed one
+    never loses it. ``sensitive`` bodies (OTPs, temporary passwords) are
+    cleared once the message is sent, given up on or past ``expires_at``.
+    See ``core.outbox``.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    recipients = models.JSONField(default=list)
+    sensitive = models.BooleanField(default=False)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+
+class ImageJob(models.Model):
+    """Resized variants to render for an uploaded image, processed by ``manage.py process_images``.
+
+    ``model`` is the owning model's label (``pharmacy.medicine``) and
+    ``source`` the storage name of the upload the variants are made from.
+    See ``core.images``.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    )
+
+    model = models.CharField(max_length=100)
+    object_id = models.BigIntegerField()
+    source = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_id', 'source'], name='image_job_source_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='image_job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model}#{self.object_id} {self.source} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """Response recorded for a client's ``Idempotency-Key``, replayed on retries.
+
+    The row is inserted in the same transaction as the request's writes, so
+    it only becomes visible together with them. See ``core.idempotency``.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # "POST /api/pharmacy/sales/" and a hash of the request body
+    endpoint = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_key_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} {self.endpoint} ({self.response_status})"
@@ -0,0 +1,170 @@
+"""Transactional email outbox.
+
+Views call ``enqueue()`` instead of ``send_mail``: it only inserts an
+``OutboundEmail`` row, so no SMTP round trip happens inside the request and
+the row commits or rolls back together with the rest of the request.
+
+``manage.py send_outbox`` drains the table with ``deliver_batch()``. Each
+batch is claimed by pushing ``next_attempt_at`` forward by a lease (so
+concurrent workers skip it), then sent over one reused backend connection.
+Failed messages are retried with exponential backoff until
+``EMAIL_OUTBOX_MAX_ATTEMPTS`` is reached, after which they are marked failed.
+
+Mail a user is waiting for (password reset OTPs) is enqueued with
+``send_now=True``: delivery is attempted right after the transaction
+commits, and the worker only retries it if that attempt fails. Messages
+enqueued as ``sensitive`` have their body cleared once they are sent, given
+up on or past ``expires_at``, so OTPs and temporary passwords do not stay in
+the table.
+"""
+import datetime
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger('core.outbox')
+
+DEFAULT_BATCH_SIZE = 50
+# Seconds a claimed batch is hidden from other workers while it is sent
+LEASE_SECONDS = 300
+
+
+def max_attempts():
+    return int(getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+
+
+def backoff(attempts):
+    """Delay before retrying a message that has failed ``attempts`` times."""
+    base = int(getattr(settings, 'EMAIL_OUTBOX_RETRY_SECONDS', 60))
+    return datetime.timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def enqueue(subject, body, recipients, from_email=None, sensitive=False, expires_at=None, send_now=False):
+    """Queue an email for background delivery and return the outbox row.
+
+    ``send_now`` also tries to deliver it once the current transaction
+    commits; ``expires_at`` stops delivery attempts after that time.
+    """
+    message = OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or getattr(settings, 'DEFAULT_FROM_EMAIL', '') or '',
+        recipients=list(recipients),
+        sensitive=sensitive,
+        expires_at=expires_at,
+    )
+    if send_now:
+        transaction.on_commit(lambda: deliver_now(message.pk))
+    return message
+
+
+def expire(now=None):
+    """Mark pending messages past ``expires_at`` failed and clear sensitive bodies."""
+    now = now or timezone.now()
+    return OutboundEmail.objects.filter(status='pending', expires_at__lte=now).update(
+        status='failed',
+        last_error='Expired before delivery',
+        body=Case(When(sensitive=True, then=Value('')), default=F('body'), output_field=TextField()),
+    )
+
+
+def claim_batch(batch_size=DEFAULT_BATCH_SIZE, now=None, ids=None):
+    """Lease up to ``batch_size`` due messages (only ``ids``, if given) to the calling worker."""
+    now = now or timezone.now()
+    expire(now)
+    with transaction.atomic():
+        due = (
+            OutboundEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+        )
+        if ids is not None:
+            due = due.filter(pk__in=ids)
+        batch = list(due[:batch_size])
+        if batch:
+            OutboundEmail.objects.filter(pk__in=[m.pk for m in batch]).update(
+                next_attempt_at=now + datetime.timedelta(seconds=LEASE_SECONDS)
+            )
+    return batch
+
+
+def deliver_batch(batch_size=DEFAULT_BATCH_SIZE, connection=None):
+    """Send one batch of due messages. Returns ``(sent, failed)`` counts."""
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        opened = connection.open()
+    except Exception as exc:
+        # Each message below retries the connection and is backed off on failure
+        logger.warning('Could not open mail connection: %s', exc)
+        opened = False
+    try:
+        for message in batch:
+            if _deliver(message, connection):
+                sent += 1
+                continue
+            failed += 1
+            # The failure may have broken the session; start a fresh one
+            connection.close()
+            try:
+                opened = connection.open() or opened
+            except Exception:
+                pass
+    finally:
+        if opened:
+            connection.close()
+    return sent, failed
+
+
+def deliver_now(pk, connection=None):
+    """Try to send one queued message immediately; True when it was sent.
+
+    A failure is backed off like any other, leaving the message to
+    ``send_outbox``.
+    """
+    batch = claim_batch(1, ids=[pk])
+    return bool(batch) and _deliver(batch[0], connection or get_connection())
+
+
+def _deliver(message, connection):
+    now = timezone.now()
+    message.attempts += 1
+    try:
+        EmailMessage(
+            message.subject, message.body, message.from_email or None, message.recipients,
+            connection=connection,
+        ).send(fail_silently=False)
+    except Exception as exc:
+        message.last_error = f'{type(exc).__name__}: {exc}'
+        if message.attempts >= max_attempts():
+            message.status = 'failed'
+            _scrub(message)
+            logger.error('Giving up on outbox email %s after %d attempts: %s', message.pk, message.attempts, exc)
+        else:
+            message.next_attempt_at = now + backoff(message.attempts)
+            logger.warning('Outbox email %s failed (attempt %d): %s', message.pk, message.attempts, exc)
+        message.save(update_fields=['attempts', 'status', 'next_attempt_at', 'last_error', 'body'])
+        return False
+
+    message.status = 'sent'
+    message.sent_at = now
+    message.last_error = ''
+    _scrub(message)
+    message.save(update_fields=['attempts', 'status', 'sent_at', 'last_error', 'body'])
+    return True
+
+
+def _scrub(message):
+    if message.sensitive:
+        message.body = ''
@@ -0,0 +1,125 @@
+"""Minimal publish/subscribe used to push events to streaming clients.
+
+The broker is chosen with the ``PUBSUB_BROKER`` setting (a dotted path to a
+``Broker`` subclass). ``LocalBroker`` fans messages out to subscribers in
+the same process and is the only broker shipped, so streaming requires a
+single worker process: an event published in one process never reaches
+streams held by another. A deployment running several worker processes
+needs a shared broker implementing the same methods; ``check_broker`` is a
+system check that warns when ``WEB_CONCURRENCY`` is above 1 with
+``LocalBroker``.
+
+Messages are published after the surrounding transaction commits
+(``publish_on_commit``), so subscribers never see rows that were rolled
+back.
+"""
+import queue
+import threading
+
+from django.conf import settings
+from django.core import checks
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class Subscription:
+    """A subscriber's message queue. ``overflowed`` is set if messages were dropped."""
+
+    def __init__(self, broker, channel, maxsize):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def get(self, timeout=None):
+        """Return the next message, or None if none arrived within ``timeout``."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class LocalBroker(Broker):
+    """In-process broker: every subscriber gets its own bounded queue.
+
+    A slow subscriber whose queue is full loses messages instead of
+    blocking the publisher; its ``overflowed`` flag tells it to resync.
+    """
+    MAX_PENDING = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                subscription.overflowed = True
+        return len(subscribers)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.MAX_PENDING)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker_path():
+    return getattr(settings, 'PUBSUB_BROKER', 'core.pubsub.LocalBroker')
+
+
+@checks.register()
+def check_broker(app_configs=None, **kwargs):
+    """Warn when ``LocalBroker`` is configured for several worker processes."""
+    workers = int(getattr(settings, 'WEB_CONCURRENCY', 1))
+    if workers > 1 and issubclass(import_string(broker_path()), LocalBroker):
+        return [checks.Warning(
+            f'PUBSUB_BROKER is LocalBroker but WEB_CONCURRENCY is {workers}',
+            hint='Pharmacist queue events only reach streams held by the publishing process; '
+                 'run a single worker or configure a shared broker.',
+            id='core.W001',
+        )]
+    return []
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(broker_path())()
+    return _broker
+
+
+def publish_on_commit(channel, message):
+    transaction.on_commit(lambda: get_broker().publish(channel, message))
@@ -1,3 +1,582 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import threading
 
-# Create your tests here.
+from django.core import mail
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import outbox
+from .identifiers import IdentifierAllocator, max_numeric_suffix
+from .models import IdentifierSequence, OutboundEmail
+
+
+class IdentifierAllocatorTests(TestCase):
+    def test_seed_continues_after_existing_identifiers(self):
+        allocator = IdentifierAllocator('test-seed', 'APT', 5, seed=lambda: 41, block_size=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(allocator.next_id(), 'APT00042')
+        self.assertEqual(allocator.next_id(), 'APT00043')
+
+    def test_block_is_served_from_memory(self):
+        allocator = IdentifierAllocator('test-block', 'DOC', 3, block_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            allocator.next_id()
+        with self.assertNumQueries(0):
+            ids = [allocator.next_id() for _ in range(9)]
+        self.assertEqual(ids[-1], 'DOC010')
+        self.assertEqual(IdentifierSequence.objects.get(name='test-block').last_value, 10)
+
+    def test_uncommitted_block_serves_only_its_own_transaction(self):
+        allocator = IdentifierAllocator('test-atomic', 'APT', 5, block_size=10)
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.assertEqual(allocator.next_value(), 1)
+            with self.assertNumQueries(0):
+                self.assertEqual([allocator.next_value() for _ in range(3)], [2, 3, 4])
+        # Until the reservation commits the rest of the block stays unpublished
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual((allocator._next, allocator._end), (0, 0))
+
+        other_thread = []
+        worker = threading.Thread(target=lambda: other_thread.append(allocator._pending()))
+        worker.start()
+        worker.join()
+        self.assertEqual(other_thread, [None])
+
+        callbacks[0]()
+        self.assertEqual((allocator._next, allocator._end), (5, 11))
+
+    def test_rolled_back_reservation_is_not_reused(self):
+        allocator = IdentifierAllocator('test-rollback', 'APT', 5, block_size=10)
+        try:
+            with transaction.atomic():
+                self.assertEqual(allocator.next_value(), 1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # The sequence update rolled back with the savepoint, so 1 is free again
+        self.assertEqual(allocator.next_value(), 1)
+        self.assertEqual(allocator.next_value(), 2)
+
+    def test_max_numeric_suffix_ignores_foreign_values(self):
+        self.assertEqual(max_numeric_suffix(['APT00007', 'APTx', None, 'DOC999', 'APT00012'], 'APT'), 12)
+
+
+class IdentifierAllocatorConcurrencyTests(TransactionTestCase):
+    workers = 8
+    per_worker = 250
+
+    def test_concurrent_workers_never_collide(self):
+        results = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            # Each thread stands in for a separate process with its own block
+            allocator = IdentifierAllocator('stress', 'APT', 5, block_size=7)
+            issued = []
+            try:
+                while len(issued) < self.per_worker:
+                    try:
+                        issued.append(allocator.next_id())
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting
+                        continue
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+            with lock:
+                results.extend(issued)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.workers * self.per_worker)
+        self.assertEqual(len(set(results)), len(results))
+
+
+class QueryBudgetTests(TestCase):
+    """Every list endpoint must run in a fixed number of queries.
+
+    Data is seeded with several rows per relation so that an N+1 pattern
+    pushes the count over budget. Endpoints with conditional GET spend one
+    extra query on their validators.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        from appointment.models import Appointment, Prescription
+        from chat.models import ChatMessage, ChatSession
+        from doctor.models import DoctorProfile, DoctorReview, DoctorTip
+        from pharmacy.models import Medicine, MedicineCategory
+        from .models import User
+
+        cls.admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', role='admin', is_staff=True)
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        cls.customers = [
+            User.objects.create_user(email=f'cust{i}@example.com', password='pw', name=f'Customer {i}', role='customer')
+            for i in range(3)
+        ]
+        cls.doctors = []
+        for i in range(3):
+            user = User.objects.create_user(email=f'doc{i}@example.com', password='pw', name=f'Doctor {i}', role='doctor')
+            cls.doctors.append(DoctorProfile.objects.create(user=user, doctor_id=f'DOC{i + 1:03d}', specialty='Cardiology'))
+
+        today = datetime.date.today()
+        for d_index, doctor in enumerate(cls.doctors):
+            DoctorTip.objects.create(doctor=doctor, title=f'Tip {d_index}', body='Drink water')
+            for c_index, customer in enumerate(cls.customers):
+                DoctorReview.objects.create(doctor=doctor, user=customer, rating=4)
+                appointment = Appointment.objects.create(
+                    patient=customer, doctor=doctor,
+                    appointment_date=today + datetime.timedelta(days=c_index),
+                    appointment_time=datetime.time(9 + d_index),
+                    reason='Checkup', patient_name=customer.name, patient_age=30,
+                    patient_gender='Male', patient_phone='123', consultation_fee=500,
+                    status='completed',
+                )
+                Prescription.objects.create(
+                    appointment=appointment, doctor=doctor, patient=customer,
+                    medications=[{'name': 'Paracetamol', 'dosage': '500mg', 'duration': '3 days'}],
+                    instructions='After food', diagnosis='Fever',
+                )
+
+        for i in range(3):
+            category = MedicineCategory.objects.create(name=f'Category {i}', slug=f'category-{i}')
+            for j in range(3):
+                Medicine.objects.create(name=f'Medicine {i}-{j}', category=category, price=10, stock_count=5)
+
+        for customer in cls.customers:
+            for i in range(2):
+                session = ChatSession.objects.create(user=customer, title=f'Chat {i}')
+                ChatMessage.objects.create(session=session, sender='user', content='Hello')
+                ChatMessage.objects.create(session=session, sender='assistant', content='Hi')
+
+    def assertQueryBudget(self, user, url, budget):
+        from rest_framework.test import APIClient
+        from django.test.utils import CaptureQueriesContext
+
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        queries = '\n'.join(q['sql'] for q in ctx.captured_queries)
+        self.assertLessEqual(len(ctx), budget, f'{url} ran {len(ctx)} queries (budget {budget}):\n{queries}')
+
+    def test_doctor_endpoints(self):
+        doctor = self.doctors[0]
+        self.assertQueryBudget(None, '/api/doctor/doctors/', 2)
+        self.assertQueryBudget(None, '/api/doctor/tips/', 2)
+        self.assertQueryBudget(None, f'/api/doctor/{doctor.id}/reviews/', 2)
+        self.assertQueryBudget(self.admin, '/api/doctor/pharmacists/', 1)
+
+    def test_appointment_endpoints(self):
+        customer = self.customers[0]
+        doctor = self.doctors[0]
+        self.assertQueryBudget(customer, '/api/appointment/appointments/', 2)
+        self.assertQueryBudget(doctor.user, '/api/appointment/appointments/', 2)
+        self.assertQueryBudget(customer, f'/api/appointment/appointments/?doctor={doctor.id}', 2)
+        self.assertQueryBudget(customer, '/api/appointment/appointments/?scope=past&limit=2', 2)
+
+    def test_prescription_endpoints(self):
+        self.assertQueryBudget(self.customers[0], '/api/appointment/prescriptions/', 1)
+        self.assertQueryBudget(self.doctors[0].user, '/api/appointment/prescriptions/', 1)
+        self.assertQueryBudget(self.pharmacist, '/api/appointment/prescriptions/', 1)
+        self.assertQueryBudget(self.pharmacist, '/api/appointment/prescriptions/pharmacist/', 1)
+
+    def test_pharmacy_and_chat_endpoints(self):
+        self.assertQueryBudget(self.pharmacist, '/api/pharmacy/categories/', 1)
+        self.assertQueryBudget(None, '/api/pharmacy/products/', 2)
+        self.assertQueryBudget(self.customers[0], '/api/chat/sessions/', 2)
+
+    def test_admin_dashboard_endpoints(self):
+        self.assertQueryBudget(self.admin, '/api/appointment/stats/?days=30', 1)
+
+    def test_middleware_reports_query_count_in_debug(self):
+        from rest_framework.test import APIClient
+        from django.test import override_settings
+
+        with override_settings(DEBUG=True):
+            response = APIClient().get('/api/doctor/doctors/')
+        self.assertEqual(response['X-DB-Query-Count'], '2')
+        self.assertIn('X-DB-Query-Time-Ms', response)
+
+    def test_conditional_get_returns_304_without_serializing(self):
+        from rest_framework.test import APIClient
+        from pharmacy.models import Medicine
+
+        client = APIClient()
+        first = client.get('/api/pharmacy/products/')
+        self.assertIn('Last-Modified', first)
+
+        with CaptureQueriesContext(connection) as ctx:
+            cached = client.get('/api/pharmacy/products/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(ctx), 1)
+        self.assertEqual(cached['ETag'], first['ETag'])
+
+        medicine = Medicine.objects.first()
+        medicine.stock_count += 1
+        medicine.save()
+        self.assertEqual(client.get('/api/pharmacy/products/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+        Medicine.objects.filter(pk=medicine.pk).delete()
+        changed = client.get('/api/pharmacy/products/')
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        # The delete left the newest timestamp alone; If-Modified-Since must not hide it
+        since = client.get('/api/pharmacy/products/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 200)
+
+    def test_conditional_get_tracks_related_rows(self):
+        from rest_framework.test import APIClient
+        from doctor.models import DoctorReview
+
+        client = APIClient()
+        etag = client.get('/api/doctor/doctors/')['ETag']
+        self.assertEqual(client.get('/api/doctor/doctors/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        review = DoctorReview.objects.create(doctor=self.doctors[0], user=self.customers[0], rating=1)
+        self.assertEqual(client.get('/api/doctor/doctors/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = client.get('/api/doctor/doctors/')['ETag']
+        review.rating = 5
+        review.save()
+        self.assertEqual(client.get('/api/doctor/doctors/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = client.get('/api/doctor/doctors/')['ETag']
+        user = self.doctors[1].user
+        user.name = 'Renamed Doctor'
+        user.save()
+        self.assertEqual(client.get('/api/doctor/doctors/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # Appointment lists are per user
+        client.force_authenticate(self.customers[0])
+        etag = client.get('/api/appointment/appointments/')['ETag']
+        client.force_authenticate(self.customers[1])
+        self.assertEqual(client.get('/api/appointment/appointments/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_lean_serialization_is_byte_identical(self):
+        from rest_framework.test import APIClient
+
+        cases = [
+            (None, '/api/doctor/doctors/'),
+            (self.customers[0], '/api/appointment/appointments/'),
+            (self.doctors[0].user, '/api/appointment/appointments/?scope=past&limit=2'),
+            (self.pharmacist, '/api/appointment/prescriptions/'),
+            (None, '/api/pharmacy/products/'),
+        ]
+        for user, url in cases:
+            client = APIClient()
+            if user is not None:
+                client.force_authenticate(user)
+            sep = '&' if '?' in url else '?'
+            regular = client.get(f'{url}{sep}lean=0')
+            lean = client.get(f'{url}{sep}lean=1')
+            self.assertEqual(regular.status_code, 200, url)
+            self.assertEqual(lean.content, regular.content, url)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'other.example.com'])
+    def test_lean_plan_is_compiled_once_per_host(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+        from pharmacy.models import Medicine
+        from pharmacy.serializers import MEDICINE_LEAN
+
+        Medicine.objects.filter(pk=Medicine.objects.order_by('pk').values('pk')[:1]).update(image='medicine_images/a.png')
+        MEDICINE_LEAN._plans.clear()
+        client = APIClient()
+        with mock.patch.object(MEDICINE_LEAN, '_compile', wraps=MEDICINE_LEAN._compile) as compile_plan:
+            for host in ('testserver', 'testserver', 'other.example.com', 'testserver'):
+                regular = client.get('/api/pharmacy/products/?lean=0', HTTP_HOST=host)
+                lean = client.get('/api/pharmacy/products/?lean=1', HTTP_HOST=host)
+                self.assertEqual(lean.content, regular.content, host)
+                self.assertIn(f'http://{host}/media/medicine_images/a.png'.encode(), lean.content)
+        self.assertEqual(compile_plan.call_count, 2)
+        self.assertIs(MEDICINE_LEAN.compile(), MEDICINE_LEAN.compile())
+
+
+class FailingEmailBackend:
+    """Mail backend whose every send fails, for outbox retry tests."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def open(self):
+        return False
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP unavailable')
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+    EMAIL_OUTBOX_RETRY_SECONDS=60,
+)
+class OutboxTests(TestCase):
+    def test_forgot_password_sends_after_commit_and_clears_the_otp(self):
+        from rest_framework.test import APIClient
+        from .models import OTP, User
+
+        User.objects.create_user(email='patient@example.com', password='pw', name='Patient')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post('/api/auth/forgot-password/', {'email': 'patient@example.com'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(OTP.objects.get().otp_code, mail.outbox[0].body)
+        queued = OutboundEmail.objects.get()
+        self.assertEqual(queued.recipients, ['patient@example.com'])
+        self.assertEqual((queued.status, queued.attempts, queued.body), ('sent', 1, ''))
+        self.assertIsNotNone(queued.sent_at)
+        self.assertEqual(outbox.deliver_batch(), (0, 0))
+
+    @override_settings(EMAIL_BACKEND='core.tests.FailingEmailBackend')
+    def test_unsent_otp_is_retried_then_expires(self):
+        from unittest import mock
+        from rest_framework.test import APIClient
+        from .models import User
+
+        User.objects.create_user(email='patient@example.com', password='pw', name='Patient')
+        with self.captureOnCommitCallbacks(execute=True):
+            APIClient().post('/api/auth/forgot-password/', {'email': 'patient@example.com'}, format='json')
+        queued = OutboundEmail.objects.get()
+        self.assertEqual((queued.status, queued.attempts), ('pending', 1))
+        self.assertIn('OTP', queued.body)
+
+        later = queued.expires_at + datetime.timedelta(seconds=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(outbox.deliver_batch(), (0, 0))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.body), ('failed', ''))
+
+    def test_account_emails_are_queued_and_cleared_once_sent(self):
+        from rest_framework.test import APIClient
+        from .models import User
+
+        admin = User.objects.create_user(email='admin@example.com', password='pw', name='Admin', role='admin', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.post('/api/doctor/pharmacists/create/', {
+            'email': 'pharma@example.com', 'name': 'Pharma', 'password': 'Temp-pass-1',
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['email_sent'])
+        self.assertTrue(response.data['email_queued'])
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(outbox.deliver_batch(), (1, 0))
+        self.assertIn('Temp-pass-1', mail.outbox[0].body)
+        self.assertEqual(OutboundEmail.objects.get().body, '')
+
+    def test_batch_reuses_one_connection(self):
+        from unittest import mock
+        from django.core.mail import get_connection
+
+        for i in range(3):
+            outbox.enqueue('Hello', 'Body', [f'user{i}@example.com'])
+        connection = get_connection()
+        with mock.patch.object(connection, 'open', wraps=connection.open) as opened:
+            self.assertEqual(outbox.deliver_batch(connection=connection), (3, 0))
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(outbox.deliver_batch(), (0, 0))
+
+    def test_failures_back_off_then_give_up(self):
+        from unittest import mock
+        from django.utils import timezone
+
+        queued = outbox.enqueue('Hello', 'Body', ['user@example.com'])
+        backend = FailingEmailBackend()
+
+        self.assertEqual(outbox.deliver_batch(connection=backend), (0, 1))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('pending', 1))
+        self.assertIn('SMTP unavailable', queued.last_error)
+        self.assertGreater(queued.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertEqual(outbox.deliver_batch(connection=backend), (0, 0))
+
+        later = queued.next_attempt_at + datetime.timedelta(seconds=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(outbox.deliver_batch(connection=backend), (0, 1))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), ('failed', 2))
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        import tempfile
+        from rest_framework.test import APIClient
+        from .models import User
+
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist'))
+
+    def _upload(self, name, size=(2000, 1000), fmt='JPEG', mode='RGB', orientation=None):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+
+        image = Image.new(mode, size, 'red')
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'
+        if orientation:
+            exif[0x0112] = orientation
+        image.save(buffer, fmt, exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def _create(self, **images):
+        response = self.client.post('/api/pharmacy/products/', {'name': 'Aspirin', 'price': '2.00', **images}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return response.data['medicine']['id']
+
+    def test_upload_queues_job_and_worker_writes_stripped_variants(self):
+        from django.core.files.storage import default_storage
+        from django.core.management import call_command
+        from PIL import Image
+        from pharmacy.models import Medicine
+        from . import images
+        from .models import ImageJob
+
+        # EXIF orientation 6 means the stored pixels are rotated; variants come out upright
+        pk = self._create(image=self._upload('photo.jpg', orientation=6))
+        job = ImageJob.objects.get()
+        self.assertEqual((job.model, job.object_id, job.status), ('pharmacy.medicine', pk, 'pending'))
+        self.assertEqual(self.client.get(f'/api/pharmacy/products/{pk}/').data['medicine']['image_variants'], {})
+
+        call_command('process_images', once=True, stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        variants = Medicine.objects.get(pk=pk).image_variants
+        self.assertEqual(variants['source'], Medicine.objects.get(pk=pk).image.name)
+        self.assertEqual([(variants[n]['width'], variants[n]['height']) for n, _ in images.VARIANTS], [(80, 160), (240, 480), (640, 1280)])
+        for ext in ('webp', 'jpeg'):
+            name = variants['thumb'][ext]
+            self.assertRegex(name, rf'^image_variants/[0-9a-f]{{24}}\.{ext}$')
+            with default_storage.open(name) as fp, Image.open(fp) as variant:
+                self.assertEqual(len(variant.getexif()), 0)
+                self.assertNotIn('icc_profile', variant.info)
+
+        data = self.client.get('/api/pharmacy/products/').data['medicines'][0]['image_variants']
+        self.assertTrue(data['card']['webp'].startswith('http://testserver/media/image_variants/'))
+        self.assertEqual(self.client.get('/api/pharmacy/products/', {'lean': 1}).data['medicines'][0]['image_variants'], data)
+
+    def test_replaced_upload_skips_stale_job_and_clears_variants(self):
+        from pharmacy.models import Medicine
+        from . import images
+        from .models import ImageJob
+
+        pk = self._create(image=self._upload('first.png', size=(100, 50), fmt='PNG', mode='RGBA'))
+        images.process_batch()
+        self.assertEqual(Medicine.objects.get(pk=pk).image_variants['full']['width'], 100)
+
+        self.client.put(f'/api/pharmacy/products/{pk}/', {'image': self._upload('second.png', fmt='PNG')}, format='multipart')
+        self.assertEqual(Medicine.objects.get(pk=pk).image_variants, {})
+        ImageJob.objects.create(model='pharmacy.medicine', object_id=pk, source='medicine_images/gone.png')
+        self.assertEqual(images.process_batch(), (2, 0))
+        self.assertEqual(
+            sorted(ImageJob.objects.values_list('status', flat=True)), ['done', 'done', 'skipped'],
+        )
+        self.assertEqual(Medicine.objects.get(pk=pk).image_variants['full']['width'], 1280)
+
+    def test_unreadable_upload_is_retried_then_failed(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from pharmacy.models import Medicine
+        from . import images
+        from .models import ImageJob
+
+        pk = self._create(image=self._upload('photo.jpg'))
+        medicine = Medicine.objects.get(pk=pk)
+        medicine.image.save('broken.jpg', SimpleUploadedFile('broken.jpg', b'not an image'))
+        ImageJob.objects.filter(source=medicine.image.name).update(attempts=images.MAX_ATTEMPTS - 1)
+        with self.assertLogs('core.images', 'ERROR'):
+            self.assertEqual(images.process_batch(), (1, 1))
+        failed = ImageJob.objects.get(source=medicine.image.name)
+        self.assertEqual(failed.status, 'failed')
+        self.assertIn('UnidentifiedImageError', failed.last_error)
+
+
+class IdempotencyKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from pharmacy.models import Medicine
+        from .models import User
+
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        cls.aspirin = Medicine.objects.create(name='Aspirin', price='2.00', stock_count=10)
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.pharmacist)
+
+    def _sell(self, key, qty=3):
+        payload = {'customer_name': 'Walk-in', 'items': [{'product_id': self.aspirin.id, 'qty': qty}]}
+        return self.client.post('/api/pharmacy/sales/', payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_response_without_selling_twice(self):
+        from pharmacy.models import Sale
+
+        first = self._sell('sale-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        with CaptureQueriesContext(connection) as queries:
+            retry = self._sell('sale-1')
+        self.assertEqual((retry.status_code, retry['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(json.loads(retry.content), json.loads(first.content))
+        self.assertFalse(any('pharmacy_' in q['sql'] for q in queries.captured_queries))
+
+        self.assertEqual(self._sell('sale-2').status_code, 201)
+        self.aspirin.refresh_from_db()
+        self.assertEqual((Sale.objects.count(), self.aspirin.stock_count), (2, 4))
+
+    def test_key_reuse_errors_and_conflicts(self):
+        self.assertEqual(self._sell('sale-1').status_code, 201)
+        self.assertEqual(self._sell('sale-1', qty=2).status_code, 422)
+        self.assertEqual(self._sell('x' * 256).status_code, 400)
+
+        # A 409 is a final answer for that request and is replayed too
+        self.assertEqual(self._sell('too-many', qty=50).status_code, 409)
+        self.aspirin.refresh_from_db()
+        self.aspirin.stock_count = 100
+        self.aspirin.save(update_fields=['stock_count', 'updated_at'])
+        self.assertEqual(self._sell('too-many', qty=50).status_code, 409)
+
+    def test_expired_keys_rerun_and_prune_caps_store(self):
+        from django.core.management import call_command
+        from django.utils import timezone
+        from pharmacy.models import Sale
+        from .models import IdempotencyKey
+
+        self._sell('sale-1')
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        self.assertNotIn('Idempotent-Replayed', self._sell('sale-1'))
+        self.assertEqual(Sale.objects.count(), 2)
+
+        self._sell('sale-2')
+        self._sell('sale-3')
+        IdempotencyKey.objects.filter(key='sale-3').update(expires_at=timezone.now())
+        with override_settings(IDEMPOTENCY_MAX_KEYS=1):
+            call_command('prune_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['sale-2'])
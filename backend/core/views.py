@@ -6,6 +6,7 @@ from django.contrib.auth import login
 from django.utils import timezone
 from rest_framework_simplejwt.tokens import RefreshToken
 from .models import User, OTP, CustomerProfile
+from . import outbox
 from .serializers import (
     UserSerializer,
     UserRegisterSerializer,
@@ -16,6 +17,8 @@ from .serializers import (
     CustomerProfileSerializer,
 )
 from django.conf import settings
+from django.db import transaction
+from datetime import timedelta
 import logging
 
 logger = logging.getLogger(__name__)
@@ -110,12 +113,8 @@ class ForgotPasswordView(APIView):
             email = serializer.validated_data['email']
             
             try:
-                # Generate OTP
-                otp = OTP.generate_otp(email)
-                
-                # Send OTP via email
-                try:
-                    from django.core.mail import send_mail
+                with transaction.atomic():
+                    otp = OTP.generate_otp(email)
                     subject = 'Password Reset OTP - Arogya Medical'
                     message = f'''
 Hello,
@@ -129,35 +128,17 @@ If you didn't request this, please ignore this email.
 Best regards,
 Arogya Medical Team
 '''
-                    from_email = getattr(settings, 'DEFAULT_FROM_EMAIL', None)
-                    send_mail(
-                        subject,
-                        message,
-                        from_email,
-                        [email],
-                        fail_silently=False,
+                    # Sent right after commit; `manage.py send_outbox` retries it until the OTP expires
+                    outbox.enqueue(
+                        subject, message, [email], sensitive=True, send_now=True,
+                        expires_at=otp.created_at + timedelta(minutes=10),
                     )
 
-                    return Response({
-                        'success': True,
-                        'message': 'OTP sent to your email'
-                    }, status=status.HTTP_200_OK)
-
-                except Exception as email_error:
-                    logger.exception("Email sending failed for OTP: %s", email_error)
-                    # In development, return the OTP in the response so tests can continue
-                    if getattr(settings, 'DEBUG', False):
-                        return Response({
-                            'success': True,
-                            'message': 'OTP generated (email failed)',
-                            'otp': otp.otp_code
-                        }, status=status.HTTP_200_OK)
-                    # In production, do not expose the OTP in the response
-                    return Response({
-                        'success': True,
-                        'message': 'OTP generated (email failed)'
-                    }, status=status.HTTP_200_OK)
-                
+                return Response({
+                    'success': True,
+                    'message': 'OTP sent to your email'
+                }, status=status.HTTP_200_OK)
+
             except Exception as e:
                 return Response({
                     'success': False,
@@ -1,5 +1,8 @@
 from django.contrib import admin
+from django.db import transaction
+from . import schedule
 from .models import DoctorProfile, DoctorTip, DoctorReview
+from .models import WeeklyScheduleBlock, ScheduleException, DoctorSlot
 
 
 @admin.register(DoctorProfile)
@@ -19,3 +22,42 @@ class DoctorReviewAdmin(admin.ModelAdmin):
 	list_display = ('doctor', 'user', 'rating', 'created_at')
 	search_fields = ('doctor__user__name', 'user__name', 'comment')
 	list_filter = ('rating', 'created_at')
+
+
+@admin.register(WeeklyScheduleBlock)
+class WeeklyScheduleBlockAdmin(admin.ModelAdmin):
+	list_display = ('doctor', 'weekday', 'start_time', 'end_time', 'slot_minutes')
+	list_filter = ('weekday',)
+	search_fields = ('doctor__doctor_id', 'doctor__user__name')
+
+	# Blocks are authoritative, so edits here rebuild the doctor's slots
+	def save_model(self, request, obj, form, change):
+		super().save_model(request, obj, form, change)
+		self._rematerialize([obj.doctor_id])
+
+	def delete_model(self, request, obj):
+		super().delete_model(request, obj)
+		self._rematerialize([obj.doctor_id])
+
+	def delete_queryset(self, request, queryset):
+		doctor_ids = list(queryset.values_list('doctor_id', flat=True).distinct())
+		super().delete_queryset(request, queryset)
+		self._rematerialize(doctor_ids)
+
+	@staticmethod
+	def _rematerialize(doctor_ids):
+		transaction.on_commit(lambda: schedule.materialize(doctor_ids=doctor_ids))
+
+
+@admin.register(ScheduleException)
+class ScheduleExceptionAdmin(admin.ModelAdmin):
+	list_display = ('date', 'doctor', 'kind', 'start_time', 'end_time', 'reason')
+	list_filter = ('kind', 'date')
+	search_fields = ('doctor__doctor_id', 'doctor__user__name', 'reason')
+
+
+@admin.register(DoctorSlot)
+class DoctorSlotAdmin(admin.ModelAdmin):
+	list_display = ('doctor', 'date', 'start_time', 'end_time')
+	list_filter = ('date',)
+	search_fields = ('doctor__doctor_id', 'doctor__user__name')
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class DoctorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'doctor'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_migrate, post_save
+        from core.models import User
+        from .models import DoctorProfile, ScheduleException
+        from . import schedule, signals
+
+        post_save.connect(schedule.rematerialize_exception, sender=ScheduleException, dispatch_uid='schedule-exception-saved')
+        post_delete.connect(schedule.rematerialize_exception, sender=ScheduleException, dispatch_uid='schedule-exception-deleted')
+        post_save.connect(schedule.profile_created, sender=DoctorProfile, dispatch_uid='schedule-profile-created')
+        post_migrate.connect(schedule.convert_after_migrate, sender=self, dispatch_uid='schedule-convert-after-migrate')
+        post_save.connect(signals.touch_doctor_profile, sender=User, dispatch_uid='doctor-profile-touch-user')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from doctor import schedule
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert available_days / available_time_slots JSON into weekly schedule blocks '
+        '(also done after every migrate; use --force to rebuild converted doctors).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Also rebuild doctors that already have blocks')
+
+    def handle(self, *args, **options):
+        converted, blocks = schedule.convert_legacy(force=options['force'])
+        created, deleted = schedule.materialize()
+        self.stdout.write(self.style.SUCCESS(
+            f'Converted {converted} doctors into {blocks} schedule blocks; '
+            f'{created} slots materialized, {deleted} removed'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from doctor import schedule
+
+
+class Command(BaseCommand):
+    help = 'Materialize DoctorSlot rows for the rolling schedule horizon (run daily).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=None, help='Horizon in weeks (default SCHEDULE_HORIZON_WEEKS)')
+        parser.add_argument('--doctor', type=int, action='append', dest='doctors', help='DoctorProfile id (repeatable)')
+
+    def handle(self, *args, **options):
+        created, deleted = schedule.materialize(doctor_ids=options['doctors'], weeks=options['weeks'])
+        self.stdout.write(self.style.SUCCESS(f'{created} slots materialized, {deleted} removed'))
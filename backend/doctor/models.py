@@ -1,6 +1,7 @@
 from django.db import models
 from core.models import User
 from django.utils import timezone
+from core.identifiers import IdentifierAllocator, max_numeric_suffix
 
 # Day choices used for doctor availability
 DAY_CHOICES = [
@@ -24,6 +25,8 @@ class DoctorProfile(models.Model):
     bio = models.TextField(blank=True)
     # Optional profile image stored under MEDIA_ROOT/doctor_images/
     profile_image = models.ImageField(upload_to='doctor_images/', null=True, blank=True)
+    # Resized copies of ``profile_image`` written by the background pipeline (core.images)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     available_days = models.JSONField(default=list, blank=True)
     available_time_slots = models.JSONField(default=list, blank=True)
     consultation_fee = models.DecimalField(max_digits=10, decimal_places=2, default=500.00)
@@ -36,6 +39,100 @@ class DoctorProfile(models.Model):
 
     # REMOVE the save method entirely - let the serializer handle specialty formatting
 
+
+# Allocates DOC001, DOC002, ... for new doctor profiles
+DOCTOR_IDS = IdentifierAllocator(
+    'doctor', 'DOC', 3,
+    seed=lambda: max_numeric_suffix(DoctorProfile.objects.exclude(doctor_id__isnull=True).values_list('doctor_id', flat=True).iterator(), 'DOC'),
+)
+
+
+
+WEEKDAY_CHOICES = [(index, label) for index, (_, label) in enumerate(DAY_CHOICES)]
+
+
+class WeeklyScheduleBlock(models.Model):
+    """A recurring working block, split into slots of ``slot_minutes``.
+
+    ``weekday`` follows ``date.weekday()`` (0 = Monday). See
+    ``doctor.schedule`` for how blocks are turned into ``DoctorSlot`` rows.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name='schedule_blocks')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    slot_minutes = models.PositiveSmallIntegerField(default=30)
+
+    class Meta:
+        ordering = ['doctor', 'weekday', 'start_time']
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'weekday', 'start_time'], name='unique_schedule_block'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} {self.get_weekday_display()} {self.start_time}-{self.end_time}"
+
+
+class ScheduleException(models.Model):
+    """Leave or holiday removing slots on a date.
+
+    Without a doctor the exception applies to every doctor (clinic holiday);
+    without start/end times it covers the whole day.
+    """
+    KIND_CHOICES = (
+        ('leave', 'Leave'),
+        ('holiday', 'Holiday'),
+    )
+
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, null=True, blank=True, related_name='schedule_exceptions')
+    date = models.DateField()
+    start_time = models.TimeField(null=True, blank=True)
+    end_time = models.TimeField(null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='leave')
+    reason = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['date', 'start_time']
+        indexes = [
+            models.Index(fields=['date', 'doctor'], name='schedule_exception_date_idx'),
+        ]
+
+    def covers(self, start_time):
+        if self.start_time is None or self.end_time is None:
+            return True
+        return self.start_time <= start_time < self.end_time
+
+    def __str__(self):
+        who = self.doctor or 'All doctors'
+        return f"{self.get_kind_display()} {self.date} - {who}"
+
+
+class DoctorSlot(models.Model):
+    """A concrete bookable slot materialized from the weekly schedule.
+
+    Rows are kept for a rolling horizon by ``manage.py materialize_slots``
+    and rebuilt for a doctor whenever their schedule or exceptions change.
+    Whether a slot is booked is answered by the appointment table, not here.
+    """
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name='slots')
+    date = models.DateField()
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'date', 'start_time'], name='unique_doctor_slot'),
+        ]
+        indexes = [
+            # Also orders the earliest-free-slot search, doctor breaking ties
+            models.Index(fields=['date', 'start_time', 'doctor'], name='doctor_slot_when_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} {self.date} {self.start_time}"
+
+
 class DoctorTip(models.Model):
     """A short, doctor-authored tip article that customers can read.
 
@@ -71,6 +168,7 @@ class DoctorReview(models.Model):
     rating = models.PositiveSmallIntegerField(default=5)
     comment = models.TextField(blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
@@ -0,0 +1,278 @@
+"""Structured weekly schedules and materialized slot rows.
+
+A doctor's week is described by ``WeeklyScheduleBlock`` rows and adjusted
+by ``ScheduleException`` rows (leave, holidays). ``materialize()`` expands
+them into one ``DoctorSlot`` row per bookable slot for a rolling horizon of
+``SCHEDULE_HORIZON_WEEKS`` weeks, so questions such as "which doctors are
+free on Tuesday at 10:00" become an indexed query over ``DoctorSlot``.
+
+Blocks are the source of truth for when a doctor can be booked; availability
+reads ``DoctorSlot``. The legacy JSON lists on the profile (``available_days``
+and ``available_time_slots``) are only an input format: existing profiles
+are converted after ``migrate`` (or with ``manage.py convert_legacy_schedules``),
+new profiles get blocks when they are created, and the profile API calls
+``sync_from_profile()`` only when a doctor actually edits the lists.
+
+Booking checks go through ``offers()``, which falls back to the blocks (or
+the legacy lists) for a date with no materialized slots, so bookings keep
+working if ``materialize_slots`` has not run yet or has fallen behind.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import DoctorSlot, ScheduleException, WeeklyScheduleBlock
+
+DEFAULT_SLOT_MINUTES = 30
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def horizon_weeks():
+    return int(getattr(settings, 'SCHEDULE_HORIZON_WEEKS', 8))
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def _time(minutes):
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+def blocks_from_legacy(available_days, available_time_slots):
+    """Convert the legacy JSON lists into ``(weekday, start, end, slot_minutes)`` tuples.
+
+    Each legacy entry such as ``"9:00 AM - 9:30 AM"`` becomes a block holding
+    exactly one slot, matching how the entries have always been booked. An
+    empty day list means every day, as before.
+    """
+    from appointment.availability import parse_time_str
+
+    weekdays = sorted({
+        WEEKDAYS.index(d.strip().lower())
+        for d in available_days or []
+        if isinstance(d, str) and d.strip().lower() in WEEKDAYS
+    }) or list(range(7))
+
+    periods = {}
+    for slot in available_time_slots or []:
+        parts = str(slot).split('-')
+        start = parse_time_str(parts[0])
+        if start is None:
+            continue
+        end = parse_time_str(parts[1]) if len(parts) > 1 else None
+        length = _minutes(end) - _minutes(start) if end else 0
+        if length <= 0:
+            length = DEFAULT_SLOT_MINUTES
+        length = min(length, 24 * 60 - _minutes(start))
+        periods.setdefault(start, length)
+
+    return [
+        (weekday, start, _time(min(_minutes(start) + length, 24 * 60 - 1)), length)
+        for weekday in weekdays
+        for start, length in sorted(periods.items())
+    ]
+
+
+def slot_starts(block):
+    """Yield ``(start, end)`` times of the slots inside a schedule block."""
+    weekday, start, end, length = block
+    step = max(int(length), 1)
+    cursor, stop = _minutes(start), _minutes(end)
+    # A block whose end was clamped to 23:59 still holds its final slot
+    if stop == 24 * 60 - 1:
+        stop += 1
+    while cursor + step <= stop:
+        yield _time(cursor), _time(min(cursor + step, 24 * 60 - 1))
+        cursor += step
+
+
+def sync_from_profile(doctor, materialize_now=True):
+    """Replace ``doctor``'s weekly blocks with the ones from its JSON lists."""
+    blocks = blocks_from_legacy(doctor.available_days, doctor.available_time_slots)
+    with transaction.atomic():
+        WeeklyScheduleBlock.objects.filter(doctor=doctor).delete()
+        WeeklyScheduleBlock.objects.bulk_create([
+            WeeklyScheduleBlock(doctor=doctor, weekday=w, start_time=s, end_time=e, slot_minutes=m)
+            for w, s, e, m in blocks
+        ])
+        if materialize_now:
+            materialize(doctor_ids=[doctor.pk])
+    return len(blocks)
+
+
+def convert_legacy(force=False):
+    """Give every doctor without blocks (all doctors with ``force``) blocks from its JSON lists.
+
+    Slots are not materialized here. Returns ``(doctors converted, blocks created)``.
+    """
+    from .models import DoctorProfile
+
+    doctors = DoctorProfile.objects.all()
+    if not force:
+        doctors = doctors.exclude(pk__in=WeeklyScheduleBlock.objects.values('doctor_id'))
+    converted = blocks = 0
+    for doctor in doctors.iterator():
+        blocks += sync_from_profile(doctor, materialize_now=False)
+        converted += 1
+    return converted, blocks
+
+
+def offers(doctor, date, start_time):
+    """True when ``doctor``'s schedule has a slot starting at ``start_time`` on ``date``.
+
+    Reads the materialized ``DoctorSlot`` rows. When the doctor has none on
+    that date, the slot is worked out from the weekday's blocks (or from the
+    legacy JSON lists for a doctor with no blocks at all) and checked
+    against leave and holidays, as ``materialize()`` would.
+    """
+    materialized = set(DoctorSlot.objects.filter(doctor=doctor, date=date).values_list('start_time', flat=True))
+    if materialized:
+        return start_time in materialized
+
+    blocks = list(
+        WeeklyScheduleBlock.objects.filter(doctor=doctor, weekday=date.weekday())
+        .values_list('weekday', 'start_time', 'end_time', 'slot_minutes')
+    )
+    if not blocks and not WeeklyScheduleBlock.objects.filter(doctor=doctor).exists():
+        blocks = [
+            block for block in blocks_from_legacy(doctor.available_days, doctor.available_time_slots)
+            if block[0] == date.weekday()
+        ]
+    if not any(start == start_time for block in blocks for start, _ in slot_starts(block)):
+        return False
+    return not is_blocked(exceptions_between(doctor.pk, date, date), date, start_time)
+
+
+def exceptions_between(doctor_id, start, end):
+    """Return ``{date: [ScheduleException, ...]}`` affecting a doctor in [start, end]."""
+    return exceptions_for([doctor_id], start, end)[doctor_id]
+
+
+def exceptions_for(doctor_ids, start, end):
+    """Like ``exceptions_between`` for several doctors, with a single query.
+
+    Returns ``{doctor_id: {date: [ScheduleException, ...]}}`` including
+    clinic-wide exceptions for every doctor.
+    """
+    rows = ScheduleException.objects.filter(
+        Q(doctor_id__in=doctor_ids) | Q(doctor__isnull=True),
+        date__range=(start, end),
+    )
+    result = {doctor_id: {} for doctor_id in doctor_ids}
+    for exc in rows:
+        targets = result.values() if exc.doctor_id is None else [result[exc.doctor_id]]
+        for target in targets:
+            target.setdefault(exc.date, []).append(exc)
+    return result
+
+
+def is_blocked(exceptions, day, start_time):
+    """True when one of ``exceptions`` (as returned above) removes the slot."""
+    return any(exc.covers(start_time) for exc in exceptions.get(day, ()))
+
+
+def materialize(doctor_ids=None, start=None, weeks=None):
+    """Bring ``DoctorSlot`` rows in line with schedules for ``weeks`` from ``start``.
+
+    Slots before ``start`` are pruned, missing ones are created and ones no
+    longer produced by the schedule are deleted. Returns ``(created, deleted)``.
+    """
+    start = start or timezone.localdate()
+    end = start + datetime.timedelta(weeks=weeks or horizon_weeks()) - datetime.timedelta(days=1)
+
+    blocks = WeeklyScheduleBlock.objects.all()
+    slots = DoctorSlot.objects.all()
+    exceptions = ScheduleException.objects.filter(date__range=(start, end))
+    if doctor_ids is not None:
+        blocks = blocks.filter(doctor_id__in=doctor_ids)
+        slots = slots.filter(doctor_id__in=doctor_ids)
+        exceptions = exceptions.filter(Q(doctor_id__in=doctor_ids) | Q(doctor__isnull=True))
+
+    by_weekday = {}
+    for block in blocks.values_list('doctor_id', 'weekday', 'start_time', 'end_time', 'slot_minutes'):
+        doctor_id, rest = block[0], block[1:]
+        by_weekday.setdefault(rest[0], []).append((doctor_id, list(slot_starts(rest))))
+
+    clinic_wide, per_doctor = {}, {}
+    for exc in exceptions:
+        target = clinic_wide if exc.doctor_id is None else per_doctor.setdefault(exc.doctor_id, {})
+        target.setdefault(exc.date, []).append(exc)
+
+    wanted = {}
+    day = start
+    while day <= end:
+        for doctor_id, times in by_weekday.get(day.weekday(), ()):
+            own = per_doctor.get(doctor_id, {})
+            for slot_start, slot_end in times:
+                if is_blocked(clinic_wide, day, slot_start) or is_blocked(own, day, slot_start):
+                    continue
+                wanted[(doctor_id, day, slot_start)] = slot_end
+        day += datetime.timedelta(days=1)
+
+    with transaction.atomic():
+        deleted, _ = slots.filter(date__lt=start).delete()
+        stale = []
+        for pk, doctor_id, date, slot_start in slots.filter(date__range=(start, end)).values_list(
+            'pk', 'doctor_id', 'date', 'start_time'
+        ).iterator():
+            if wanted.pop((doctor_id, date, slot_start), None) is None:
+                stale.append(pk)
+        for i in range(0, len(stale), 500):
+            deleted += DoctorSlot.objects.filter(pk__in=stale[i:i + 500]).delete()[0]
+        DoctorSlot.objects.bulk_create(
+            [
+                DoctorSlot(doctor_id=doctor_id, date=date, start_time=slot_start, end_time=slot_end)
+                for (doctor_id, date, slot_start), slot_end in wanted.items()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+    return len(wanted), deleted
+
+
+def booked():
+    """``Exists`` expression, for ``DoctorSlot`` querysets, true when the slot is booked."""
+    from appointment.models import Appointment
+
+    return Exists(Appointment.objects.filter(
+        doctor=OuterRef('doctor'),
+        appointment_date=OuterRef('date'),
+        appointment_time=OuterRef('start_time'),
+    ).exclude(status='cancelled'))
+
+
+def free_slots_on(date, at=None):
+    """``DoctorSlot`` queryset of unbooked slots on ``date`` (optionally at a start time)."""
+    slots = DoctorSlot.objects.filter(date=date)
+    if at is not None:
+        slots = slots.filter(start_time=at)
+    return slots.exclude(booked())
+
+
+def rematerialize_exception(instance, **kwargs):
+    """Signal handler: rebuild slots of the doctors affected by a schedule exception."""
+    if instance.date < timezone.localdate():
+        return
+    doctor_ids = None if instance.doctor_id is None else [instance.doctor_id]
+    transaction.on_commit(lambda: materialize(doctor_ids=doctor_ids))
+
+
+def convert_after_migrate(**kwargs):
+    """post_migrate handler: convert unconverted profiles and fill the slot horizon.
+
+    Lets a fresh deploy offer every doctor's slots without running
+    ``convert_legacy_schedules`` and ``materialize_slots`` by hand.
+    """
+    convert_legacy()
+    materialize()
+
+
+def profile_created(instance, created=False, raw=False, **kwargs):
+    """Signal handler: give a new doctor blocks (and slots) from its JSON lists."""
+    if created and not raw:
+        sync_from_profile(instance)
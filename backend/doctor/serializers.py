@@ -1,14 +1,17 @@
 from rest_framework import serializers
 from django.db.models import Avg, Count
 from core.models import User
-from .models import DoctorProfile
+from .models import DoctorProfile, DOCTOR_IDS
 from .models import DoctorTip, DoctorReview
+from core.images import ImageVariantsField
+from core.lean import LeanSerializer
 
 class DoctorProfileSerializer(serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.name', read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
     user_phone = serializers.CharField(source='user.phone', read_only=True)
     profile_image = serializers.ImageField(required=False, allow_null=True, use_url=True)
+    image_variants = ImageVariantsField()
     avg_rating = serializers.SerializerMethodField(read_only=True)
     review_count = serializers.SerializerMethodField(read_only=True)
     
@@ -16,7 +19,7 @@ class DoctorProfileSerializer(serializers.ModelSerializer):
         model = DoctorProfile
         fields = (
             'id', 'doctor_id', 'user', 'user_name', 'user_email', 'user_phone',
-            'profile_image',
+            'profile_image', 'image_variants',
             'specialty', 'experience', 'qualification', 'license_number', 'bio',
             'available_days', 'available_time_slots', 'consultation_fee',
             'is_profile_complete', 'created_at', 'updated_at',
@@ -67,19 +70,39 @@ class DoctorProfileSerializer(serializers.ModelSerializer):
         except (ValueError, TypeError):
             raise serializers.ValidationError("Consultation fee must be a valid number")
 
+    @staticmethod
+    def annotate_queryset(queryset):
+        """Precompute review stats so listing doctors avoids two aggregates per row."""
+        return queryset.annotate(
+            annotated_avg_rating=Avg('reviews__rating'),
+            annotated_review_count=Count('reviews'),
+        )
+
     def get_avg_rating(self, obj):
-        # aggregate average rating from related reviews
-        agg = obj.reviews.aggregate(avg=Avg('rating'))
-        avg = agg.get('avg') or 0
+        if hasattr(obj, 'annotated_avg_rating'):
+            avg = obj.annotated_avg_rating or 0
+        else:
+            # aggregate average rating from related reviews
+            agg = obj.reviews.aggregate(avg=Avg('rating'))
+            avg = agg.get('avg') or 0
         try:
             return round(float(avg), 1)
         except Exception:
             return 0
 
     def get_review_count(self, obj):
+        if hasattr(obj, 'annotated_review_count'):
+            return obj.annotated_review_count or 0
         agg = obj.reviews.aggregate(cnt=Count('id'))
         return agg.get('cnt') or 0
 
+DOCTOR_PROFILE_LEAN = LeanSerializer(DoctorProfileSerializer, overrides={
+    # Lookups refer to DoctorProfileSerializer.annotate_queryset() annotations
+    'avg_rating': ('annotated_avg_rating', lambda avg: round(float(avg), 1) if avg else 0),
+    'review_count': ('annotated_review_count', lambda cnt: cnt or 0),
+})
+
+
 class DoctorCreateSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(write_only=True)
     name = serializers.CharField(write_only=True)
@@ -103,29 +126,16 @@ class DoctorCreateSerializer(serializers.ModelSerializer):
         # Create user
         user = User.objects.create_user(**user_data)
         
-        # Create doctor profile with default empty arrays for availability
+        # Create doctor profile with default empty arrays for availability and
+        # a unique doctor_id like DOC001, DOC002
         doctor_profile = DoctorProfile.objects.create(
             user=user,
+            doctor_id=DOCTOR_IDS.next_id(),
             available_days=[],
             available_time_slots=[],
             bio=''
         )
 
-        # Generate a unique doctor_id like DOC001, DOC002
-        last = DoctorProfile.objects.exclude(doctor_id__isnull=True).order_by('-id').first()
-        if last and last.doctor_id and last.doctor_id.startswith('DOC'):
-            try:
-                num = int(last.doctor_id.replace('DOC', '')) + 1
-            except Exception:
-                num = DoctorProfile.objects.count()
-        else:
-            num = DoctorProfile.objects.count()
-            num = num + 1
-
-        doctor_id = f"DOC{num:03d}"
-        doctor_profile.doctor_id = doctor_id
-        doctor_profile.save()
-        
         return doctor_profile
 
 
@@ -0,0 +1,17 @@
+from django.utils import timezone
+
+from .models import DoctorProfile
+
+
+def touch_doctor_profile(instance, update_fields=None, **kwargs):
+    """Bump ``DoctorProfile.updated_at`` when the doctor's user changes.
+
+    Doctor responses embed the user's name, email and phone; bumping the
+    profile keeps conditional GET validators (``core.conditional``) honest.
+    Login bookkeeping (``last_login`` only) is ignored.
+    """
+    if kwargs.get('created') or getattr(instance, 'role', None) != 'doctor':
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    DoctorProfile.objects.filter(user=instance).update(updated_at=timezone.now())
@@ -1,3 +1,171 @@
+import datetime
+
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from core.models import User
+from . import schedule
+from .models import DoctorProfile, DoctorSlot, ScheduleException, WeeklyScheduleBlock
+
+
+class ScheduleMaterializationTests(TestCase):
+    # A Monday, so weekday offsets are easy to read
+    start = datetime.date(2030, 1, 7)
+
+    def make_doctor(self, index, days, slots):
+        user = User.objects.create_user(email=f'doc{index}@example.com', password='pw', name=f'Doctor {index}', role='doctor')
+        return DoctorProfile.objects.create(user=user, available_days=days, available_time_slots=slots)
+
+    def slots(self, doctor):
+        return list(DoctorSlot.objects.filter(doctor=doctor).order_by('date', 'start_time').values_list('date', 'start_time'))
+
+    def test_legacy_json_converts_to_blocks(self):
+        blocks = schedule.blocks_from_legacy(['Monday', 'friday', 'noday'], ['9:00 AM - 9:30 AM', '14:00 - 15:00', 'junk'])
+        self.assertEqual(blocks, [
+            (0, datetime.time(9), datetime.time(9, 30), 30),
+            (0, datetime.time(14), datetime.time(15), 60),
+            (4, datetime.time(9), datetime.time(9, 30), 30),
+            (4, datetime.time(14), datetime.time(15), 60),
+        ])
+        # No days means every day, as with the JSON lists
+        self.assertEqual(len(schedule.blocks_from_legacy([], ['10:00 - 10:30'])), 7)
+
+    def test_materialize_skips_leave_and_holidays(self):
+        doctor = self.make_doctor(1, ['monday', 'tuesday'], ['9:00 AM - 9:30 AM', '10:00 AM - 10:30 AM'])
+        schedule.sync_from_profile(doctor, materialize_now=False)
+        ScheduleException.objects.create(doctor=doctor, date=self.start, start_time=datetime.time(10), end_time=datetime.time(11))
+        ScheduleException.objects.create(date=self.start + datetime.timedelta(days=1), kind='holiday')
+
+        schedule.materialize(start=self.start, weeks=1)
+        self.assertEqual(self.slots(doctor), [(self.start, datetime.time(9))])
+
+        # Removing the leave brings the slot back; re-running is idempotent
+        ScheduleException.objects.filter(doctor=doctor).delete()
+        schedule.materialize(start=self.start, weeks=1)
+        created, deleted = schedule.materialize(start=self.start, weeks=1)
+        self.assertEqual((created, deleted), (0, 0))
+        self.assertEqual(self.slots(doctor), [(self.start, datetime.time(9)), (self.start, datetime.time(10))])
+
+    def test_schedule_change_replaces_future_slots(self):
+        doctor = self.make_doctor(1, ['monday'], ['9:00 AM - 9:30 AM'])
+        schedule.sync_from_profile(doctor, materialize_now=False)
+        schedule.materialize(start=self.start, weeks=1)
+
+        doctor.available_time_slots = ['11:00 AM - 11:30 AM']
+        schedule.sync_from_profile(doctor, materialize_now=False)
+        schedule.materialize(start=self.start, weeks=1)
+        self.assertEqual(self.slots(doctor), [(self.start, datetime.time(11))])
+        self.assertEqual(WeeklyScheduleBlock.objects.filter(doctor=doctor).count(), 1)
+
+    def test_doctor_list_filters_by_free_slot(self):
+        from appointment.models import Appointment
+
+        busy = self.make_doctor(1, ['monday'], ['10:00 - 10:30'])
+        free = self.make_doctor(2, ['monday'], ['10:00 - 10:30'])
+        other = self.make_doctor(3, ['monday'], ['11:00 - 11:30'])
+        for doctor in (busy, free, other):
+            schedule.sync_from_profile(doctor, materialize_now=False)
+        schedule.materialize(start=self.start, weeks=1)
+
+        patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient')
+        Appointment.objects.create(
+            patient=patient, doctor=busy, appointment_date=self.start, appointment_time=datetime.time(10),
+            reason='Checkup', patient_name='Patient', patient_age=30, patient_gender='Male',
+            patient_phone='123', consultation_fee=500,
+        )
+
+        response = APIClient().get('/api/doctor/doctors/', {'available_on': self.start.isoformat(), 'at': '10:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['id'] for d in response.data['doctors']], [free.id])
+
+        response = APIClient().get('/api/doctor/doctors/', {'available_on': self.start.isoformat()})
+        self.assertEqual(sorted(d['id'] for d in response.data['doctors']), sorted([free.id, other.id]))
+
+
+class ScheduleAuthorityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='doc@example.com', password='pw', name='Doctor', role='doctor')
+        cls.doctor = DoctorProfile.objects.create(user=cls.user, available_days=['monday'], available_time_slots=['09:00 - 09:30'])
+        cls.patient = User.objects.create_user(email='patient@example.com', password='pw', name='Patient', role='customer')
+
+    def next_monday(self):
+        today = datetime.date.today()
+        return today + datetime.timedelta(days=7 - today.weekday())
+
+    def test_new_doctor_gets_blocks_and_slots(self):
+        self.assertEqual(
+            list(WeeklyScheduleBlock.objects.filter(doctor=self.doctor).values_list('weekday', 'start_time')),
+            [(0, datetime.time(9))],
+        )
+        self.assertTrue(DoctorSlot.objects.filter(doctor=self.doctor, date=self.next_monday(), start_time=datetime.time(9)).exists())
+
+    def test_blocks_are_only_rebuilt_when_the_lists_change(self):
+        block = WeeklyScheduleBlock.objects.get(doctor=self.doctor)
+        self.doctor.bio = 'Updated'
+        self.doctor.available_time_slots = ['10:00 - 10:30']
+        self.doctor.save()
+        self.assertTrue(WeeklyScheduleBlock.objects.filter(pk=block.pk).exists())
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.put('/api/doctor/doctor/profile/', {'bio': 'Again', 'available_days': '["monday"]'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(WeeklyScheduleBlock.objects.filter(pk=block.pk).exists())
+
+        response = client.put('/api/doctor/doctor/profile/', {'available_time_slots': '["11:00 - 11:30"]'}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(WeeklyScheduleBlock.objects.filter(doctor=self.doctor).values_list('start_time', flat=True)), [datetime.time(11)])
+        self.assertEqual(
+            set(DoctorSlot.objects.filter(doctor=self.doctor).values_list('start_time', flat=True)), {datetime.time(11)},
+        )
+
+    def test_holds_and_bookings_only_accept_materialized_slots(self):
+        monday = self.next_monday()
+        client = APIClient()
+        client.force_authenticate(self.patient)
+
+        def hold(day, time):
+            return client.post('/api/appointment/holds/', {
+                'doctor': self.doctor.pk, 'appointment_date': day.isoformat(), 'appointment_time': time,
+            }, format='json')
+
+        self.assertEqual(hold(monday, '10:00').status_code, 400)
+        self.assertEqual(hold(monday + datetime.timedelta(days=1), '09:00').status_code, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            ScheduleException.objects.create(doctor=self.doctor, date=monday)
+        self.assertEqual(hold(monday, '09:00').status_code, 400)
+        self.assertEqual(hold(monday + datetime.timedelta(days=7), '09:00').status_code, 201)
+
+        response = client.post('/api/appointment/appointments/create/', {
+            'doctor': self.doctor.pk, 'appointment_date': monday.isoformat(), 'appointment_time': '09:00',
+            'patient_name': 'Patient', 'patient_age': 30, 'patient_gender': 'female', 'patient_phone': '123',
+            'consultation_fee': '500.00', 'payment_method': 'cash_on_arrival', 'reason': 'Checkup',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_booking_falls_back_when_slots_are_not_materialized(self):
+        from appointment import booking
+
+        monday = self.next_monday()
+        far = monday + datetime.timedelta(weeks=schedule.horizon_weeks() + 1)
+        nine, ten = datetime.time(9), datetime.time(10)
+        DoctorSlot.objects.filter(doctor=self.doctor).delete()
+
+        # Weekly blocks answer for dates without slot rows, including beyond the horizon
+        self.assertTrue(booking.is_offered(self.doctor, monday, nine))
+        self.assertTrue(booking.is_offered(self.doctor, far, nine))
+        self.assertFalse(booking.is_offered(self.doctor, monday, ten))
+        self.assertFalse(booking.is_offered(self.doctor, monday + datetime.timedelta(days=1), nine))
+        ScheduleException.objects.create(doctor=self.doctor, date=far)
+        self.assertFalse(booking.is_offered(self.doctor, far, nine))
+
+        # A doctor not converted yet is checked against the legacy lists
+        WeeklyScheduleBlock.objects.filter(doctor=self.doctor).delete()
+        self.assertTrue(booking.is_offered(self.doctor, monday, nine))
+        self.assertFalse(booking.is_offered(self.doctor, monday, ten))
 
-# Create your tests here.
+        # ...and is converted and materialized by the post-migrate hook
+        schedule.convert_after_migrate()
+        self.assertTrue(WeeklyScheduleBlock.objects.filter(doctor=self.doctor).exists())
+        self.assertTrue(DoctorSlot.objects.filter(doctor=self.doctor, date=monday, start_time=nine).exists())
@@ -4,18 +4,25 @@ from rest_framework.views import APIView
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+import datetime
 import logging
 import json
 
 from core.models import User
-from .models import DoctorProfile
-from .serializers import DoctorProfileSerializer, DoctorCreateSerializer
+from .models import DoctorProfile, DoctorSlot, DOCTOR_IDS
+from .serializers import DoctorProfileSerializer, DoctorCreateSerializer, DOCTOR_PROFILE_LEAN
+from core.lean import lean_requested
+from core import conditional, outbox
+from appointment.models import Appointment
 from .models import DoctorTip
 from .serializers_tips import DoctorTipSerializer, DoctorTipCreateSerializer
 from .models import DoctorReview
 from .serializers import DoctorReviewSerializer, DoctorReviewCreateSerializer
+from appointment.availability import parse_time_str
+from . import schedule
 
 logger = logging.getLogger(__name__)
 
@@ -25,13 +32,41 @@ class DoctorListView(APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
-        doctors = DoctorProfile.objects.select_related('user').all()
-        serializer = DoctorProfileSerializer(doctors, many=True, context={'request': request})
+        doctors = DoctorProfileSerializer.annotate_queryset(DoctorProfile.objects.select_related('user'))
 
-        return Response({
+        # ?available_on=YYYY-MM-DD[&at=HH:MM] keeps doctors with a free slot then
+        available_on = request.query_params.get('available_on')
+        if available_on:
+            try:
+                day = datetime.date.fromisoformat(available_on)
+            except ValueError:
+                return Response({'success': False, 'message': 'Invalid date format. Use YYYY-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+            at = request.query_params.get('at')
+            at_time = parse_time_str(at) if at else None
+            if at and at_time is None:
+                return Response({'success': False, 'message': 'Invalid time format.'}, status=status.HTTP_400_BAD_REQUEST)
+            free = schedule.free_slots_on(day, at_time).filter(doctor=OuterRef('pk'))
+            doctors = doctors.filter(Exists(free))
+            # Bookings and slot rebuilds change who is free without touching profiles
+            versions = [Appointment.objects.filter(appointment_date=day), (DoctorSlot.objects.filter(date=day), 'id')]
+        else:
+            versions = []
+
+        validators, not_modified = conditional.check(
+            request, DoctorProfile.objects.all(), DoctorReview.objects.all(), *versions,
+        )
+        if not_modified:
+            return not_modified
+
+        if lean_requested(request):
+            data = DOCTOR_PROFILE_LEAN.serialize(doctors, context={'request': request})
+        else:
+            data = DoctorProfileSerializer(doctors, many=True, context={'request': request}).data
+
+        return conditional.finalize(Response({
             'success': True,
-            'doctors': serializer.data
-        })
+            'doctors': data
+        }), validators)
 
 class DoctorCreateView(APIView):
     permission_classes = [IsAuthenticated]
@@ -45,13 +80,13 @@ class DoctorCreateView(APIView):
         
         serializer = DoctorCreateSerializer(data=request.data)
         if serializer.is_valid():
-            doctor_profile = serializer.save()
-            
-            # Send email to doctor with credentials. Use a safe default for FRONTEND_URL
-            email_sent = False
             frontend_url = getattr(settings, 'FRONTEND_URL', 'http://localhost:3000')
-            subject = 'Welcome to Arogya - Doctor Account Created'
-            message = f"""
+            with transaction.atomic():
+                doctor_profile = serializer.save()
+
+                # Queue the credentials email; `manage.py send_outbox` delivers it
+                subject = 'Welcome to Arogya - Doctor Account Created'
+                message = f"""
 Welcome to Arogya!
 
 Your doctor account has been created with the following details:
@@ -66,25 +101,15 @@ Login at: {frontend_url}
 Best regards,
 Arogya Admin Team
 """
+                outbox.enqueue(subject, message, [doctor_profile.user.email], sensitive=True)
 
-            try:
-                send_mail(
-                    subject,
-                    message,
-                    settings.DEFAULT_FROM_EMAIL,
-                    [doctor_profile.user.email],
-                    fail_silently=False,
-                )
-                email_sent = True
-            except Exception:
-                # Log the exception; don't fail the doctor creation
-                logger.exception("Failed to send doctor creation email to %s", doctor_profile.user.email)
-            
             return Response({
                 'success': True,
                 'message': 'Doctor added successfully',
                 'doctor': DoctorProfileSerializer(doctor_profile, context={'request': request}).data,
-                'email_sent': email_sent,
+                # email_sent is kept for existing clients; the mail is queued, not yet delivered
+                'email_sent': True,
+                'email_queued': True,
             }, status=status.HTTP_201_CREATED)
         
         return Response({
@@ -114,20 +139,9 @@ class DoctorProfileView(APIView):
             })
         except DoctorProfile.DoesNotExist:
             try:
-                last = DoctorProfile.objects.exclude(doctor_id__isnull=True).order_by('-id').first()
-                if last and last.doctor_id and last.doctor_id.startswith('DOC'):
-                    try:
-                        num = int(last.doctor_id.replace('DOC', '')) + 1
-                    except Exception:
-                        num = DoctorProfile.objects.count() + 1
-                else:
-                    num = DoctorProfile.objects.count() + 1
-
-                doctor_id = f"DOC{num:03d}"
-
                 doctor_profile = DoctorProfile.objects.create(
                     user=request.user,
-                    doctor_id=doctor_id,
+                    doctor_id=DOCTOR_IDS.next_id(),
                     available_days=[],
                     available_time_slots=[],
                     bio=''
@@ -163,7 +177,15 @@ class DoctorProfileView(APIView):
             )
             
             if serializer.is_valid():
-                updated_profile = serializer.save()
+                # Weekly blocks are only rebuilt when the doctor edits the schedule lists
+                schedule_changed = any(
+                    field in serializer.validated_data and serializer.validated_data[field] != getattr(doctor_profile, field)
+                    for field in ('available_days', 'available_time_slots')
+                )
+                with transaction.atomic():
+                    updated_profile = serializer.save()
+                    if schedule_changed:
+                        schedule.sync_from_profile(updated_profile)
                 
                 # Update profile completion status
                 required_fields = ['specialty', 'experience', 'qualification', 'bio']
@@ -228,8 +250,14 @@ class DoctorTipsListCreateView(APIView):
         else:
             tips = DoctorTip.objects.filter(is_published=True).select_related('doctor__user')
 
+        validators, not_modified = conditional.check(
+            request, DoctorTip.objects.all(), DoctorProfile.objects.filter(pk__in=tips.values('doctor')),
+        )
+        if not_modified:
+            return not_modified
+
         serializer = DoctorTipSerializer(tips, many=True)
-        return Response({'success': True, 'tips': serializer.data})
+        return conditional.finalize(Response({'success': True, 'tips': serializer.data}), validators)
 
     def post(self, request):
         # Only authenticated doctors may create tips
@@ -331,7 +359,7 @@ class DoctorReviewsView(APIView):
         if not doctor:
             return Response({'success': False, 'message': 'Doctor not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        reviews = DoctorReview.objects.filter(doctor=doctor)
+        reviews = DoctorReview.objects.filter(doctor=doctor).select_related('user')
         serializer = DoctorReviewSerializer(reviews, many=True)
         return Response({'success': True, 'reviews': serializer.data})
 
@@ -398,16 +426,14 @@ class PharmacistCreateView(APIView):
         if User.objects.filter(email=email).exists():
             return Response({'success': False, 'message': 'User with this email already exists'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            user = User.objects.create_user(email=email, password=password, name=name, phone=phone, role='pharmacist')
-        except Exception as e:
-            return Response({'success': False, 'message': f'Failed to create user: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # Send welcome email with credentials
-        email_sent = False
         frontend_url = getattr(settings, 'FRONTEND_URL', 'http://localhost:3000')
         subject = 'Welcome to Arogya - Pharmacist Account Created'
-        message = f"""
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(email=email, password=password, name=name, phone=phone, role='pharmacist')
+
+                # Queue the credentials email; `manage.py send_outbox` delivers it
+                message = f"""
 Welcome to Arogya!
 
 Your pharmacist account has been created with the following details:
@@ -420,11 +446,9 @@ Login at: {frontend_url}
 Best regards,
 Arogya Admin Team
 """
+                outbox.enqueue(subject, message, [user.email], sensitive=True)
+        except Exception as e:
+            return Response({'success': False, 'message': f'Failed to create user: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        try:
-            send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email], fail_silently=False)
-            email_sent = True
-        except Exception:
-            logger.exception("Failed to send pharmacist creation email to %s", user.email)
-
-        return Response({'success': True, 'message': 'pharmacist added successfully', 'pharmacist': {'id': user.id, 'email': user.email, 'name': user.name}, 'email_sent': email_sent}, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        # email_sent is kept for existing clients; the mail is queued, not yet delivered
+        return Response({'success': True, 'message': 'pharmacist added successfully', 'pharmacist': {'id': user.id, 'email': user.email, 'name': user.name}, 'email_sent': True, 'email_queued': True}, status=status.HTTP_201_CREATED)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import MedicineCategory, Medicine, Sale, SaleItem
+from .models import MedicineCategory, Medicine, Sale, SaleItem, StockMovement
 
 
 @admin.register(MedicineCategory)
@@ -10,10 +10,11 @@ class MedicineCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Medicine)
 class MedicineAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'brand', 'category', 'price', 'stock_count', 'created_at')
+    list_display = ('id', 'name', 'brand', 'category', 'price', 'stock_count', 'reorder_level', 'created_at')
     list_filter = ('category', 'brand')
     search_fields = ('name', 'brand')
-    readonly_fields = ('created_at', 'updated_at')
+    # Stock changes go through the ledger (StockMovement), not direct edits
+    readonly_fields = ('stock_count', 'created_at', 'updated_at')
 
 
 class SaleItemInline(admin.TabularInline):
@@ -26,3 +27,13 @@ class SaleAdmin(admin.ModelAdmin):
     list_display = ('id', 'customer_name', 'payment_method', 'total', 'created_by', 'created_at')
     inlines = [SaleItemInline]
     readonly_fields = ('created_at',)
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    list_display = ('id', 'medicine_name', 'kind', 'quantity', 'balance_after', 'sale', 'created_by', 'created_at')
+    list_filter = ('kind',)
+    raw_id_fields = ('medicine', 'sale')
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class PharmacyConfig(AppConfig):
+    # No default_auto_field: pharmacy tables were created with AutoField keys
+    name = 'pharmacy'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from . import autocomplete
+        from .models import Medicine
+
+        post_save.connect(autocomplete.medicine_saved, sender=Medicine, dispatch_uid='autocomplete-medicine-saved')
+        post_delete.connect(autocomplete.medicine_deleted, sender=Medicine, dispatch_uid='autocomplete-medicine-deleted')
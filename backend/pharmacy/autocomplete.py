@@ -0,0 +1,135 @@
+"""Per-process medicine name autocomplete.
+
+Every medicine is indexed under each word start of its name and brand
+("Paracetamol Forte" under "paracetamol forte" and "forte") in sorted
+lists searched with ``bisect``. A lookup never touches the database.
+
+The index is loaded on first use and kept current in this process by the
+``Medicine`` post_save/post_delete handlers below, once the write
+commits. Writes made by other
+worker processes, or that bypass signals (``QuerySet.update``,
+``bulk_create``), are picked up by a full reload once the index is older
+than ``MEDICINE_AUTOCOMPLETE_MAX_AGE`` seconds.
+"""
+import bisect
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Medicine
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+# key rank: matches on the start of the name sort before other word starts
+NAME_START, OTHER_WORD = 0, 1
+
+
+def normalize(text):
+    return ' '.join(_NON_ALNUM.sub(' ', (text or '').lower()).split())
+
+
+def _keys(name, brand):
+    keys = []
+    for rank_base, text in ((NAME_START, normalize(name)), (OTHER_WORD, normalize(brand))):
+        words = text.split(' ') if text else []
+        for i in range(len(words)):
+            keys.append((' '.join(words[i:]), NAME_START if rank_base == NAME_START and i == 0 else OTHER_WORD))
+    return keys
+
+
+def max_age():
+    return float(getattr(settings, 'MEDICINE_AUTOCOMPLETE_MAX_AGE', 300))
+
+
+class MedicineIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # rank -> sorted (key, medicine_id); name starts are searched first
+        self._entries = {NAME_START: [], OTHER_WORD: []}
+        self._by_id = {}  # medicine_id -> (row, [(key, rank), ...])
+        self._loaded_at = None
+
+    def load(self):
+        rows = Medicine.objects.values('id', 'name', 'brand', 'weight_or_volume')
+        by_id, entries = {}, {NAME_START: [], OTHER_WORD: []}
+        for row in rows:
+            keys = _keys(row['name'], row['brand'])
+            by_id[row['id']] = (row, keys)
+            for key, rank in keys:
+                entries[rank].append((key, row['id']))
+        for ranked in entries.values():
+            ranked.sort()
+        with self._lock:
+            self._entries, self._by_id = entries, by_id
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > max_age():
+            self.load()
+
+    def _remove(self, medicine_id):
+        _, keys = self._by_id.pop(medicine_id, (None, []))
+        for key, rank in keys:
+            ranked = self._entries[rank]
+            i = bisect.bisect_left(ranked, (key, medicine_id))
+            if i < len(ranked) and ranked[i] == (key, medicine_id):
+                del ranked[i]
+
+    def upsert(self, row):
+        """Index (or re-index) one medicine given as a dict with id, name, brand and weight_or_volume."""
+        if self._loaded_at is None:
+            return
+        keys = _keys(row['name'], row['brand'])
+        with self._lock:
+            self._remove(row['id'])
+            for key, rank in keys:
+                bisect.insort(self._entries[rank], (key, row['id']))
+            self._by_id[row['id']] = (row, keys)
+
+    def discard(self, medicine_id):
+        if self._loaded_at is None:
+            return
+        with self._lock:
+            self._remove(medicine_id)
+
+    def suggest(self, prefix, limit=10):
+        """Return up to ``limit`` medicine rows with a name or brand word starting with ``prefix``.
+
+        Medicines whose name starts with ``prefix`` come first, then those
+        matching on a later word or the brand; each group in key order.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self._ensure_loaded()
+        found = {}
+        with self._lock:
+            for rank in (NAME_START, OTHER_WORD):
+                ranked = self._entries[rank]
+                i = bisect.bisect_left(ranked, (prefix,))
+                while i < len(ranked) and len(found) < limit and ranked[i][0].startswith(prefix):
+                    medicine_id = ranked[i][1]
+                    found.setdefault(medicine_id, self._by_id[medicine_id][0])
+                    i += 1
+        return list(found.values())
+
+
+index = MedicineIndex()
+
+
+def medicine_saved(sender, instance, **kwargs):
+    row = {
+        'id': instance.pk,
+        'name': instance.name,
+        'brand': instance.brand,
+        'weight_or_volume': instance.weight_or_volume,
+    }
+    transaction.on_commit(lambda: index.upsert(row))
+
+
+def medicine_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: index.discard(pk))
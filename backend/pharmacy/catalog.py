@@ -0,0 +1,301 @@
+"""Bulk import and export of the medicine catalog as CSV or JSONL.
+
+An import streams the uploaded file row by row and upserts medicines by
+``(name, brand)`` in batches of ``BATCH_SIZE``: one locking read of the
+batch's existing rows, a ``bulk_create`` for new medicines and a
+``bulk_update`` for changed ones. Categories are resolved by name through
+an in-memory map and created as needed. Stock given in the file goes
+through the ledger (a receipt for new medicines, an adjustment otherwise).
+
+Rows that fail validation are skipped and reported with their line number;
+every batch commits on its own, so a file that turns out to be unreadable
+half way keeps the rows before it and reports the rest as not read
+(``ImportResult.complete``).
+
+An export is a generator of text chunks over ``iterator()``, for a
+``StreamingHttpResponse``; memory stays flat whatever the catalog size.
+"""
+import codecs
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import autocomplete, stock
+from .models import Medicine, MedicineCategory
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = (
+    'name', 'brand', 'category', 'weight_or_volume', 'price', 'discount',
+    'stock_count', 'reorder_level', 'description',
+)
+BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 2000
+# Error details returned for at most this many rows; error_count has the total
+MAX_REPORTED_ERRORS = 200
+
+_LENGTHS = {'name': 255, 'brand': 255, 'category': 200, 'weight_or_volume': 100}
+
+
+class InvalidFile(ValueError):
+    pass
+
+
+class RowError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(errors)
+
+
+def detect_format(filename, requested=None):
+    fmt = (requested or '').lower() or filename.rsplit('.', 1)[-1].lower()
+    if fmt == 'ndjson':
+        fmt = 'jsonl'
+    if fmt not in FORMATS:
+        raise InvalidFile(f"type must be one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+def read_rows(upload, fmt):
+    """Yield ``(line number, row)`` from an uploaded file without reading it whole.
+
+    A JSONL line that is not valid JSON is yielded as ``None`` so it is
+    reported like any other bad row.
+    """
+    lines = codecs.iterdecode(upload, 'utf-8-sig')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        if 'name' not in (reader.fieldnames or ()):
+            raise InvalidFile('CSV header must include a name column')
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def clean(raw):
+    """Validate one row; return the given values keyed by column.
+
+    Empty cells are left out, so an import only changes the columns the
+    file fills in. Raises ``RowError`` with a message per bad column.
+    """
+    if not isinstance(raw, dict):
+        raise RowError({'row': 'Expected a JSON object'})
+    values, errors = {}, {}
+    for column in COLUMNS:
+        value = _text(raw.get(column))
+        if value == '':
+            continue
+        if column in ('price', 'discount'):
+            try:
+                value = Decimal(value)
+                # NaN and Infinity parse (and NaN quantizes) but fail the range check below
+                if not value.is_finite():
+                    raise InvalidOperation
+                value = value.quantize(Decimal('0.01'))
+            except InvalidOperation:
+                errors[column] = 'Must be a number'
+                continue
+            limit = 100 if column == 'discount' else Decimal('99999999.99')
+            if not 0 <= value <= limit:
+                errors[column] = f'Must be between 0 and {limit}'
+                continue
+        elif column in ('stock_count', 'reorder_level'):
+            try:
+                value = int(value)
+            except ValueError:
+                errors[column] = 'Must be a whole number'
+                continue
+            if value < 0:
+                errors[column] = 'Cannot be negative'
+                continue
+        elif column in _LENGTHS and len(value) > _LENGTHS[column]:
+            errors[column] = f'At most {_LENGTHS[column]} characters'
+            continue
+        values[column] = value
+    if 'name' not in values and 'name' not in errors:
+        errors['name'] = 'This field is required'
+    if errors:
+        raise RowError(errors)
+    return values
+
+
+class CategoryMap:
+    """Category ids by case-insensitive name, loaded once per import."""
+
+    def __init__(self):
+        self._ids = {}
+        self._slugs = set()
+        for pk, name, slug in MedicineCategory.objects.values_list('id', 'name', 'slug'):
+            self._ids[name.casefold()] = pk
+            self._slugs.add(slug)
+
+    def _slug(self, name):
+        base = slugify(name)[:200] or 'category'
+        slug, n = base, 1
+        while slug in self._slugs:
+            n += 1
+            slug = f'{base}-{n}'
+        self._slugs.add(slug)
+        return slug
+
+    def resolve(self, names):
+        """Return ``{name: id}`` for ``names``, creating the missing categories."""
+        missing = {}
+        for name in names:
+            if name.casefold() not in self._ids:
+                missing.setdefault(name.casefold(), name)
+        if missing:
+            MedicineCategory.objects.bulk_create(
+                [MedicineCategory(name=name, slug=self._slug(name)) for name in missing.values()],
+                ignore_conflicts=True,
+            )
+            # Re-read rather than trust returned pks: another import may have created some
+            created = MedicineCategory.objects.filter(name__in=missing.values()).values_list('id', 'name')
+            for pk, name in created:
+                self._ids[name.casefold()] = pk
+        return {name: self._ids.get(name.casefold()) for name in names}
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = self.updated = self.unchanged = self.error_count = 0
+        self.errors = []
+        self.complete = True
+
+    def error(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created, 'updated': self.updated, 'unchanged': self.unchanged,
+            'error_count': self.error_count, 'errors': self.errors, 'complete': self.complete,
+        }
+
+
+def _write_batch(batch, categories, result, created_by):
+    """Upsert one batch of ``{(name, brand): values}``."""
+    category_ids = categories.resolve({values['category'] for values in batch.values() if 'category' in values})
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {}
+        rows = Medicine.objects.select_for_update().filter(name__in={name for name, _ in batch}).order_by('id')
+        for medicine in rows:
+            existing.setdefault((medicine.name, medicine.brand or ''), medicine)
+
+        new, changed, fields, adjustments = [], [], set(), {}
+        for key, values in batch.items():
+            count = values.pop('stock_count', None)
+            if 'category' in values:
+                values['category_id'] = category_ids[values.pop('category')]
+            medicine = existing.get(key)
+            if medicine is None:
+                values.setdefault('brand', None)
+                new.append(Medicine(**values, stock_count=count or 0))
+                continue
+
+            dirty = {field for field, value in values.items() if getattr(medicine, field) != value}
+            for field in dirty:
+                setattr(medicine, field, values[field])
+            if dirty:
+                medicine.updated_at = now
+                changed.append(medicine)
+                fields |= dirty
+            if count is not None and count != medicine.stock_count:
+                adjustments[medicine.pk] = count - medicine.stock_count
+            if dirty or medicine.pk in adjustments:
+                result.updated += 1
+            else:
+                result.unchanged += 1
+
+        Medicine.objects.bulk_create(new)
+        if changed:
+            Medicine.objects.bulk_update(changed, fields | {'updated_at'})
+        stock.record_opening(new, created_by=created_by, note='Catalog import')
+        stock.apply(adjustments, 'adjustment', created_by=created_by, note='Catalog import')
+        result.created += len(new)
+
+        # bulk writes send no signals, so keep this process's autocomplete index current here
+        indexed = [
+            {'id': m.pk, 'name': m.name, 'brand': m.brand, 'weight_or_volume': m.weight_or_volume}
+            for m in new + changed
+        ]
+        transaction.on_commit(lambda: [autocomplete.index.upsert(row) for row in indexed])
+
+
+def import_rows(rows, created_by=None, batch_size=BATCH_SIZE):
+    """Upsert medicines from ``(line number, row)`` pairs; returns an ``ImportResult``.
+
+    A medicine appearing more than once within a batch is merged, later
+    rows winning. If the file stops decoding after some rows were read,
+    those rows are still written and the result is marked incomplete; a
+    file that fails before its first row raises ``UnicodeDecodeError``.
+    """
+    result = ImportResult()
+    categories = CategoryMap()
+    batch = {}
+    line = 0
+    try:
+        for line, raw in rows:
+            try:
+                values = clean(raw)
+            except RowError as e:
+                result.error(line, e.errors)
+                continue
+            key = (values['name'], values.get('brand', ''))
+            batch.setdefault(key, {}).update(values)
+            if len(batch) >= batch_size:
+                _write_batch(batch, categories, result, created_by)
+                batch = {}
+    except UnicodeDecodeError:
+        if not line:
+            raise
+        result.complete = False
+        result.error(line + 1, {'file': 'Not valid UTF-8; the rest of the file was not read'})
+    if batch:
+        _write_batch(batch, categories, result, created_by)
+    return result
+
+
+def export_rows(fmt, qs=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the catalog as CSV or JSONL text, ``chunk_size`` medicines per chunk."""
+    qs = Medicine.objects.all() if qs is None else qs
+    rows = qs.order_by('id').values_list(
+        'name', 'brand', 'category__name', 'weight_or_volume', 'price', 'discount',
+        'stock_count', 'reorder_level', 'description',
+    ).iterator(chunk_size=chunk_size)
+
+    out = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS)
+        write = writer.writerow
+    else:
+        def write(row):
+            out.write(json.dumps(dict(zip(COLUMNS, row)), default=str))
+            out.write('\n')
+
+    for n, row in enumerate(rows, 1):
+        write(row)
+        if n % chunk_size == 0:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    if out.tell():
+        yield out.getvalue()
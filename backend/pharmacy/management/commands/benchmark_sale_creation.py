@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.models import User
+from pharmacy.models import Medicine
+from pharmacy.serializers import SaleSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Show that sale creation runs a constant number of queries as the basket grows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 30, 100])
+        parser.add_argument('--repeat', type=int, default=20, help='Sales timed per basket size')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    email='bench-pharmacist@example.com', password=None, name='Bench Pharmacist', role='pharmacist'
+                )
+                products = Medicine.objects.bulk_create([
+                    Medicine(name=f'Bench medicine {i}', price='12.50', discount='5.00', stock_count=10 ** 6)
+                    for i in range(max(options['sizes']))
+                ])
+                for size in options['sizes']:
+                    self._run(user, products[:size], options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, user, products, repeat):
+        payload = {
+            'customer_name': 'Bench',
+            'payment_method': 'cash',
+            'items': [{'product_id': p.pk, 'qty': 2} for p in products],
+        }
+        request = type('Request', (), {'user': user})()
+
+        started = time.perf_counter()
+        for i in range(repeat):
+            serializer = SaleSerializer(data=payload, context={'request': request})
+            serializer.is_valid(raise_exception=True)
+            if i == 0:
+                with CaptureQueriesContext(connection) as ctx:
+                    serializer.save()
+            else:
+                serializer.save()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'{len(products)} items: {len(ctx.captured_queries)} queries per sale, '
+            f'{elapsed / repeat * 1000:.1f} ms per sale'
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacy import search
+
+
+class Command(BaseCommand):
+    help = 'Create or refresh the text index behind the medicine search (pg_trgm on PostgreSQL, FTS5 on SQLite).'
+
+    def handle(self, *args, **options):
+        try:
+            vendor = search.build_index()
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Medicine search index ready ({vendor})'))
@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from pharmacy import reports
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily sales aggregates behind the pharmacy reports from existing sales.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First sale date to rebuild (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='end', help='Last sale date to rebuild (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.date.fromisoformat(options['start']) if options['start'] else None
+            end = datetime.date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError:
+            raise CommandError('Dates must be in YYYY-MM-DD format')
+
+        days, products = reports.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {days} daily rows and {products} product rows'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from pharmacy import stock
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare Medicine.stock_count with the StockMovement ledger and report drift; '
+        'with --fix, reset drifted columns to the ledger total.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Set drifted stock columns to the ledger total')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        drift = stock.reconcile(fix=options['fix'], batch_size=options['batch_size'])
+        for pk, count, total in drift:
+            self.stdout.write(f'Medicine {pk}: stock {count}, ledger {total}')
+        verb = 'Corrected' if options['fix'] else 'Found'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(drift)} medicines with drift'))
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class MedicineCategory(models.Model):
@@ -19,12 +20,31 @@ class Medicine(models.Model):
     # Price of the medicine (in your currency) and optional discount percentage
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     discount = models.DecimalField(max_digits=5, decimal_places=2, default=0.00, help_text='Discount percentage, e.g. 10.00 for 10%')
+    # Materialized from the StockMovement ledger; change it through pharmacy.stock
     stock_count = models.IntegerField(default=0)
+    # Listed on the low-stock watch list once stock falls to this level
+    reorder_level = models.IntegerField(default=10)
     image = models.ImageField(upload_to='medicine_images/', blank=True, null=True)
+    # Resized copies of ``image`` written by the background pipeline (core.images)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Keyset orderings and the category filter of the catalog search
+        indexes = [
+            models.Index(fields=['name', 'id'], name='medicine_name_idx'),
+            models.Index(fields=['price', 'id'], name='medicine_price_idx'),
+            models.Index(fields=['created_at', 'id'], name='medicine_created_idx'),
+            models.Index(fields=['category', 'name', 'id'], name='medicine_category_name_idx'),
+            # Low-stock watch list; only the few rows at or under their reorder level are indexed
+            models.Index(
+                fields=['stock_count', 'id'], name='medicine_low_stock_idx',
+                condition=models.Q(stock_count__lte=models.F('reorder_level')),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.brand})" if self.brand else self.name
 
@@ -39,8 +59,17 @@ class Sale(models.Model):
     tax = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    # Set when the sale was made by dispensing a prescription
+    prescription = models.OneToOneField(
+        'appointment.Prescription', on_delete=models.SET_NULL, null=True, blank=True, related_name='sale'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='sale_history_idx'),
+        ]
+
     def __str__(self):
         return f"Sale #{self.id} - {self.customer_name} - {self.total}"
 
@@ -54,3 +83,81 @@ class SaleItem(models.Model):
 
     def __str__(self):
         return f"{self.product} x{self.qty} @ {self.price}"
+
+
+class StockMovement(models.Model):
+    """Append-only ledger entry for a change in a medicine's stock.
+
+    ``quantity`` is signed (receipts and returns add, sales and dispenses
+    take away, adjustments go either way) and ``balance_after`` is the
+    medicine's stock once the movement was applied, so the stock at any
+    moment is the balance of the last movement before it. Deleting a
+    medicine keeps its movements: ``medicine`` is cleared and
+    ``medicine_name`` still says what was moved.
+    """
+    KIND_CHOICES = (
+        ('receipt', 'Receipt'),
+        ('sale', 'Sale'),
+        ('return', 'Return'),
+        ('adjustment', 'Adjustment'),
+        ('dispense', 'Dispense'),
+    )
+
+    medicine = models.ForeignKey(Medicine, on_delete=models.SET_NULL, null=True, related_name='movements')
+    medicine_name = models.CharField(max_length=255, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()
+    balance_after = models.IntegerField()
+    sale = models.ForeignKey(Sale, on_delete=models.SET_NULL, null=True, blank=True, related_name='movements')
+    note = models.CharField(max_length=255, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['medicine', 'created_at', 'id'], name='stock_movement_history_idx'),
+            models.Index(fields=['kind', 'created_at'], name='stock_movement_kind_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} {self.medicine_id} -> {self.balance_after}"
+
+
+class DailySalesStats(models.Model):
+    """Per-day sales totals, maintained by ``pharmacy.reports`` as sales are written."""
+    date = models.DateField(unique=True)
+    sales_count = models.IntegerField(default=0)
+    items_sold = models.IntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    tax = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.date}: {self.sales_count} sales, {self.total}"
+
+
+class DailyProductSales(models.Model):
+    """Per-day, per-medicine quantity and pre-tax revenue.
+
+    ``category`` is the medicine's category when its first sale of the day
+    was recorded, so category reports do not change when a medicine moves.
+    """
+    date = models.DateField()
+    medicine = models.ForeignKey(Medicine, on_delete=models.SET_NULL, null=True, blank=True, related_name='daily_sales')
+    category = models.ForeignKey(MedicineCategory, on_delete=models.SET_NULL, null=True, blank=True, related_name='daily_sales')
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'medicine'], name='unique_daily_product_sales'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'category'], name='daily_product_sales_cat_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date}: {self.medicine_id} x{self.quantity}"
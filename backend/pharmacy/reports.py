@@ -0,0 +1,165 @@
+"""Incremental sales aggregates behind the pharmacy reports.
+
+Each sale adds to one ``DailySalesStats`` row and one ``DailyProductSales``
+row per medicine for its day, inside the transaction that writes the sale.
+Both use the same two statements whatever the basket size: an insert of
+zero rows that ignores conflicts (so concurrent first sales of a day do not
+collide) followed by a single ``F()`` increment.
+
+Reports then read days x products rows instead of every ``SaleItem``.
+``manage.py rebuild_sales_reports`` recomputes the aggregates, e.g. after
+sales were deleted in the admin.
+"""
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .models import DailyProductSales, DailySalesStats, Sale, SaleItem
+
+ZERO = Decimal('0.00')
+
+
+def record_sale(sale, products):
+    """Add ``sale`` to its day's aggregates.
+
+    ``products`` maps medicine id to ``(quantity, revenue, category_id)``.
+    """
+    day = timezone.localdate(sale.created_at)
+
+    DailySalesStats.objects.bulk_create([DailySalesStats(date=day)], ignore_conflicts=True)
+    DailySalesStats.objects.filter(date=day).update(
+        sales_count=F('sales_count') + 1,
+        items_sold=F('items_sold') + sum(qty for qty, _, _ in products.values()),
+        subtotal=F('subtotal') + sale.subtotal,
+        tax=F('tax') + sale.tax,
+        total=F('total') + sale.total,
+    )
+
+    if not products:
+        return
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(date=day, medicine_id=pk, category_id=category_id)
+        for pk, (_, _, category_id) in products.items()
+    ], ignore_conflicts=True)
+    DailyProductSales.objects.filter(date=day, medicine_id__in=products).update(
+        quantity=Case(*(When(medicine_id=pk, then=F('quantity') + qty) for pk, (qty, _, _) in products.items())),
+        revenue=Case(*(When(medicine_id=pk, then=F('revenue') + revenue) for pk, (_, revenue, _) in products.items())),
+    )
+
+
+def _day_bounds(start, end):
+    tz = timezone.get_current_timezone()
+    lower = datetime.datetime.combine(start, datetime.time.min, tzinfo=tz) if start else None
+    upper = datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min, tzinfo=tz) if end else None
+    return lower, upper
+
+
+def parse_range(params):
+    """Read ``from`` / ``to`` dates from query params. Raises ``ValueError``."""
+    start, end = params.get('from'), params.get('to')
+    return (
+        datetime.date.fromisoformat(start) if start else None,
+        datetime.date.fromisoformat(end) if end else None,
+    )
+
+
+def sales_between(start, end):
+    """``Sale`` rows made on local dates ``start`` to ``end`` (either may be None)."""
+    lower, upper = _day_bounds(start, end)
+    qs = Sale.objects.all()
+    if lower:
+        qs = qs.filter(created_at__gte=lower)
+    if upper:
+        qs = qs.filter(created_at__lt=upper)
+    return qs
+
+
+def _dates(qs, start, end):
+    if start:
+        qs = qs.filter(date__gte=start)
+    if end:
+        qs = qs.filter(date__lte=end)
+    return qs
+
+
+def _money(row, *fields):
+    for field in fields:
+        # SQLite returns SUM() of decimals without their scale
+        row[field] = str(Decimal(row[field] or 0).quantize(ZERO))
+    return row
+
+
+def daily(start=None, end=None):
+    rows = _dates(DailySalesStats.objects.all(), start, end).values(
+        'date', 'sales_count', 'items_sold', 'subtotal', 'tax', 'total'
+    ).order_by('date')
+    return [_money(row, 'subtotal', 'tax', 'total') for row in rows]
+
+
+def top_products(start=None, end=None, limit=10, by='revenue'):
+    order = '-quantity' if by == 'quantity' else '-revenue'
+    rows = (
+        _dates(DailyProductSales.objects.filter(medicine__isnull=False), start, end)
+        .values('medicine_id', 'medicine__name')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by(order, 'medicine_id')[:limit]
+    )
+    return [
+        _money({'medicine_id': r['medicine_id'], 'name': r['medicine__name'], 'quantity': r['quantity'], 'revenue': r['revenue']}, 'revenue')
+        for r in rows
+    ]
+
+
+def categories(start=None, end=None):
+    rows = (
+        _dates(DailyProductSales.objects.all(), start, end)
+        .values('category_id', 'category__name')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('-revenue', 'category_id')
+    )
+    return [
+        _money({'category_id': r['category_id'], 'name': r['category__name'], 'quantity': r['quantity'], 'revenue': r['revenue']}, 'revenue')
+        for r in rows
+    ]
+
+
+def rebuild(start=None, end=None):
+    """Recompute the aggregates from ``Sale`` / ``SaleItem`` (optionally for a date range).
+
+    Returns ``(days, product_rows)`` written.
+    """
+    from .sales import line_total
+
+    sales_qs = sales_between(start, end)
+    items_qs = SaleItem.objects.filter(sale__in=sales_qs)
+    stats = _dates(DailySalesStats.objects.all(), start, end)
+    products = _dates(DailyProductSales.objects.all(), start, end)
+
+    days = {}
+    for created_at, subtotal, tax, total in sales_qs.values_list('created_at', 'subtotal', 'tax', 'total').iterator():
+        row = days.setdefault(timezone.localdate(created_at), DailySalesStats(date=timezone.localdate(created_at)))
+        row.sales_count += 1
+        row.subtotal += subtotal
+        row.tax += tax
+        row.total += total
+
+    per_product = {}
+    items = items_qs.values_list('sale__created_at', 'product_id', 'product__category_id', 'qty', 'price', 'discount')
+    for created_at, pk, category_id, qty, price, discount in items.iterator():
+        day = timezone.localdate(created_at)
+        days[day].items_sold += qty
+        if pk is None:
+            continue
+        row = per_product.setdefault((day, pk), DailyProductSales(date=day, medicine_id=pk, category_id=category_id, revenue=ZERO))
+        row.quantity += qty
+        row.revenue += line_total(price, discount, qty)
+
+    with transaction.atomic():
+        stats.delete()
+        products.delete()
+        DailySalesStats.objects.bulk_create(days.values(), batch_size=1000)
+        DailyProductSales.objects.bulk_create(per_product.values(), batch_size=1000)
+    return len(days), len(per_product)
@@ -0,0 +1,54 @@
+"""Writing pharmacy sales.
+
+``record_sale`` writes a ``Sale``, its ``SaleItem`` rows and the stock
+decrement with a fixed number of queries however long the basket is. Stock
+is taken through the ledger (``stock.apply``) with one conditional
+``UPDATE``; if any product falls short the whole sale is rejected with
+``InsufficientStock`` (callers run it inside ``transaction.atomic``). The
+daily report aggregates are updated in the same transaction.
+"""
+from collections import Counter
+from decimal import ROUND_HALF_UP, Decimal
+
+from . import reports, stock
+from .models import Sale, SaleItem
+from .stock import InsufficientStock  # noqa: F401 (raised by record_sale)
+
+TAX_RATE = Decimal('0.05')
+CENTS = Decimal('0.01')
+
+
+def money(value):
+    return Decimal(value).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def line_total(price, discount, qty):
+    """Pre-tax total of a line: ``qty`` units at ``price`` less ``discount`` percent."""
+    return money(Decimal(price or 0) * (1 - Decimal(discount or 0) / 100) * qty)
+
+
+def record_sale(lines, created_by=None, **fields):
+    """Create a sale for ``lines`` (``(medicine, qty)`` pairs) and take the stock.
+
+    Must be called inside a transaction so a stock shortfall rolls back the
+    sale rows written before it.
+    """
+    totals = [line_total(medicine.price, medicine.discount, qty) for medicine, qty in lines]
+    subtotal = sum(totals, Decimal('0.00'))
+    tax = money(subtotal * TAX_RATE)
+    sale = Sale.objects.create(subtotal=subtotal, tax=tax, total=subtotal + tax, created_by=created_by, **fields)
+
+    SaleItem.objects.bulk_create([
+        SaleItem(sale=sale, product=medicine, qty=qty, price=medicine.price or 0, discount=medicine.discount or 0)
+        for medicine, qty in lines
+    ])
+    changes = Counter()
+    products = {}
+    for (medicine, qty), revenue in zip(lines, totals):
+        changes[medicine.pk] -= qty
+        sold, earned, _ = products.get(medicine.pk, (0, Decimal('0.00'), None))
+        products[medicine.pk] = (sold + qty, earned + revenue, medicine.category_id)
+    kind = 'dispense' if sale.prescription_id else 'sale'
+    stock.apply(changes, kind, created_by=created_by, sale=sale)
+    reports.record_sale(sale, products)
+    return sale
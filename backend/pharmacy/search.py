@@ -0,0 +1,183 @@
+"""Medicine catalog search with keyset pagination.
+
+Name/brand matching is substring based and is served by an index built
+with ``manage.py build_medicine_search_index``:
+
+* PostgreSQL: ``pg_trgm`` GIN indexes on ``UPPER(name)`` / ``UPPER(brand)``,
+  which serve the ``UPPER(...) LIKE`` that ``icontains`` compiles to.
+* SQLite: an FTS5 table with the trigram tokenizer, kept in sync with
+  ``pharmacy_medicine`` by triggers.
+
+Without the index the same query still works, only slower. Queries shorter
+than a trigram fall back to a name prefix match. Results are ordered by
+``(sort field, id)`` and paged by seeking past the last row, so deep pages
+cost the same as the first one.
+"""
+import base64
+import binascii
+import datetime
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MIN_SUBSTRING = 3
+
+FTS_TABLE = 'pharmacy_medicine_fts'
+
+# sort key -> (field, descending)
+SORTS = {
+    'name': ('name', False),
+    '-name': ('name', True),
+    'price': ('price', False),
+    '-price': ('price', True),
+    'newest': ('created_at', True),
+}
+
+SQLITE_INDEX_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, brand, content='pharmacy_medicine', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON pharmacy_medicine BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, brand) VALUES (new.id, new.name, new.brand); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON pharmacy_medicine BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, brand) VALUES ('delete', old.id, old.name, old.brand); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, brand ON pharmacy_medicine BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, brand) VALUES ('delete', old.id, old.name, old.brand); "
+    f"INSERT INTO {FTS_TABLE}(rowid, name, brand) VALUES (new.id, new.name, new.brand); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+POSTGRES_INDEX_SQL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS medicine_name_trgm_idx ON pharmacy_medicine USING gin (UPPER(name::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS medicine_brand_trgm_idx ON pharmacy_medicine USING gin (UPPER(brand::text) gin_trgm_ops)',
+]
+
+# Only a positive answer is cached: the table can be created while the process runs
+_fts_ready = set()
+
+
+class InvalidParameter(ValueError):
+    pass
+
+
+def build_index():
+    """Create (or refresh) the text index for the current database. Returns the vendor."""
+    statements = {'sqlite': SQLITE_INDEX_SQL, 'postgresql': POSTGRES_INDEX_SQL}.get(connection.vendor)
+    if statements is None:
+        raise NotImplementedError(f'No medicine search index for {connection.vendor}')
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    return connection.vendor
+
+
+def fts_available():
+    if connection.vendor != 'sqlite':
+        return False
+    if connection.alias not in _fts_ready:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone() is None:
+                return False
+        _fts_ready.add(connection.alias)
+    return True
+
+
+def text_filter(query):
+    query = ' '.join(query.split())
+    if len(query) < MIN_SUBSTRING:
+        return Q(name__istartswith=query)
+    if fts_available():
+        phrase = '"' + query.replace('"', '""') + '"'
+        return Q(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [phrase]))
+    return Q(name__icontains=query) | Q(brand__icontains=query)
+
+
+def _decimal(value, name):
+    if value in (None, ''):
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise InvalidParameter(f'{name} must be a number')
+    # NaN and Infinity parse but cannot be compared with prices
+    if not number.is_finite():
+        raise InvalidParameter(f'{name} must be a number')
+    return number
+
+
+def apply_filters(qs, params):
+    """Filter ``qs`` by the search query parameters. Raises ``InvalidParameter``."""
+    query = (params.get('q') or '').strip()
+    if query:
+        qs = qs.filter(text_filter(query))
+
+    category = params.get('category')
+    if category:
+        qs = qs.filter(category_id=category) if category.isdigit() else qs.filter(category__slug=category)
+
+    min_price, max_price = _decimal(params.get('min_price'), 'min_price'), _decimal(params.get('max_price'), 'max_price')
+    if min_price is not None:
+        qs = qs.filter(price__gte=min_price)
+    if max_price is not None:
+        qs = qs.filter(price__lte=max_price)
+    min_discount = _decimal(params.get('min_discount'), 'min_discount')
+    if min_discount is not None:
+        qs = qs.filter(discount__gte=min_discount)
+    if params.get('in_stock') in ('1', 'true', 'yes'):
+        qs = qs.filter(stock_count__gt=0)
+    return qs
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, (datetime.datetime, Decimal)):
+        value = value.isoformat() if isinstance(value, datetime.datetime) else str(value)
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode()
+
+
+def decode_cursor(value, field):
+    try:
+        raw, pk = json.loads(base64.urlsafe_b64decode(value.encode()).decode())
+        if field == 'price':
+            raw = Decimal(raw)
+            if not raw.is_finite():
+                raise ValueError(value)
+        elif field == 'created_at':
+            raw = parse_datetime(raw)
+            if raw is None:
+                raise ValueError(value)
+        return raw, int(pk)
+    except (ValueError, TypeError, InvalidOperation, binascii.Error, UnicodeDecodeError):
+        raise InvalidParameter('Invalid cursor')
+
+
+def parse_limit(value):
+    try:
+        limit = int(value) if value else DEFAULT_LIMIT
+    except (TypeError, ValueError):
+        limit = DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def paginate(qs, sort='name', cursor=None, limit=DEFAULT_LIMIT):
+    """Return ``(rows, next_cursor)`` for one page of a ``values()`` queryset."""
+    if sort not in SORTS:
+        raise InvalidParameter(f"sort must be one of: {', '.join(SORTS)}")
+    field, descending = SORTS[sort]
+    op = 'lt' if descending else 'gt'
+    if cursor:
+        value, pk = decode_cursor(cursor, field)
+        qs = qs.filter(Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk}))
+
+    prefix = '-' if descending else ''
+    rows = list(qs.order_by(f'{prefix}{field}', f'{prefix}id')[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1][field], rows[-1]['id'])
+    return rows, None
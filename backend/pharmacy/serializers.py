@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from .models import MedicineCategory, Medicine
-from .models import Sale, SaleItem
+from .models import Sale, SaleItem, StockMovement
+from core.images import ImageVariantsField
+from core.lean import LeanSerializer
+from . import sales
+from . import stock
 from django.db import transaction
 
 
@@ -17,16 +21,53 @@ class MedicineSerializer(serializers.ModelSerializer):
         queryset=MedicineCategory.objects.all(), source='category', write_only=True, required=False
     )
     image = serializers.ImageField(required=False, allow_null=True, use_url=True)
+    image_variants = ImageVariantsField()
     price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
     discount = serializers.DecimalField(max_digits=5, decimal_places=2, required=False)
 
     class Meta:
         model = Medicine
         fields = (
-            'id', 'name', 'category', 'category_id', 'brand', 'weight_or_volume', 'price', 'discount', 'stock_count', 'image', 'description', 'created_at', 'updated_at'
+            'id', 'name', 'category', 'category_id', 'brand', 'weight_or_volume', 'price', 'discount', 'stock_count', 'reorder_level', 'image', 'image_variants', 'description', 'created_at', 'updated_at'
         )
         read_only_fields = ('id', 'created_at', 'updated_at')
 
+    def validate_stock_count(self, value):
+        if value < 0:
+            raise serializers.ValidationError('Stock cannot be negative')
+        return value
+
+    def _user(self):
+        user = getattr(self.context.get('request'), 'user', None)
+        return user if getattr(user, 'is_authenticated', False) else None
+
+    # Stock edits go through the ledger: opening stock is a receipt, later edits adjustments
+    def create(self, validated_data):
+        count = validated_data.pop('stock_count', 0)
+        with transaction.atomic():
+            medicine = super().create(validated_data)
+            stock.apply({medicine.pk: count}, 'receipt', created_by=self._user(), note='Opening stock')
+        medicine.stock_count = count
+        return medicine
+
+    def update(self, instance, validated_data):
+        count = validated_data.pop('stock_count', None)
+        with transaction.atomic():
+            medicine = super().update(instance, validated_data)
+            if count is not None and count != medicine.stock_count:
+                stock.adjust_to(medicine, count, created_by=self._user(), note='Catalog edit')
+        return medicine
+
+
+MEDICINE_LEAN = LeanSerializer(MedicineSerializer)
+
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockMovement
+        fields = ('id', 'kind', 'quantity', 'balance_after', 'sale', 'note', 'created_by', 'created_at')
+        read_only_fields = fields
+
 
 class SaleItemSerializer(serializers.ModelSerializer):
     product_id = serializers.PrimaryKeyRelatedField(queryset=Medicine.objects.all(), source='product', write_only=True)
@@ -37,6 +78,30 @@ class SaleItemSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'product', 'price', 'discount')
 
 
+class SaleReceiptItemSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source='product.name', read_only=True, default=None)
+    line_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = SaleItem
+        fields = ('id', 'product', 'product_name', 'qty', 'price', 'discount', 'line_total')
+
+    def get_line_total(self, obj):
+        return str(sales.line_total(obj.price, obj.discount, obj.qty))
+
+
+class SaleReceiptSerializer(serializers.ModelSerializer):
+    items = SaleReceiptItemSerializer(many=True, read_only=True)
+    created_by_name = serializers.CharField(source='created_by.name', read_only=True, default=None)
+
+    class Meta:
+        model = Sale
+        fields = (
+            'id', 'customer_name', 'phone', 'payment_method', 'subtotal', 'tax', 'total',
+            'prescription', 'created_by', 'created_by_name', 'created_at', 'items',
+        )
+
+
 class SaleSerializer(serializers.ModelSerializer):
     items = serializers.ListField(child=serializers.DictField(), write_only=True)
     created_by = serializers.ReadOnlyField(source='created_by.id')
@@ -52,42 +117,34 @@ class SaleSerializer(serializers.ModelSerializer):
         return value
 
     def create(self, validated_data):
+        """Write the sale with a fixed number of queries.
+
+        Products are loaded with one ``in_bulk``; ``sales.record_sale``
+        bulk-creates the items and takes the stock in one conditional
+        UPDATE, raising ``sales.InsufficientStock`` on oversell. Callers run
+        this inside ``transaction.atomic``.
+        """
         items = validated_data.pop('items')
         request = self.context.get('request')
         user = getattr(request, 'user', None)
 
-        subtotal = 0
-        # calculate subtotal and prepare item records
-        item_records = []
+        requested = []
         for it in items:
             product_id = it.get('product_id') or it.get('product') or it.get('id')
-            qty = int(it.get('qty', 1))
-            product = None
-            if isinstance(product_id, int):
-                product = Medicine.objects.filter(pk=product_id).first()
-            elif isinstance(product_id, Medicine):
-                product = product_id
+            try:
+                qty = int(it.get('qty', 1))
+            except (TypeError, ValueError):
+                qty = 0
+            if qty < 1:
+                raise serializers.ValidationError({'items': f'Invalid qty for product {product_id}'})
+            requested.append((product_id, qty))
+
+        products = Medicine.objects.in_bulk([pid for pid, _ in requested if isinstance(pid, int)])
+        lines = []
+        for product_id, qty in requested:
+            product = products.get(product_id) if isinstance(product_id, int) else None
             if not product:
                 raise serializers.ValidationError({'items': f'Product not found for id {product_id}'})
-            price = float(product.price or 0)
-            discount = float(product.discount or 0)
-            discounted = price * (1 - (discount or 0) / 100)
-            subtotal += discounted * qty
-            item_records.append({'product': product, 'qty': qty, 'price': price, 'discount': discount})
-
-        tax = round(subtotal * 0.05, 2)
-        total = round(subtotal + tax, 2)
+            lines.append((product, qty))
 
-        with transaction.atomic():
-            sale = Sale.objects.create(subtotal=subtotal, tax=tax, total=total, created_by=user, **validated_data)
-            for rec in item_records:
-                SaleItem.objects.create(sale=sale, product=rec['product'], qty=rec['qty'], price=rec['price'], discount=rec['discount'])
-                # decrement stock if available
-                try:
-                    m = rec['product']
-                    m.stock_count = max(0, (m.stock_count or 0) - rec['qty'])
-                    m.save()
-                except Exception:
-                    pass
-
-        return sale
+        return sales.record_sale(lines, created_by=user, **validated_data)
@@ -0,0 +1,157 @@
+"""Medicine stock ledger.
+
+Every change to ``Medicine.stock_count`` is recorded as a ``StockMovement``
+written in the same transaction. The column itself is only changed by
+atomic ``F()`` increments, so concurrent writers never lose updates, and
+decrements are conditional so stock can not go negative.
+
+``reconcile`` is the periodic safety net (``manage.py reconcile_stock``):
+it compares each medicine's column with the sum of its ledger and reports
+any drift, e.g. from raw SQL or admin edits. The ledger is the source of
+truth, so fixing drift resets the column to the ledger total.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import Medicine, StockMovement
+
+MANUAL_KINDS = ('receipt', 'return', 'adjustment')
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__('Insufficient stock')
+
+
+def apply(changes, kind, created_by=None, sale=None, note=''):
+    """Apply ``{medicine_id: signed quantity}`` and record one movement per medicine.
+
+    Runs three queries whatever the number of medicines: the conditional
+    UPDATE, a read of the new balances and the ledger INSERT. Raises
+    ``InsufficientStock`` when a decrement exceeds the stock; callers run
+    inside ``transaction.atomic`` so nothing is kept in that case.
+    """
+    changes = {pk: qty for pk, qty in changes.items() if qty}
+    if not changes:
+        return []
+
+    # One condition per distinct quantity rather than per medicine keeps large batches cheap to build
+    by_qty = defaultdict(list)
+    for pk, qty in changes.items():
+        by_qty[qty].append(pk)
+    allowed = Q()
+    for qty, pks in by_qty.items():
+        allowed |= Q(pk__in=pks, stock_count__gte=-qty) if qty < 0 else Q(pk__in=pks)
+    now = timezone.now()
+    updated = Medicine.objects.filter(allowed).update(
+        stock_count=Case(*(When(pk__in=pks, then=F('stock_count') + qty) for qty, pks in by_qty.items())),
+        updated_at=now,
+    )
+    if updated != len(changes):
+        available = dict(Medicine.objects.filter(pk__in=changes).values_list('pk', 'stock_count'))
+        raise InsufficientStock([
+            {'product_id': pk, 'requested': -qty, 'available': available.get(pk, 0)}
+            for pk, qty in changes.items()
+            if pk not in available or (qty < 0 and available[pk] < -qty)
+        ])
+
+    # The UPDATE holds the row locks, so these are exactly the balances it produced
+    balances = {
+        pk: (count, name)
+        for pk, count, name in Medicine.objects.filter(pk__in=changes).values_list('pk', 'stock_count', 'name')
+    }
+    return StockMovement.objects.bulk_create([
+        StockMovement(
+            medicine_id=pk, medicine_name=balances[pk][1], kind=kind, quantity=qty, balance_after=balances[pk][0],
+            sale=sale, note=note, created_by=created_by, created_at=now,
+        )
+        for pk, qty in changes.items()
+    ])
+
+
+def record_opening(medicines, created_by=None, note=''):
+    """Record a receipt for the ``stock_count`` of medicines inserted with their stock.
+
+    Only for rows created in the current transaction: nobody else can see
+    them yet, so there is nothing to update and the balance is the count.
+    """
+    now = timezone.now()
+    return StockMovement.objects.bulk_create([
+        StockMovement(
+            medicine_id=m.pk, medicine_name=m.name, kind='receipt', quantity=m.stock_count, balance_after=m.stock_count,
+            note=note, created_by=created_by, created_at=now,
+        )
+        for m in medicines if m.stock_count
+    ])
+
+
+def adjust_to(medicine, count, created_by=None, note=''):
+    """Record an adjustment that sets ``medicine``'s stock to ``count``."""
+    with transaction.atomic():
+        current = Medicine.objects.select_for_update().values_list('stock_count', flat=True).get(pk=medicine.pk)
+        movements = apply({medicine.pk: count - current}, 'adjustment', created_by=created_by, note=note)
+    medicine.stock_count = count
+    return movements
+
+
+def stock_at(medicine_id, when):
+    """Stock of ``medicine_id`` at ``when``, read from the ledger."""
+    balance = (
+        StockMovement.objects.filter(medicine_id=medicine_id, created_at__lte=when)
+        .order_by('-created_at', '-id').values_list('balance_after', flat=True).first()
+    )
+    return balance or 0
+
+
+def low_stock():
+    """Medicines at or below their reorder level, emptiest first (served by a partial index)."""
+    return Medicine.objects.filter(stock_count__lte=F('reorder_level')).order_by('stock_count', 'id')
+
+
+def reconcile(fix=False, batch_size=500):
+    """Compare stock columns with ledger sums and report drift.
+
+    With ``fix`` the column of each drifted medicine is set to its ledger
+    total. A medicine with no movements at all predates the ledger, so its
+    column is recorded as an opening balance instead.
+
+    Each batch of medicines is locked while it is compared, so sales in
+    flight can not show up as drift. Returns a list of
+    ``(medicine_id, stock_count, ledger_total)`` for every mismatch.
+    """
+    drift = []
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            stocks = list(
+                Medicine.objects.select_for_update().filter(pk__gt=last_id)
+                .order_by('pk').values_list('pk', 'stock_count', 'name')[:batch_size]
+            )
+            if not stocks:
+                return drift
+            last_id = stocks[-1][0]
+            totals = dict(
+                StockMovement.objects.filter(medicine_id__in=[pk for pk, _, _ in stocks])
+                .values('medicine_id').annotate(total=Sum('quantity')).values_list('medicine_id', 'total')
+            )
+            batch = [(pk, stock, totals.get(pk, 0)) for pk, stock, _ in stocks if stock != totals.get(pk, 0)]
+            if fix and batch:
+                names = {pk: name for pk, _, name in stocks}
+                StockMovement.objects.bulk_create([
+                    StockMovement(
+                        medicine_id=pk, medicine_name=names[pk], kind='adjustment', quantity=stock,
+                        balance_after=stock, note='Opening balance',
+                    )
+                    for pk, stock, _ in batch if pk not in totals
+                ])
+                corrections = {pk: total for pk, _, total in batch if pk in totals}
+                if corrections:
+                    Medicine.objects.filter(pk__in=corrections).update(
+                        stock_count=Case(*(When(pk=pk, then=Value(total)) for pk, total in corrections.items())),
+                        updated_at=timezone.now(),
+                    )
+            drift.extend(batch)
@@ -0,0 +1,394 @@
+import datetime
+import io
+import json
+
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+
+class SaleCreationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Medicine
+        from core.models import User
+
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        cls.products = [Medicine.objects.create(name=f'Drug {i}', price='0.10', discount='0', stock_count=10) for i in range(5)]
+
+    def sell(self, items):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.pharmacist)
+        return client.post('/api/pharmacy/sales/', {'customer_name': 'Walk-in', 'items': items}, format='json')
+
+    def test_totals_are_exact_and_stock_is_taken(self):
+        response = self.sell([{'product_id': self.products[0].id, 'qty': 3}, {'product_id': self.products[1].id, 'qty': 1}])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual((response.data['sale']['subtotal'], response.data['sale']['tax'], response.data['sale']['total']), ('0.40', '0.02', '0.42'))
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_count, 7)
+
+    def test_oversell_is_rejected_without_writes(self):
+        from .models import Sale
+
+        response = self.sell([{'product_id': self.products[0].id, 'qty': 4}, {'product_id': self.products[0].id, 'qty': 7}])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['shortages'], [{'product_id': self.products[0].id, 'requested': 11, 'available': 10}])
+        self.assertFalse(Sale.objects.exists())
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock_count, 10)
+        self.assertEqual(self.sell([{'product_id': 999999, 'qty': 1}]).status_code, 400)
+
+    def test_query_count_is_constant_in_basket_size(self):
+        counts = []
+        for size in (1, 5):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.sell([{'product_id': p.id, 'qty': 1} for p in self.products[:size]]).status_code, 201)
+            counts.append(len(ctx.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class MedicineSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Medicine, MedicineCategory
+
+        cls.pain = MedicineCategory.objects.create(name='Pain relief', slug='pain-relief')
+        names = [('Paracetamol', 'Calpol', '20.00', 5), ('Paracetamol Forte', None, '35.00', 0),
+                 ('Ibuprofen', 'Brufen', '15.00', 3), ('Aspirin', 'Disprin', '10.00', 8)]
+        cls.medicines = [
+            Medicine.objects.create(name=name, brand=brand, price=price, stock_count=stock, category=cls.pain)
+            for name, brand, price, stock in names
+        ]
+        Medicine.objects.create(name='Cetirizine', price='12.00', stock_count=4)
+
+    def tearDown(self):
+        from . import search
+        search._fts_ready.clear()
+
+    def search(self, **params):
+        from rest_framework.test import APIClient
+
+        response = APIClient().get('/api/pharmacy/products/search/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def names(self, **params):
+        return [row['name'] for row in self.search(**params)['medicines']]
+
+    def test_substring_and_brand_match_with_and_without_index(self):
+        from django.core.management import call_command
+
+        expected = {'q': 'cetam'}, ['Paracetamol', 'Paracetamol Forte']
+        self.assertEqual(self.names(**expected[0]), expected[1])
+        self.assertEqual(self.names(q='brufen'), ['Ibuprofen'])
+
+        call_command('build_medicine_search_index', stdout=io.StringIO())
+        self.assertEqual(self.names(**expected[0]), expected[1])
+        self.assertEqual(self.names(q='BRUF'), ['Ibuprofen'])
+        self.medicines[2].name = 'Ibuprofen Gel'
+        self.medicines[2].save()
+        self.assertEqual(self.names(q='gel'), ['Ibuprofen Gel'])
+        self.assertEqual(self.names(q='as'), ['Aspirin'])
+
+    def test_filters_sort_and_keyset_pages(self):
+        self.assertEqual(self.names(category='pain-relief', in_stock='1', max_price='20', sort='-price'), ['Paracetamol', 'Ibuprofen', 'Aspirin'])
+
+        seen, cursor = [], None
+        while True:
+            page = self.search(sort='price', limit=2, **({'cursor': cursor} if cursor else {}))
+            seen += [row['name'] for row in page['medicines']]
+            cursor = page['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, ['Aspirin', 'Cetirizine', 'Ibuprofen', 'Paracetamol', 'Paracetamol Forte'])
+
+        from rest_framework.test import APIClient
+        self.assertEqual(APIClient().get('/api/pharmacy/products/search/', {'sort': 'bogus'}).status_code, 400)
+        self.assertEqual(APIClient().get('/api/pharmacy/products/search/', {'cursor': 'x'}).status_code, 400)
+        for value in ('NaN', 'Infinity', '-inf', 'sNaN'):
+            self.assertEqual(APIClient().get('/api/pharmacy/products/search/', {'min_price': value}).status_code, 400)
+        from . import search
+        cursor = search.encode_cursor('NaN', 1)
+        self.assertEqual(APIClient().get('/api/pharmacy/products/search/', {'sort': 'price', 'cursor': cursor}).status_code, 400)
+
+
+class MedicineAutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Medicine
+
+        cls.forte = Medicine.objects.create(name='Paracetamol Forte', brand='Calpol', weight_or_volume='650mg')
+        cls.plain = Medicine.objects.create(name='Paracetamol', brand='Crocin', weight_or_volume='500mg')
+        cls.other = Medicine.objects.create(name='Pantoprazole', brand='Pan')
+
+    def setUp(self):
+        from .autocomplete import MedicineIndex
+        self.index = MedicineIndex()
+
+    def suggest(self, prefix, limit=10):
+        return [row['name'] for row in self.index.suggest(prefix, limit)]
+
+    def test_name_starts_rank_before_other_words_and_brands(self):
+        self.assertEqual(self.suggest('para'), ['Paracetamol', 'Paracetamol Forte'])
+        self.assertEqual(self.suggest('pa'), ['Pantoprazole', 'Paracetamol', 'Paracetamol Forte'])
+        self.assertEqual(self.suggest('forte'), ['Paracetamol Forte'])
+        self.assertEqual(self.suggest('cro'), ['Paracetamol'])
+        self.assertEqual(self.suggest('pa', limit=1), ['Pantoprazole'])
+        self.assertEqual(self.suggest(''), [])
+
+    def test_lookups_do_not_query_and_saves_update_the_index(self):
+        self.suggest('p')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('panto'), ['Pantoprazole'])
+
+        self.index.upsert({'id': self.other.id, 'name': 'Pantocid', 'brand': None, 'weight_or_volume': None})
+        self.index.upsert({'id': 999, 'name': 'Amlodipine', 'brand': None, 'weight_or_volume': '5mg'})
+        self.index.discard(self.plain.id)
+        self.assertEqual(self.suggest('pa'), ['Pantocid', 'Paracetamol Forte'])
+        self.assertEqual(self.suggest('aml'), ['Amlodipine'])
+
+    def test_signals_update_the_shared_index_after_commit(self):
+        from rest_framework.test import APIClient
+        from . import autocomplete
+        from .models import Medicine
+
+        autocomplete.index.load()
+        with self.captureOnCommitCallbacks(execute=True):
+            Medicine.objects.create(name='Zinc sulphate')
+        response = APIClient().get('/api/pharmacy/products/autocomplete/', {'q': 'zin'})
+        self.assertEqual([row['name'] for row in response.data['suggestions']], ['Zinc sulphate'])
+
+
+class StockLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from core.models import User
+
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+
+    def client_for(self, user):
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_catalog_edits_and_sales_are_recorded(self):
+        from .models import Medicine, StockMovement
+
+        client = self.client_for(self.pharmacist)
+        created = client.post('/api/pharmacy/products/', {'name': 'Aspirin', 'price': '2.00', 'stock_count': 12}, format='multipart')
+        self.assertEqual(created.status_code, 201, created.data)
+        medicine = Medicine.objects.get(pk=created.data['medicine']['id'])
+        self.assertEqual(client.put(f'/api/pharmacy/products/{medicine.pk}/', {'stock_count': 9}, format='multipart').status_code, 200)
+        self.assertEqual(client.post(f'/api/pharmacy/products/{medicine.pk}/stock/', {'kind': 'receipt', 'quantity': 20}, format='json').status_code, 201)
+        sale = client.post('/api/pharmacy/sales/', {'customer_name': 'Walk-in', 'items': [{'product_id': medicine.pk, 'qty': 4}]}, format='json')
+        self.assertEqual(sale.status_code, 201)
+
+        movements = list(StockMovement.objects.filter(medicine=medicine).order_by('id').values_list('kind', 'quantity', 'balance_after', 'sale_id'))
+        self.assertEqual(movements, [
+            ('receipt', 12, 12, None), ('adjustment', -3, 9, None), ('receipt', 20, 29, None), ('sale', -4, 25, sale.data['sale']['id']),
+        ])
+        medicine.refresh_from_db()
+        self.assertEqual(medicine.stock_count, 25)
+
+        oversell = client.post(f'/api/pharmacy/products/{medicine.pk}/stock/', {'kind': 'adjustment', 'quantity': -26}, format='json')
+        self.assertEqual(oversell.status_code, 409)
+        history = client.get(f'/api/pharmacy/products/{medicine.pk}/stock/', {'limit': 2}).data
+        self.assertEqual([m['kind'] for m in history['movements']], ['sale', 'receipt'])
+
+    def test_stock_at_low_stock_and_reconcile(self):
+        from django.core.management import call_command
+        from django.utils import timezone
+        from . import stock
+        from .models import Medicine, StockMovement
+
+        low = Medicine.objects.create(name='Low', stock_count=2, reorder_level=5)
+        ok = Medicine.objects.create(name='Ok', stock_count=50, reorder_level=5)
+        self.assertEqual([m.pk for m in stock.low_stock()], [low.pk])
+
+        # Rows created outside the ledger are reported, and get an opening balance with --fix
+        out = io.StringIO()
+        call_command('reconcile_stock', stdout=out)
+        self.assertIn('Found 2 medicines', out.getvalue())
+        self.assertFalse(StockMovement.objects.exists())
+        out = io.StringIO()
+        call_command('reconcile_stock', '--fix', stdout=out)
+        self.assertIn('Corrected 2 medicines', out.getvalue())
+        before = timezone.now()
+        with transaction.atomic():
+            stock.apply({ok.pk: -10}, 'sale')
+        self.assertEqual(stock.stock_at(ok.pk, before), 50)
+        self.assertEqual(stock.stock_at(ok.pk, timezone.now()), 40)
+
+        # The ledger wins: drift resets the column instead of writing an adjustment
+        Medicine.objects.filter(pk=ok.pk).update(stock_count=38)
+        movements = StockMovement.objects.count()
+        self.assertEqual(stock.reconcile(), [(ok.pk, 38, 40)])
+        self.assertEqual(Medicine.objects.get(pk=ok.pk).stock_count, 38)
+        stock.reconcile(fix=True)
+        self.assertEqual(Medicine.objects.get(pk=ok.pk).stock_count, 40)
+        self.assertEqual(StockMovement.objects.count(), movements)
+        self.assertEqual(stock.reconcile(), [])
+
+        # Deleting a medicine keeps its history
+        ok.delete()
+        self.assertEqual(
+            list(StockMovement.objects.filter(medicine_name='Ok').values_list('medicine_id', 'quantity')),
+            [(None, 50), (None, -10)],
+        )
+
+
+class SalesHistoryReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Medicine, MedicineCategory
+        from core.models import User
+
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        pain = MedicineCategory.objects.create(name='Pain', slug='pain')
+        cold = MedicineCategory.objects.create(name='Cold', slug='cold')
+        cls.aspirin = Medicine.objects.create(name='Aspirin', price='2.00', stock_count=100, category=pain)
+        cls.syrup = Medicine.objects.create(name='Syrup', price='5.00', discount='10', stock_count=100, category=cold)
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.pharmacist)
+        for items in ([(self.aspirin, 3)], [(self.aspirin, 1), (self.syrup, 2)]):
+            response = self.client.post('/api/pharmacy/sales/', {
+                'customer_name': 'Walk-in', 'items': [{'product_id': m.id, 'qty': q} for m, q in items],
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+
+    def test_history_pages_and_receipt(self):
+        first = self.client.get('/api/pharmacy/sales/', {'limit': 1}).data
+        self.assertEqual([(s['total'], s['item_count']) for s in first['sales']], [('11.55', 2)])
+        second = self.client.get('/api/pharmacy/sales/', {'limit': 1, 'cursor': first['next']}).data
+        self.assertEqual([s['total'] for s in second['sales']], ['6.30'])
+        self.assertIsNone(second['next'])
+
+        with self.assertNumQueries(2):
+            receipt = self.client.get(f"/api/pharmacy/sales/{first['sales'][0]['id']}/").data['sale']
+        self.assertEqual([(i['product_name'], i['qty'], i['line_total']) for i in receipt['items']], [('Aspirin', 1, '2.00'), ('Syrup', 2, '9.00')])
+
+    def test_reports_read_aggregates_and_match_rebuild(self):
+        from django.core.management import call_command
+
+        def snapshot():
+            return (
+                self.client.get('/api/pharmacy/sales/reports/daily/').data['rows'],
+                self.client.get('/api/pharmacy/sales/reports/top-products/', {'by': 'quantity'}).data['rows'],
+                self.client.get('/api/pharmacy/sales/reports/categories/').data['rows'],
+            )
+
+        daily, top, categories = snapshot()
+        self.assertEqual([(r['sales_count'], r['items_sold'], r['total']) for r in daily], [(2, 6, '17.85')])
+        self.assertEqual([(r['name'], r['quantity'], r['revenue']) for r in top], [('Aspirin', 4, '8.00'), ('Syrup', 2, '9.00')])
+        self.assertEqual([(r['name'], r['revenue']) for r in categories], [('Cold', '9.00'), ('Pain', '8.00')])
+
+        call_command('rebuild_sales_reports', stdout=io.StringIO())
+        self.assertEqual(snapshot(), (daily, top, categories))
+        tomorrow = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+        self.assertEqual(self.client.get('/api/pharmacy/sales/reports/daily/', {'from': tomorrow}).data['rows'], [])
+
+
+class MedicineCatalogTransferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from .models import Medicine, MedicineCategory
+        from core.models import User
+
+        cls.pharmacist = User.objects.create_user(email='pharm@example.com', password='pw', name='Pharm', role='pharmacist')
+        cls.pain = MedicineCategory.objects.create(name='Pain', slug='pain')
+        cls.aspirin = Medicine.objects.create(name='Aspirin', brand='Bayer', price='2.00', stock_count=5, category=cls.pain)
+
+    def setUp(self):
+        from rest_framework.test import APIClient
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.pharmacist)
+
+    def _import(self, name, content, **extra):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        upload = SimpleUploadedFile(name, content.encode())
+        return self.client.post('/api/pharmacy/products/import/', {'file': upload, **extra}, format='multipart')
+
+    def test_csv_import_upserts_and_reports_bad_rows(self):
+        from .models import Medicine, StockMovement
+
+        response = self._import('catalog.csv', (
+            'name,brand,category,price,stock_count\n'
+            'Aspirin,Bayer,pain,2.50,8\n'
+            'Cough Syrup,,Cold & Flu,4.00,12\n'
+            ',NoName,Cold & Flu,1.00,1\n'
+            'Zinc,,,abc,-1\n'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['error_count']), (1, 1, 2))
+        self.assertEqual([e['line'] for e in response.data['errors']], [4, 5])
+        self.assertEqual(set(response.data['errors'][1]['errors']), {'price', 'stock_count'})
+
+        self.aspirin.refresh_from_db()
+        self.assertEqual((str(self.aspirin.price), self.aspirin.stock_count), ('2.50', 8))
+        syrup = Medicine.objects.get(name='Cough Syrup')
+        self.assertEqual((syrup.brand, syrup.category.name, syrup.category.slug, syrup.stock_count), (None, 'Cold & Flu', 'cold-flu', 12))
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(note='Catalog import').values_list('kind', 'quantity')),
+            [('adjustment', 3), ('receipt', 12)],
+        )
+
+    def test_non_finite_prices_are_bad_rows(self):
+        response = self._import('catalog.csv', 'name,price,discount\nA,NaN,\nB,Infinity,\nC,1.00,sNaN\nD,1.00,\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['error_count']), (1, 3))
+        self.assertEqual([e['line'] for e in response.data['errors']], [2, 3, 4])
+
+    def test_decode_error_mid_file_keeps_rows_before_it(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .models import Medicine
+
+        content = 'name,price\nGood,1.00\n'.encode() + ('Filler,1.00\n' * 2000).encode() + b'Bad\xff,1.00\n'
+        upload = SimpleUploadedFile('catalog.csv', content)
+        response = self.client.post('/api/pharmacy/products/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['complete'])
+        self.assertEqual(response.data['errors'][-1]['errors'], {'file': 'Not valid UTF-8; the rest of the file was not read'})
+        self.assertTrue(Medicine.objects.filter(name='Good').exists())
+
+        # Nothing readable at all is still rejected outright
+        upload = SimpleUploadedFile('catalog.csv', b'\xffname,price\n')
+        self.assertEqual(self.client.post('/api/pharmacy/products/import/', {'file': upload}, format='multipart').status_code, 400)
+
+    def test_jsonl_import_and_round_trip_through_export(self):
+        response = self._import('catalog.txt', '{"name": "Cough Syrup", "price": 4}\nnot json\n\n', type='jsonl')
+        self.assertEqual((response.data['created'], response.data['error_count']), (1, 1))
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+
+        exported = self.client.get('/api/pharmacy/products/export/')
+        self.assertEqual(exported['Content-Type'], 'text/csv; charset=utf-8')
+        body = b''.join(exported.streaming_content).decode()
+        self.assertEqual(body.splitlines()[:2], [
+            'name,brand,category,weight_or_volume,price,discount,stock_count,reorder_level,description',
+            'Aspirin,Bayer,Pain,,2.00,0.00,5,10,',
+        ])
+        response = self._import('again.csv', body)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['unchanged']), (0, 0, 2))
+
+        self.assertEqual(self.client.get('/api/pharmacy/products/export/', {'max_price': 'Infinity'}).status_code, 400)
+        lines = b''.join(self.client.get('/api/pharmacy/products/export/', {'type': 'jsonl', 'q': 'syr'}).streaming_content).splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Cough Syrup'])
+
+    def test_requires_pharmacist_and_known_format(self):
+        from core.models import User
+
+        self.assertEqual(self._import('catalog.xlsx', 'x').status_code, 400)
+        self.assertEqual(self._import('catalog.csv', 'brand\nBayer\n').data['message'], 'CSV header must include a name column')
+        self.client.force_authenticate(User.objects.create_user(email='c@example.com', password='pw', name='C', role='customer'))
+        self.assertEqual(self._import('catalog.csv', 'name\nX\n').status_code, 403)
+        self.assertEqual(self.client.get('/api/pharmacy/products/export/').status_code, 403)
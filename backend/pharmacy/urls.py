@@ -5,6 +5,16 @@ urlpatterns = [
     path('categories/', views.CategoryListCreateView.as_view(), name='pharmacy-categories'),
     path('categories/<int:pk>/', views.CategoryDetailView.as_view(), name='pharmacy-category-detail'),
     path('products/', views.MedicineListCreateView.as_view(), name='pharmacy-products'),
+    path('products/autocomplete/', views.MedicineAutocompleteView.as_view(), name='pharmacy-product-autocomplete'),
+    path('products/import/', views.MedicineImportView.as_view(), name='pharmacy-product-import'),
+    path('products/export/', views.MedicineExportView.as_view(), name='pharmacy-product-export'),
+    path('products/search/', views.MedicineSearchView.as_view(), name='pharmacy-product-search'),
+    path('products/low-stock/', views.LowStockView.as_view(), name='pharmacy-low-stock'),
+    path('products/<int:pk>/stock/', views.StockMovementView.as_view(), name='pharmacy-product-stock'),
     path('products/<int:pk>/', views.MedicineDetailView.as_view(), name='pharmacy-product-detail'),
-    path('sales/', views.SaleCreateView.as_view(), name='pharmacy-sales'),
+    path('sales/', views.SaleListCreateView.as_view(), name='pharmacy-sales'),
+    path('sales/<int:pk>/', views.SaleDetailView.as_view(), name='pharmacy-sale-detail'),
+    path('sales/reports/daily/', views.SalesReportView.as_view(report='daily'), name='pharmacy-sales-daily'),
+    path('sales/reports/top-products/', views.SalesReportView.as_view(report='top-products'), name='pharmacy-sales-top-products'),
+    path('sales/reports/categories/', views.SalesReportView.as_view(report='categories'), name='pharmacy-sales-categories'),
 ]
@@ -3,15 +3,31 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import MedicineCategory, Medicine
+from .models import MedicineCategory, Medicine, Sale, SaleItem, StockMovement
 from .serializers import MedicineCategorySerializer, MedicineSerializer
-from .serializers import SaleSerializer
+from .serializers import SaleSerializer, SaleReceiptSerializer, StockMovementSerializer
+from .serializers import MEDICINE_LEAN
+from .sales import InsufficientStock
+from . import autocomplete
+from . import catalog
+from . import reports
+from . import search
+from . import stock
+from django.core.files.storage import default_storage
+from django.http import StreamingHttpResponse
+from core import conditional
+from core.idempotency import idempotent
+from core.lean import lean_requested
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.text import slugify
 import logging
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import generics
 from rest_framework import serializers
 from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 
 logger = logging.getLogger(__name__)
 
@@ -56,7 +72,10 @@ class CategoryDetailView(APIView):
         if name:
             cat.name = name
             cat.slug = slugify(name)
-            cat.save()
+            with transaction.atomic():
+                cat.save()
+                # Medicines embed their category; bump them so catalog ETags change
+                cat.medicines.update(updated_at=timezone.now())
 
         return Response({'success': True, 'category': MedicineCategorySerializer(cat).data})
 
@@ -79,8 +98,15 @@ class MedicineListCreateView(APIView):
 
     def get(self, request):
         qs = Medicine.objects.select_related('category').order_by('-created_at')
-        serializer = MedicineSerializer(qs, many=True, context={'request': request})
-        return Response({'success': True, 'medicines': serializer.data})
+        validators, not_modified = conditional.check(request, qs, (MedicineCategory.objects.all(), 'created_at'))
+        if not_modified:
+            return not_modified
+
+        if lean_requested(request):
+            data = MEDICINE_LEAN.serialize(qs, context={'request': request})
+        else:
+            data = MedicineSerializer(qs, many=True, context={'request': request}).data
+        return conditional.finalize(Response({'success': True, 'medicines': data}), validators)
 
     def post(self, request):
         # allow admin, staff, or pharmacist to create medicines
@@ -96,6 +122,112 @@ class MedicineListCreateView(APIView):
         return Response({'success': False, 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MedicineImportView(APIView):
+    """Bulk upsert medicines from an uploaded CSV or JSONL ``file``.
+
+    Rows are matched on name and brand; the format comes from ``type``
+    (csv or jsonl) or the file extension. Invalid rows are skipped and
+    listed by line number in the response. A file that stops being valid
+    UTF-8 part way keeps the rows before that point and responds with
+    ``complete: false``.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request):
+        if getattr(request.user, 'role', None) not in ('admin', 'pharmacist') and not getattr(request.user, 'is_staff', False):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'success': False, 'message': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            fmt = catalog.detect_format(upload.name, request.data.get('type'))
+            result = catalog.import_rows(catalog.read_rows(upload, fmt), created_by=request.user)
+        except (catalog.InvalidFile, UnicodeDecodeError) as e:
+            message = 'File must be UTF-8 encoded' if isinstance(e, UnicodeDecodeError) else str(e)
+            return Response({'success': False, 'message': message}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'success': True, **result.as_dict()})
+
+
+class MedicineExportView(APIView):
+    """Stream the catalog as CSV (default) or JSONL (``type=jsonl``).
+
+    Accepts the catalog search filters (q, category, min_price, ...).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if getattr(request.user, 'role', None) not in ('admin', 'pharmacist') and not getattr(request.user, 'is_staff', False):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        fmt = request.query_params.get('type') or 'csv'
+        if fmt not in catalog.FORMATS:
+            return Response({'success': False, 'message': f"type must be one of: {', '.join(catalog.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            qs = search.apply_filters(Medicine.objects.all(), request.query_params)
+        except search.InvalidParameter as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(catalog.export_rows(fmt, qs), content_type=f'{content_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="medicines.{fmt}"'
+        return response
+
+
+class MedicineSearchView(APIView):
+    """GET: search the catalog for the counter screen.
+
+    Query params: q (name/brand substring), category (id or slug),
+    min_price, max_price, min_discount, in_stock=1, sort (name, -name,
+    price, -price, newest), limit (default 20, max 100) and cursor (the
+    ``next`` value of the previous page). Rows are flat: category name
+    instead of the nested category object.
+    """
+    permission_classes = [AllowAny]
+
+    FIELDS = (
+        'id', 'name', 'brand', 'weight_or_volume', 'price', 'discount', 'stock_count',
+        'image', 'category_id', 'category__name', 'created_at',
+    )
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            qs = search.apply_filters(Medicine.objects.all(), params)
+            rows, next_cursor = search.paginate(
+                qs.values(*self.FIELDS),
+                sort=params.get('sort') or 'name',
+                cursor=params.get('cursor'),
+                limit=search.parse_limit(params.get('limit')),
+            )
+        except search.InvalidParameter as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        for row in rows:
+            row['category_name'] = row.pop('category__name')
+            row['price'] = str(row['price'])
+            row['discount'] = str(row['discount'])
+            row['image'] = request.build_absolute_uri(default_storage.url(row['image'])) if row['image'] else None
+        return Response({'success': True, 'medicines': rows, 'next': next_cursor})
+
+
+class MedicineAutocompleteView(APIView):
+    """GET: medicine name suggestions while a prescription is typed.
+
+    Query params: q (prefix of a name or brand word) and limit (default 10,
+    max 25). Served from the in-process index in ``autocomplete``.
+    """
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            limit = max(1, min(int(request.query_params.get('limit') or 10), 25))
+        except ValueError:
+            limit = 10
+        suggestions = autocomplete.index.suggest(request.query_params.get('q', ''), limit)
+        return Response({'success': True, 'suggestions': suggestions})
+
+
 class MedicineDetailView(APIView):
     permission_classes = [AllowAny]
     parser_classes = (MultiPartParser, FormParser)
@@ -140,9 +272,126 @@ class MedicineDetailView(APIView):
         return Response({'success': True, 'message': 'Medicine deleted'})
 
 
-class SaleCreateView(APIView):
+class LowStockView(APIView):
+    """GET: medicines at or below their reorder level, emptiest first."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if getattr(request.user, 'role', None) not in ('admin', 'pharmacist') and not getattr(request.user, 'is_staff', False):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        rows = stock.low_stock().values('id', 'name', 'brand', 'weight_or_volume', 'stock_count', 'reorder_level')
+        return Response({'success': True, 'medicines': list(rows)})
+
+
+class StockMovementView(APIView):
+    """Stock ledger of one medicine.
+
+    GET: latest movements first (limit, default 50, max 200); with
+    ``at=<ISO datetime>`` the stock at that moment is included.
+    POST: record a receipt, return or adjustment. ``quantity`` is positive
+    for receipts and returns and signed for adjustments.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def _denied(self, request):
+        return getattr(request.user, 'role', None) not in ('admin', 'pharmacist') and not getattr(request.user, 'is_staff', False)
+
+    def get(self, request, pk):
+        if self._denied(request):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        if not Medicine.objects.filter(pk=pk).exists():
+            return Response({'success': False, 'message': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            limit = max(1, min(int(request.query_params.get('limit') or 50), 200))
+        except ValueError:
+            limit = 50
+        movements = StockMovement.objects.filter(medicine_id=pk).order_by('-created_at', '-id')[:limit]
+        data = {'success': True, 'movements': StockMovementSerializer(movements, many=True).data}
+
+        at = request.query_params.get('at')
+        if at:
+            when = parse_datetime(at)
+            if when is None:
+                return Response({'success': False, 'message': 'at must be an ISO datetime'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(when):
+                when = timezone.make_aware(when)
+            data['stock_at'] = stock.stock_at(pk, when)
+        return Response(data)
+
+    def post(self, request, pk):
+        if self._denied(request):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        if not Medicine.objects.filter(pk=pk).exists():
+            return Response({'success': False, 'message': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        kind = request.data.get('kind')
+        if kind not in stock.MANUAL_KINDS:
+            return Response({'success': False, 'message': f"kind must be one of: {', '.join(stock.MANUAL_KINDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            quantity = int(request.data.get('quantity'))
+        except (TypeError, ValueError):
+            quantity = 0
+        if quantity == 0 or (kind != 'adjustment' and quantity < 0):
+            return Response({'success': False, 'message': 'Invalid quantity'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                movement, = stock.apply({pk: quantity}, kind, created_by=request.user, note=str(request.data.get('note', ''))[:255])
+        except InsufficientStock as e:
+            return Response({'success': False, 'message': 'Insufficient stock', 'shortages': e.shortages}, status=status.HTTP_409_CONFLICT)
+        return Response({'success': True, 'movement': StockMovementSerializer(movement).data}, status=status.HTTP_201_CREATED)
+
+
+class SaleListCreateView(APIView):
+    """GET: sales history, newest first. POST: record a sale; retries with
+    the same ``Idempotency-Key`` header get the original response back.
+
+    GET query params: from / to (sale dates, YYYY-MM-DD), payment_method,
+    customer (name substring), limit (default 20, max 100) and cursor (the
+    ``next`` value of the previous page).
+    """
     permission_classes = [IsAuthenticated]
 
+    FIELDS = (
+        'id', 'customer_name', 'phone', 'payment_method', 'subtotal', 'tax', 'total',
+        'created_by', 'prescription', 'created_at', 'item_count',
+    )
+
+    def get(self, request):
+        role = getattr(request.user, 'role', None)
+        if role not in ('pharmacist', 'admin') and not getattr(request.user, 'is_staff', False):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        params = request.query_params
+        try:
+            start, end = reports.parse_range(params)
+        except ValueError:
+            return Response({'success': False, 'message': 'Dates must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+        qs = reports.sales_between(start, end)
+        if params.get('payment_method'):
+            qs = qs.filter(payment_method=params['payment_method'])
+        if params.get('customer'):
+            qs = qs.filter(customer_name__icontains=params['customer'])
+
+        # item_count comes from a correlated subquery so the keyset query needs no GROUP BY
+        item_count = SaleItem.objects.filter(sale=OuterRef('pk')).order_by().values('sale').annotate(n=Count('id')).values('n')
+        try:
+            rows, next_cursor = search.paginate(
+                qs.annotate(item_count=Coalesce(Subquery(item_count), 0)).values(*self.FIELDS),
+                sort='newest',
+                cursor=params.get('cursor'),
+                limit=search.parse_limit(params.get('limit')),
+            )
+        except search.InvalidParameter as e:
+            return Response({'success': False, 'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        for row in rows:
+            for field in ('subtotal', 'tax', 'total'):
+                row[field] = str(row[field])
+        return Response({'success': True, 'sales': rows, 'next': next_cursor})
+
+    @idempotent
     def post(self, request):
         # only pharmacists or staff/admin can create sales
         role = getattr(request.user, 'role', None)
@@ -156,9 +405,63 @@ class SaleCreateView(APIView):
                     sale = serializer.save()
             except serializers.ValidationError as e:
                 return Response({'success': False, 'errors': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+            except InsufficientStock as e:
+                return Response({'success': False, 'message': 'Insufficient stock', 'shortages': e.shortages}, status=status.HTTP_409_CONFLICT)
             # re-serialize the saved instance to include calculated fields
             from .serializers import SaleSerializer as _SaleSerializer
             out = _SaleSerializer(sale, context={'request': request}).data
             return Response({'success': True, 'sale': out}, status=status.HTTP_201_CREATED)
 
         return Response({'success': False, 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SaleDetailView(APIView):
+    """GET: one sale with its items, for reprinting the receipt."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        role = getattr(request.user, 'role', None)
+        if role not in ('pharmacist', 'admin') and not getattr(request.user, 'is_staff', False):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        sale = (
+            Sale.objects.select_related('created_by')
+            .prefetch_related(Prefetch('items', queryset=SaleItem.objects.select_related('product').order_by('id')))
+            .filter(pk=pk).first()
+        )
+        if sale is None:
+            return Response({'success': False, 'message': 'Sale not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'success': True, 'sale': SaleReceiptSerializer(sale).data})
+
+
+class SalesReportView(APIView):
+    """GET: sales reports read from the daily aggregates.
+
+    ``report`` is 'daily' (totals per day), 'top-products' (by revenue, or
+    by quantity with ``by=quantity``; ``limit`` default 10) or 'categories'
+    (revenue per category). All take from / to dates (YYYY-MM-DD).
+    """
+    permission_classes = [IsAuthenticated]
+    report = None
+
+    def get(self, request):
+        role = getattr(request.user, 'role', None)
+        if role not in ('pharmacist', 'admin') and not getattr(request.user, 'is_staff', False):
+            return Response({'success': False, 'message': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            start, end = reports.parse_range(request.query_params)
+        except ValueError:
+            return Response({'success': False, 'message': 'Dates must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if self.report == 'daily':
+            rows = reports.daily(start, end)
+        elif self.report == 'top-products':
+            try:
+                limit = max(1, min(int(request.query_params.get('limit') or 10), 100))
+            except ValueError:
+                limit = 10
+            rows = reports.top_products(start, end, limit, by=request.query_params.get('by') or 'revenue')
+        else:
+            rows = reports.categories(start, end)
+        return Response({'success': True, 'report': self.report, 'rows': rows})